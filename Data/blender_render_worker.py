@@ -0,0 +1,464 @@
+# Headless worker of SetUp/render_dataset.py, runs inside Blender:
+#   blender -b Data/2025-Coral/ImagesGeneratorCoral.blend --python Data/blender_render_worker.py -- <arguments>
+#
+# It has two jobs:
+#   --plan      Writes the polygon filtered (x, y, rotation) grid of the field of view plane to a plan file,
+#               in the same order the blender_render_script_*.py scripts render it. With --budget the grid
+#               is sampled adaptively instead (see plan_adaptive)
+#   --indices   Renders the listed plan entries to <output>/Images/render_<index>.jpg
+#   --camera    Writes the scene camera to a camera file of RaspberryPiCode/projection_estimation.py
+#
+# The image of an entry is always named after its index in the plan, so any number of workers
+# can render any subset of the plan and the images stay consistently indexed.
+import argparse
+import heapq
+import json
+import math
+import os
+import sys
+import time
+from matplotlib import path                 # For point-in-polygon detection
+from matplotlib.transforms import Bbox
+import bpy                                  # Blender's Python API
+import mathutils                            # Blender-specific vector math
+import numpy as np
+
+# The adaptive sampler measures bounding boxes in pixels of an image resized to
+# this width, the resolution SetUp/process_blender_data.py processes the renders at
+PROCESSING_WIDTH = 1280
+
+
+def parse_arguments():
+    """ Blender passes the arguments after "--" on to the script. """
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="blender -b <file.blend> --python blender_render_worker.py --")
+    parser.add_argument("--plan", default=None, help="The plan file (JSON) to write or to render from")
+    parser.add_argument("--camera", default=None, help="Write the scene camera (and the --object's height) to this camera file")
+    parser.add_argument("--object", default=None, help="The game piece object (e.g. RING, CONE, CORAL), written to a new plan")
+    parser.add_argument("--plane", default="Plane", help="The field of view plane object")
+    parser.add_argument("--step", type=float, default=0.05, help="Grid step in Blender units")
+    parser.add_argument("--rotation-step", type=int, default=5, help="Rotation step in degrees")
+    parser.add_argument("--rotation-range", type=int, default=0, help="Rotations rendered per position (360 Cone, 180 Coral, 0 no rotation)")
+    parser.add_argument("--budget", type=int, default=None, help="Sample adaptively, rendering at most this many images")
+    parser.add_argument("--tolerance", type=float, default=0.005, help="Largest position error (Blender units) of interpolating between adaptive samples")
+    parser.add_argument("--levels", type=int, default=3, help="The adaptive grid starts 2^levels steps wide")
+    parser.add_argument("--indices", default=None, help="A file with the plan indices to render, one per line")
+    parser.add_argument("--output", default=None, help="The dataset folder, the images go to <output>/Images")
+    parser.add_argument("--engine", default="EEVEE", help="EEVEE (fast), CYCLES or WORKBENCH, the .blend's engine with KEEP")
+    parser.add_argument("--samples", type=int, default=8, help="Render samples, only the silhouette of the game piece is used")
+    parser.add_argument("--resolution", type=int, nargs=2, default=None, help="Render resolution, the .blend's resolution if not given")
+    return parser.parse_args(argv)
+
+
+def find_vertices_positions(fov_plane):
+    """
+    Retrieve the world-space (x, y) positions of the plane's corners.
+
+    Returns:
+        list: Polygon defined by reordered vertex coordinates.
+    """
+    polygon = []
+    for vertex in fov_plane.data.vertices:
+        vector3d = fov_plane.matrix_world @ vertex.co
+        polygon.append((vector3d.x, vector3d.y))
+
+    # Reorder to correct winding order (if necessary)
+    tmp1, tmp2, tmp3, tmp4 = polygon[:4]
+    return [tmp1, tmp2, tmp4, tmp3]
+
+
+def plan_grid(polygon, step_length, rotation_step_length, rotation_range):
+    """
+    Every (x, y[, rotation]) of the grid inside the polygon, in the order of the
+    blender_render_script_*.py scripts so that existing datasets keep their indices.
+    """
+    polygon_path = path.Path(polygon)
+    min_x, min_y = np.min(polygon, axis=0)
+    max_x, max_y = np.max(polygon, axis=0)
+    rotations = list(range(0, rotation_range, rotation_step_length))
+
+    positions = []
+    for x in np.arange(min_x, max_x, step_length):
+        for y in np.arange(min_y, max_y, step_length):
+            if not polygon_path.contains_points([(x, y)]):
+                continue
+            if rotations:
+                positions.extend([float(x), float(y), rotation] for rotation in rotations)
+            else:
+                positions.append([float(x), float(y)])
+    return positions
+
+
+class BoundingBoxProjector:
+    """
+    Computes the bounding rectangle of the game piece in the rendered image for
+    any pose without rendering, by projecting its mesh through the scene camera.
+
+    Attributes
+    ----------
+    vertices : np.ndarray
+        The (N, 4) homogeneous vertices of the game piece in object space
+
+    projection : np.ndarray
+        The 4x4 world to clip space matrix of the scene camera
+
+    Methods
+    -------
+    bounding_box(x: float, y: float, rotation: float) -> np.ndarray
+        The (center x, center y, width, height) of the game piece in pixels
+    """
+
+    def __init__(self, target_obj, scene):
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        mesh = target_obj.evaluated_get(depsgraph).to_mesh()
+        coordinates = np.empty(len(mesh.vertices) * 3)
+        mesh.vertices.foreach_get("co", coordinates)
+        self.vertices = np.column_stack((coordinates.reshape(-1, 3), np.ones(len(mesh.vertices))))
+        target_obj.evaluated_get(depsgraph).to_mesh_clear()
+
+        self.target_obj = target_obj
+        self.width = scene.render.resolution_x
+        self.height = scene.render.resolution_y
+        self.scale = PROCESSING_WIDTH / self.width
+        camera = scene.camera
+        camera_matrix = camera.calc_matrix_camera(depsgraph, x=self.width, y=self.height,
+                                                  scale_x=scene.render.pixel_aspect_x, scale_y=scene.render.pixel_aspect_y)
+        self.projection = np.array(camera_matrix @ camera.matrix_world.inverted())
+
+    def bounding_box(self, x, y, rotation):
+        """ The (center x, center y, width, height) of the game piece at a pose, in processed image pixels. """
+        euler = self.target_obj.rotation_euler.copy()
+        euler.z = math.radians(rotation)
+        location = mathutils.Vector((x, y, self.target_obj.location.z))
+        world = np.array(mathutils.Matrix.LocRotScale(location, euler, self.target_obj.scale))
+
+        clip = self.vertices @ (self.projection @ world).T
+        clip = clip[clip[:, 3] > 0]  # Vertices behind the camera
+        if len(clip) == 0:
+            return np.zeros(4)
+        pixels_x = np.clip((clip[:, 0] / clip[:, 3] + 1) / 2 * self.width, 0, self.width) * self.scale
+        pixels_y = np.clip((1 - clip[:, 1] / clip[:, 3]) / 2 * self.height, 0, self.height) * self.scale
+        left, right, top, bottom = pixels_x.min(), pixels_x.max(), pixels_y.min(), pixels_y.max()
+        return np.array([(left + right) / 2, (top + bottom) / 2, right - left, bottom - top])
+
+
+def interpolation_residuals(boxes, stride):
+    """
+    The difference between the bounding boxes of a full turn of fine rotations and
+    the linear interpolation between every stride-th of them, the turn wrapping around
+    """
+    count = len(boxes)
+    index = np.arange(count)
+    low = index // stride * stride
+    high = np.minimum(low + stride, count)
+    t = ((index - low) / (high - low))[:, None]
+    return boxes - ((1 - t) * boxes[low] + t * boxes[high % count])
+
+
+def position_error(jacobian, residuals):
+    """
+    How far (in Blender units) the position found for a bounding box is off when
+    the box is off by the residuals, through the (4, 2) change of the bounding box
+    per unit of x and y
+    """
+    return float(np.abs(residuals @ np.linalg.pinv(jacobian).T).max())
+
+
+def plan_adaptive(polygon, projector, args):
+    """
+    Samples the field of view adaptively, like a quadtree over the uniform grid
+
+    The estimator interpolates between the rendered samples, so a cell only needs
+    its corners where the bounding box changes about linearly over it. The grid
+    starts 2^levels steps wide and a cell is split in four while the bounding boxes
+    at the middle of its edges and at its center (projected, not rendered) differ
+    from the interpolation of its corners by more than the tolerance, measured as
+    the position error the difference causes. The position error keeps the
+    accuracy the same near and far: close to the camera the bounding box changes
+    fast and not linearly, far from it a pixel is a long way. Cells are split down
+    to the uniform grid step, and cells on the edge of the polygon are split to it
+    so that the whole field of view stays covered, the budget must cover them and
+    the coarse grid (ValueError if it does not). The other cells are split worst
+    first, until none is left or the next split would exceed the render budget.
+
+    The rotation step of every position is chosen the same way, the largest
+    multiple of rotation_step (by powers of two) that interpolates the bounding
+    boxes of the skipped rotations within the tolerance.
+
+    Returns:
+        list: The (x, y[, rotation]) positions, sorted like the uniform grid
+    """
+    polygon_path = path.Path(polygon)
+    min_x, min_y = np.min(polygon, axis=0)
+    max_x, max_y = np.max(polygon, axis=0)
+    size = 2 ** args.levels
+    # The points of the uniform grid, the cells cover them and may reach past them
+    grid_columns = len(np.arange(min_x, max_x, args.step))
+    grid_rows = len(np.arange(min_y, max_y, args.step))
+    columns = int(math.ceil(grid_columns / size)) * size
+    rows = int(math.ceil(grid_rows / size)) * size
+
+    # The cells are checked at a few rotations, a rotated piece changes differently
+    if args.rotation_range:
+        check_rotations = sorted({round(args.rotation_range * i / 4 / args.rotation_step) * args.rotation_step for i in range(4)})
+        fine_rotations = list(range(0, args.rotation_range, args.rotation_step))
+    else:
+        check_rotations = [0]
+    strides = [2 ** k for k in range(8) if 2 ** k * args.rotation_step <= max(args.rotation_range // 4, args.rotation_step)]
+
+    def boxes_at(column, row):
+        x, y = min_x + column * args.step, min_y + row * args.step
+        return np.array([projector.bounding_box(x, y, rotation) for rotation in check_rotations])
+
+    samples = {}  # (column, row) of the uniform grid -> sample, None outside the polygon
+    rendered = 0
+
+    def sample(column, row):
+        """ Measures a grid point once: its bounding boxes and the rotations to render. """
+        nonlocal rendered
+        if (column, row) in samples:
+            return samples[(column, row)]
+        x, y = min_x + column * args.step, min_y + row * args.step
+        if column >= grid_columns or row >= grid_rows or not polygon_path.contains_points([(x, y)]):
+            samples[(column, row)] = None
+            return None
+        rotations = [None]
+        if args.rotation_range:
+            fine = np.array([projector.bounding_box(x, y, rotation) for rotation in fine_rotations])
+            jacobian = np.column_stack(((projector.bounding_box(x + args.step, y, 0) - projector.bounding_box(x - args.step, y, 0)),
+                                        (projector.bounding_box(x, y + args.step, 0) - projector.bounding_box(x, y - args.step, 0)))) / (2 * args.step)
+            stride = next(stride for stride in reversed(strides)
+                          if stride == 1 or position_error(jacobian, interpolation_residuals(fine, stride)) <= args.tolerance)
+            rotations = fine_rotations[::stride]
+        samples[(column, row)] = (float(x), float(y), boxes_at(column, row), rotations)
+        rendered += len(rotations)
+        return samples[(column, row)]
+
+    def cell_error(column, row, width):
+        """ The largest interpolation error inside the cell, None if it needs no split, inf on the polygon's edge. """
+        if width == 1:
+            return None
+        corners = [sample(column + dx, row + dy) for dx, dy in ((0, 0), (width, 0), (0, width), (width, width))]
+        inside = [corner for corner in corners if corner is not None]
+        if len(inside) < 4:
+            # On the edge of the polygon
+            if inside or polygon_path.intersects_bbox(Bbox.from_bounds(min_x + column * args.step, min_y + row * args.step,
+                                                                       width * args.step, width * args.step)):
+                return math.inf
+            return None
+
+        half = width // 2
+        boxes = [corner[2] for corner in corners]
+        # (rotation, 4, 2) change of the bounding boxes per unit of x and y over the cell
+        jacobians = np.stack(((boxes[1] - boxes[0] + boxes[3] - boxes[2]),
+                              (boxes[2] - boxes[0] + boxes[3] - boxes[1])), axis=2) / (2 * width * args.step)
+        error = 0.0
+        for u, v in ((1, 0), (0, 1), (1, 2), (2, 1), (1, 1)):
+            s, t = u / 2, v / 2
+            interpolated = (1 - s) * (1 - t) * boxes[0] + s * (1 - t) * boxes[1] + (1 - s) * t * boxes[2] + s * t * boxes[3]
+            residuals = boxes_at(column + u * half, row + v * half) - interpolated
+            for jacobian, residual in zip(jacobians, residuals):
+                error = max(error, position_error(jacobian, residual))
+        return error if error > args.tolerance else None
+
+    def queue(column, row, width):
+        """ Queues a cell to split, an edge cell to the edge pass and the others by their error. """
+        error = cell_error(column, row, width)
+        if error == math.inf and edges is not None:
+            edges.append((column, row, width))
+        elif error is not None:
+            heapq.heappush(cells, (-error, column, row, width))
+
+    def split_points(column, row, width):
+        """ The grid points a split of the cell adds, the middle of its edges and its center. """
+        half = width // 2
+        return [point for point in ((column + half, row), (column + width, row + half), (column + half, row + width),
+                                    (column, row + half), (column + half, row + half)) if point not in samples]
+
+    cells, edges = [], []
+    for column in range(0, columns, size):
+        for row in range(0, rows, size):
+            queue(column, row, size)
+    print(f"Coarse grid: {rendered} renders")
+
+    # The edge cells are split down to the uniform grid step whatever their error, so
+    # they come first and the budget must cover them
+    while edges:
+        column, row, width = edges.pop()
+        for point in split_points(column, row, width):
+            sample(*point)
+        half = width // 2
+        for dx in (0, half):
+            for dy in (0, half):
+                queue(column + dx, row + dy, half)
+    # Edge cells found later (inside a concave polygon) are split first, within the budget
+    edges = None
+    print(f"Coarse grid and polygon edges: {rendered} renders")
+    if rendered > args.budget:
+        raise ValueError(f"The coarse grid and the polygon edges alone need {rendered} renders, over the budget of {args.budget}: "
+                         f"raise --budget, or use a larger --step or more --levels")
+
+    while cells:
+        _, column, row, width = heapq.heappop(cells)
+        new_points = split_points(column, row, width)
+        before = rendered
+        for point in new_points:
+            sample(*point)
+        if rendered > args.budget:
+            # Undo the split that went over the budget
+            for point in new_points:
+                samples.pop(point)
+            rendered = before
+            print(f"Stopped at the render budget, {len(cells) + 1} cells could still be split")
+            break
+        half = width // 2
+        for dx in (0, half):
+            for dy in (0, half):
+                queue(column + dx, row + dy, half)
+
+    positions = []
+    for column, row in sorted(key for key, point in samples.items() if point is not None):
+        x, y, _, rotations = samples[(column, row)]
+        if rotations == [None]:
+            positions.append([x, y])
+        else:
+            positions.extend([x, y, rotation] for rotation in rotations)
+    return positions
+
+
+def write_plan(args):
+    """ Writes the uniform (or adaptive) grid of the .blend's field of view plane to the plan file. """
+    polygon = find_vertices_positions(bpy.data.objects[args.plane])
+    if args.budget is None:
+        positions = plan_grid(polygon, args.step, args.rotation_step, args.rotation_range)
+    else:
+        projector = BoundingBoxProjector(bpy.data.objects[args.object], bpy.context.scene)
+        positions = plan_adaptive(polygon, projector, args)
+    plan = {
+        "object": args.object,
+        "polygon": [[float(x), float(y)] for x, y in polygon],
+        "step": args.step,
+        "rotation_step": args.rotation_step,
+        "rotation_range": args.rotation_range,
+        "budget": args.budget,
+        "tolerance": args.tolerance if args.budget is not None else None,
+        "levels": args.levels if args.budget is not None else None,
+        "positions": positions,
+    }
+    with open(args.plan + ".tmp", "w") as file:
+        json.dump(plan, file)
+    os.replace(args.plan + ".tmp", args.plan)
+    print(f"Planned {len(positions)} renders")
+
+
+def set_up_renderer(args):
+    """ Chooses a cheap render setup, the dataset only needs the outline of the red game piece. """
+    scene = bpy.context.scene
+    engine = args.engine.upper()
+    if engine == "EEVEE":
+        # Blender 4.2 - 4.5 call it BLENDER_EEVEE_NEXT, older and newer versions BLENDER_EEVEE
+        engines = scene.render.bl_rna.properties["engine"].enum_items.keys()
+        scene.render.engine = "BLENDER_EEVEE_NEXT" if "BLENDER_EEVEE_NEXT" in engines else "BLENDER_EEVEE"
+        scene.eevee.taa_render_samples = args.samples
+    elif engine == "CYCLES":
+        scene.render.engine = "CYCLES"
+        scene.cycles.samples = args.samples
+        scene.cycles.use_denoising = False
+    elif engine == "WORKBENCH":
+        scene.render.engine = "BLENDER_WORKBENCH"
+    elif engine != "KEEP":
+        raise ValueError(f"Unknown render engine {args.engine}")
+
+    if args.resolution is not None:
+        scene.render.resolution_x, scene.render.resolution_y = args.resolution
+        scene.render.resolution_percentage = 100
+    scene.render.use_compositing = False
+    scene.render.use_sequencer = False
+    scene.render.image_settings.file_format = "JPEG"
+
+
+def render_indices(args):
+    """ Renders the plan entries listed in the indices file, skipping the ones already rendered. """
+    with open(args.plan, "r") as file:
+        plan = json.load(file)
+    with open(args.indices, "r") as file:
+        indices = [int(line) for line in file if line.strip()]
+
+    target_obj = bpy.data.objects[plan["object"]]
+    images_folder = os.path.join(args.output, "Images")
+    os.makedirs(images_folder, exist_ok=True)
+    set_up_renderer(args)
+
+    start_time = time.time()
+    for done, index in enumerate(indices, 1):
+        image_path = os.path.join(images_folder, f"render_{index}.jpg")
+        if os.path.exists(image_path):
+            continue
+
+        position = plan["positions"][index]
+        target_obj.location = mathutils.Vector((position[0], position[1], target_obj.location.z))
+        if len(position) > 2:
+            target_obj.rotation_euler.z = math.radians(position[2])
+
+        # Render next to the final name and rename, so an interrupted worker never
+        # leaves a half written image that a rerun would take as rendered
+        temporary_path = os.path.join(images_folder, f"render_{index}.tmp.jpg")
+        bpy.context.scene.render.filepath = temporary_path
+        bpy.ops.render.render(write_still=True)
+        os.replace(temporary_path, image_path)
+        print(f"Rendered {index} ({done}/{len(indices)}, {round((time.time() - start_time) / done, 2)}s per render)")
+
+
+def write_camera(args):
+    """
+    Writes the intrinsics and the pose of the scene camera in OpenCV's convention,
+    for images of the given (or the .blend's) resolution
+    """
+    scene = bpy.context.scene
+    camera = scene.camera
+    if args.resolution is not None:
+        width, height = args.resolution
+    else:
+        width = round(scene.render.resolution_x * scene.render.resolution_percentage / 100)
+        height = round(scene.render.resolution_y * scene.render.resolution_percentage / 100)
+
+    # The sensor size applies to the image width, or its larger side when fitted automatically
+    sensor_fit = camera.data.sensor_fit
+    if sensor_fit == "VERTICAL" or (sensor_fit == "AUTO" and height > width):
+        sensor_pixels = height
+        sensor_size = camera.data.sensor_height if sensor_fit == "VERTICAL" else camera.data.sensor_width
+    else:
+        sensor_pixels = width
+        sensor_size = camera.data.sensor_width
+    focal_length = camera.data.lens / sensor_size * sensor_pixels
+    shift_pixels = max(width, height)
+    camera_matrix = [[focal_length, 0, width / 2 - camera.data.shift_x * shift_pixels],
+                     [0, focal_length, height / 2 + camera.data.shift_y * shift_pixels],
+                     [0, 0, 1]]
+
+    # Blender cameras look down their -z with y up, OpenCV cameras down their z with y down
+    world = np.array(camera.matrix_world)
+    rotation = world[:3, :3] / np.linalg.norm(world[:3, :3], axis=0) @ np.diag([1, -1, -1])
+    piece = bpy.data.objects[args.object] if args.object is not None else None
+    piece_height = piece.dimensions.z if piece is not None else 0.0
+    piece_width = max(piece.dimensions.x, piece.dimensions.y) if piece is not None else 0.0
+    with open(args.camera, "w") as file:
+        json.dump({
+            "resolution": [width, height],
+            "camera_matrix": camera_matrix,
+            "distortion": [0, 0, 0, 0, 0],
+            "rotation": rotation.tolist(),
+            "position": world[:3, 3].tolist(),
+            "piece_height": piece_height,
+            "piece_width": piece_width,
+        }, file, indent=4)
+    print("Wrote the camera to", args.camera)
+
+
+args = parse_arguments()
+if args.camera is not None:
+    write_camera(args)
+elif args.indices is None:
+    write_plan(args)
+else:
+    render_indices(args)
@@ -0,0 +1,452 @@
+# Offline benchmark of the detection and estimation stages
+# Replays the testing images and synthetic frames without a camera or NetworkTables,
+# and measures accuracy by leaving rows out of the datasets
+#
+# Usage (from the repository root):
+#   python RaspberryPiCode/benchmark.py
+#   python RaspberryPiCode/benchmark.py --repeat 20 --synthetic 500 --output results.json
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from dataset import load_dataset, columns_to_array
+from debug_stream import STREAM_NICENESS, DebugOverlay
+from game_piece_detection import ColorDetection
+from game_piece_pos_estimation import GamePiecePosEstimator
+from lookup_table import fit_lut
+from projection_estimation import fit_camera
+from regression_model import fit_model
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RESOLUTION = (1280, 720)
+
+# Testing images, the dataset rendered for the same game piece and its color bounds
+BENCHMARK_SETS = [
+    {
+        "name": "2024-Note",
+        "images": "TestingImages/2024-Ring",
+        "dataset": "Data/2024-Note/FullData.csv",
+        "piece_height": 0.05,
+        "lower_bound": np.array([9, 35, 0]),
+        "upper_bound": np.array([31, 255, 255]),
+    },
+    {
+        "name": "2023-Cone",
+        "images": "TestingImages/2023-Cone",
+        "dataset": "Data/2023-Cone/FullData.csv",
+        "piece_height": 0.0,
+        "lower_bound": np.array([6, 140, 85]),
+        "upper_bound": np.array([27, 255, 255]),
+    },
+]
+
+# Non symmetrical game pieces without testing images, only their leave-out accuracy
+# (including the yaw) is measured
+ORIENTED_SETS = [
+    {
+        "name": "2025-Coral",
+        "dataset": "Data/2025-Coral/FullData.csv",
+        "piece_height": 0.0,
+    },
+]
+
+# ColorDetection options compared on the testing images and synthetic frames
+DETECTION_MODES = {
+    "full": {},
+    "pyramid_2": {"pyramid_scale": 2},
+    "pyramid_4": {"pyramid_scale": 4},
+    "lut_5": {"lut_bits": 5},
+    "lut_6": {"lut_bits": 6},
+}
+
+# Estimation methods compared by the accuracy benchmark, each builds an estimator
+# from the training rows (and benchmark set) and returns a function estimating one rectangle
+ESTIMATION_METHODS = {
+    "tolerance": lambda data, _: GamePiecePosEstimator(RESOLUTION[0], RESOLUTION[1], data).estimate_position,
+    "knn": lambda data, _: GamePiecePosEstimator(RESOLUTION[0], RESOLUTION[1], data, method="knn").estimate_position,
+    "model": lambda data, _: GamePiecePosEstimator(RESOLUTION[0], RESOLUTION[1], None, model=fit_model(data)).estimate_position,
+    "lut": lambda data, _: GamePiecePosEstimator(RESOLUTION[0], RESOLUTION[1], None, lut=fit_lut(data)).estimate_position,
+    "projection": lambda data, benchmark_set: fit_camera(data, benchmark_set["piece_height"], RESOLUTION[0], RESOLUTION[1]).estimate_position,
+}
+
+
+def latency_stats(samples : list[float]) -> dict[str, float]:
+    """ The p50/p95/p99 and mean of a list of durations, in milliseconds. """
+    if not samples:
+        return {}
+    samples = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"mean_ms": float(samples.mean()), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def peak_memory_mb() -> float | None:
+    """ The peak resident memory of this process, None where it is not available. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def load_frames(folder : str) -> list[np.ndarray]:
+    """ Loads every image in a folder, resized to the pipeline resolution. """
+    frames = []
+    for filename in sorted(os.listdir(folder)):
+        image = cv2.imread(os.path.join(folder, filename))
+        if image is not None:
+            frames.append(cv2.resize(image, RESOLUTION))
+    return frames
+
+
+def synthetic_frames(data : np.ndarray, count : int, seed : int = 0) -> tuple[list[np.ndarray], np.ndarray]:
+    """
+    Draws frames with one orange game piece at the rectangle of random dataset rows
+
+    Returns
+    -------
+    tuple[list[np.ndarray], np.ndarray]
+        The frames and the (x_position, y_position) ground truth of each frame
+    """
+    rng = np.random.default_rng(seed)
+    rows = data[rng.integers(len(data), size=count)]
+    frames = []
+    for row in rows:
+        # Gray noise (no saturation) so that only the game piece passes the color filter
+        noise = rng.integers(40, 90, size=(RESOLUTION[1], RESOLUTION[0], 1), dtype=np.uint8)
+        frame = np.repeat(noise, 3, axis=2)
+        center = (int(row['Center_X']), int(row['Center_Y']))
+        axes = (max(int(row['Width']) // 2, 1), max(int(row['Height']) // 2, 1))
+        cv2.ellipse(frame, center, axes, 0, 0, 360, (0, 140, 255), -1)
+        frames.append(frame)
+    return frames, columns_to_array(rows, ['x_position', 'y_position'])
+
+
+def moving_frames(data : np.ndarray, count : int, seed : int = 0) -> list[np.ndarray]:
+    """ Draws a game piece sliding across the frame, the case tracking mode is meant for. """
+    rng = np.random.default_rng(seed)
+    row = data[rng.integers(len(data))]
+    axes = (max(int(row['Width']) // 2, 1), max(int(row['Height']) // 2, 1))
+    start = np.array([axes[0], RESOLUTION[1] // 3])
+    end = np.array([RESOLUTION[0] - axes[0], 2 * RESOLUTION[1] // 3])
+    frames = []
+    for i in range(count):
+        noise = rng.integers(40, 90, size=(RESOLUTION[1], RESOLUTION[0], 1), dtype=np.uint8)
+        frame = np.repeat(noise, 3, axis=2)
+        center = start + (end - start) * i // max(count - 1, 1)
+        cv2.ellipse(frame, (int(center[0]), int(center[1])), axes, 0, 0, 360, (0, 140, 255), -1)
+        frames.append(frame)
+    return frames
+
+
+def error_stats(errors : list[float]) -> dict[str, float]:
+    """ The mean, median and p95 of position errors in meters. """
+    errors = np.asarray(errors)
+    return {"mean": float(errors.mean()), "p50": float(np.median(errors)), "p95": float(np.percentile(errors, 95))}
+
+
+def benchmark_threshold(frames : list[np.ndarray], lower_bound : np.ndarray, upper_bound : np.ndarray, repeat : int) -> dict:
+    """ Times the lookup table thresholding against cvtColor and inRange, and how many pixels they disagree on. """
+    reference = ColorDetection(lower_bound, upper_bound)
+    result = {}
+    for bits in (0, 5, 6):
+        detector = ColorDetection(lower_bound, upper_bound, lut_bits=bits)
+        times, mismatched = [], 0
+        for _ in range(repeat):
+            for frame in frames:
+                t0 = time.perf_counter()
+                mask = detector.threshold(frame)
+                times.append(time.perf_counter() - t0)
+                mismatched += np.count_nonzero(mask != reference.threshold(frame))
+        build_start = time.perf_counter()
+        detector.set_bounds(lower_bound, upper_bound)
+        entry = {"latency": latency_stats(times), "build_s": time.perf_counter() - build_start,
+                 "mismatched_pixels": mismatched / (repeat * sum(frame.shape[0] * frame.shape[1] for frame in frames))}
+        result["inrange" if bits == 0 else f"lut_{bits}"] = entry
+    return result
+
+
+def benchmark_cache(data : np.ndarray, count : int, frames_per_piece : int = 30, seed : int = 0) -> dict:
+    """
+    Estimates stationary game pieces, every piece is seen for a number of frames
+    with a pixel of detection jitter, with and without the estimator's cache (exact
+    rectangles, and rectangles rounded to 2 pixels)
+    """
+    rng = np.random.default_rng(seed)
+    rows = data[rng.integers(len(data), size=count)]
+    rects = []
+    for row in rows:
+        rect = np.array([row['Center_X'] - row['Width'] // 2, row['Center_Y'] - row['Height'] // 2, row['Width'], row['Height']], dtype=np.int64)
+        rects += [rect + rng.integers(-1, 2, size=4) for _ in range(frames_per_piece)]
+
+    result = {}
+    reference = None
+    for name, options in (("uncached", {}), ("cached", {"cache_size": 256}), ("cached_bucket_2", {"cache_size": 256, "cache_bucket": 2})):
+        estimator = GamePiecePosEstimator(RESOLUTION[0], RESOLUTION[1], data, **options)
+        times, positions = [], []
+        for rect in rects:
+            t0 = time.perf_counter()
+            positions.append(estimator.estimate_positions(rect[None])[0])
+            times.append(time.perf_counter() - t0)
+        result[name] = {"latency": latency_stats(times)}
+        if reference is None:
+            reference = np.array(positions)
+        else:
+            total = estimator.cache_hits + estimator.cache_misses
+            result[name]["hit_rate"] = estimator.cache_hits / total if total else 0.0
+            # The bucket answers nearby rectangles with the first one's position
+            result[name]["max_difference_m"] = float(np.nanmax(np.hypot(*(np.array(positions)[:, :2] - reference[:, :2]).T)))
+    return result
+
+
+def benchmark_pipeline(frames : list[np.ndarray], detector : ColorDetection, estimator : GamePiecePosEstimator,
+                       repeat : int, truth : np.ndarray | None = None) -> dict:
+    """ Runs detection and estimation over the frames, timing both stages. """
+    detection_times, estimation_times = [], []
+    detected = estimated = 0
+    errors = []
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for i, frame in enumerate(frames):
+            t0 = time.perf_counter()
+            rects = detector.detect_color(frame)
+            t1 = time.perf_counter()
+            positions = estimator.estimate_positions(rects)
+            t2 = time.perf_counter()
+            detection_times.append(t1 - t0)
+            estimation_times.append(t2 - t1)
+
+            detected += len(rects) > 0
+            if len(positions) and not np.isnan(positions[0, 0]):
+                estimated += 1
+                if truth is not None:
+                    errors.append(np.hypot(*(positions[0, :2] - truth[i])))
+    elapsed = time.perf_counter() - start
+
+    total = repeat * len(frames)
+    result = {
+        "frames": total,
+        "fps": total / elapsed if elapsed > 0 else 0.0,
+        "detected_rate": detected / total if total else 0.0,
+        "estimated_rate": estimated / total if total else 0.0,
+        "detection": latency_stats(detection_times),
+        "estimation": latency_stats(estimation_times),
+    }
+    if truth is not None and errors:
+        result["error_m"] = error_stats(errors)
+    return result
+
+
+def benchmark_allocations(frames : list[np.ndarray], detector : ColorDetection, warmup : int = 5) -> dict:
+    """
+    Measures the memory the detection allocates (and frees) per frame after a few
+    warm up frames, the peak above what was allocated before the frame, in kilobytes
+    """
+    for frame in frames[:warmup]:
+        detector.detect_color(frame)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for frame in frames:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            detector.detect_color(frame)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    peaks = np.asarray(peaks) / 1024
+    return {"mean_kb": float(peaks.mean()), "max_kb": float(peaks.max())}
+
+
+def stream_worker(frames : list[np.ndarray], rects : np.ndarray, positions : np.ndarray, fps : int, cores : list[int] | None, stop, results):
+    """ Renders debug stream images at the stream rate, like main.debug_stream_process, until stopped. """
+    if hasattr(os, "nice"):
+        os.nice(STREAM_NICENESS)
+    if cores:
+        os.sched_setaffinity(0, cores)
+    cv2.setNumThreads(1)
+    overlay = DebugOverlay(RESOLUTION)
+    overlay.render(frames[0], rects, positions)  # The first text drawing loads the font
+    period = 1.0 / fps
+    times = []
+    while not stop.wait(period):
+        t0 = time.perf_counter()
+        overlay.render(frames[len(times) % len(frames)], rects, positions)
+        times.append(time.perf_counter() - t0)
+    results.put(times)
+
+
+def benchmark_debug_stream(frames : list[np.ndarray], detector : ColorDetection, estimator : GamePiecePosEstimator, fps : int = 15) -> dict:
+    """
+    Runs the pipeline alone and while a debug stream process renders overlays, and
+    reports what the stream adds to the detection and estimation p50/p95/p99.
+    Even niced, a stream on the pipeline's core delays it (mostly in the p95/p99),
+    it only leaves the latencies alone on a core of its own. With two cores or more
+    the pipeline and the stream are pinned to different ones, like the debug_stream
+    "cores" setting of main, with one core they share it
+    """
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    pipeline_cores = stream_cores = None
+    if len(available) > 1:
+        pipeline_cores, stream_cores = available[:1], available[-1:]
+        os.sched_setaffinity(0, pipeline_cores)
+    else:
+        print("No spare core for the debug stream, it shares the pipeline's core")
+
+    try:
+        result = {"alone": benchmark_pipeline(frames, detector, estimator, 1)}
+        rects = detector.detect_color(frames[0])
+        positions = np.nan_to_num(estimator.estimate_positions(rects))
+
+        stop, results = mp.Event(), mp.Queue()
+        worker = mp.Process(target=stream_worker, args=(frames[:8], rects, positions, fps, stream_cores, stop, results))
+        worker.start()
+        try:
+            result["with_stream"] = benchmark_pipeline(frames, detector, estimator, 1)
+        finally:
+            stop.set()
+            times = results.get()
+            worker.join()
+    finally:
+        if pipeline_cores is not None:
+            os.sched_setaffinity(0, available)
+
+    result["stream"] = {"frames": len(times), "latency": latency_stats(times)}
+    result["cores"] = {"pipeline": pipeline_cores, "stream": stream_cores}
+    # The tail percentiles show the stream first, the p50 barely moves
+    result["added_by_stream"] = {stage: {key: result["with_stream"][stage][key] - result["alone"][stage][key] for key in ("p50_ms", "p95_ms", "p99_ms")}
+                                 for stage in ("detection", "estimation")}
+    return result
+
+
+def benchmark_accuracy(data : np.ndarray, method : str, holdout : float, benchmark_set : dict, seed : int = 0) -> dict:
+    """
+    Leave-out evaluation: rows are removed from the dataset, the estimator is built
+    from the rest and asked for the position of every removed row's rectangle
+    (with its image angle when the dataset has one, the yaw error is then measured too)
+    """
+    rng = np.random.default_rng(seed)
+    held_out = rng.random(len(data)) < holdout
+    train, test = np.ascontiguousarray(data[~held_out]), data[held_out]
+
+    build_start = time.perf_counter()
+    estimate = ESTIMATION_METHODS[method](train, benchmark_set)
+    build_time = time.perf_counter() - build_start
+
+    truth = columns_to_array(test, ['x_position', 'y_position'])
+    features = columns_to_array(test, ['Center_X', 'Center_Y', 'Width', 'Height']).astype(np.int64)
+    oriented = all(name in test.dtype.names for name in ('Image_angle', 'angle'))
+    angles = columns_to_array(test, ['Image_angle', 'angle']) if oriented else np.full((len(test), 2), np.nan)
+    yaw_period = 180 if oriented and test['angle'].max() < 180 else 360
+    errors, yaw_errors, times = [], [], []
+    for (center_x, center_y, width, height), expected, (image_angle, yaw) in zip(features, truth, angles):
+        # The dataset stores the center as x + w // 2, so this recovers the original rectangle
+        rect = np.array([center_x - width // 2, center_y - height // 2, width, height] + ([image_angle] if oriented else []))
+        t0 = time.perf_counter()
+        position = estimate(rect)
+        times.append(time.perf_counter() - t0)
+        if position is not None and not np.isnan(position[0]):
+            errors.append(np.hypot(position[0] - expected[0], position[1] - expected[1]))
+            if len(position) == 4:
+                yaw_errors.append(abs((position[2] - yaw + yaw_period / 2) % yaw_period - yaw_period / 2))
+
+    result = {
+        "method": method,
+        "test_rows": int(len(test)),
+        "build_s": build_time,
+        "match_rate": len(errors) / len(test) if len(test) else 0.0,
+        "latency": latency_stats(times),
+    }
+    if errors:
+        result["error_m"] = error_stats(errors)
+    if yaw_errors:
+        result["yaw_error_deg"] = error_stats(yaw_errors)
+    return result
+
+
+def print_result(title : str, result : dict, indent : int = 0):
+    """ Prints a nested result dictionary. """
+    padding = "  " * indent
+    print(padding + title)
+    for key, value in result.items():
+        if isinstance(value, dict):
+            print_result(key, value, indent + 1)
+        elif isinstance(value, float):
+            print(f"{padding}  {key}: {value:.4f}")
+        else:
+            print(f"{padding}  {key}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark game piece detection and position estimation offline")
+    parser.add_argument("--repeat", type=int, default=10, help="Times every testing image is replayed")
+    parser.add_argument("--synthetic", type=int, default=200, help="Number of synthetic frames per dataset")
+    parser.add_argument("--holdout", type=float, default=0.1, help="Fraction of dataset rows left out for the accuracy test")
+    parser.add_argument("--detection", nargs="+", default=list(DETECTION_MODES), choices=list(DETECTION_MODES),
+                        help="Detection modes to compare")
+    parser.add_argument("--methods", nargs="+", default=list(ESTIMATION_METHODS), choices=list(ESTIMATION_METHODS),
+                        help="Estimation methods to evaluate")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    for benchmark_set in BENCHMARK_SETS:
+        name = benchmark_set["name"]
+        data = load_dataset(benchmark_set["dataset"])
+        estimator = GamePiecePosEstimator(RESOLUTION[0], RESOLUTION[1], data)
+
+        set_results = {}
+        images = load_frames(benchmark_set["images"])
+        synthetic, truth = synthetic_frames(data, args.synthetic) if args.synthetic > 0 else ([], None)
+        if images:
+            set_results["threshold"] = benchmark_threshold(images, benchmark_set["lower_bound"], benchmark_set["upper_bound"], args.repeat)
+        for mode in args.detection:
+            detector = ColorDetection(benchmark_set["lower_bound"], benchmark_set["upper_bound"], resolution=RESOLUTION, **DETECTION_MODES[mode])
+            if images:
+                set_results["testing_images_" + mode] = benchmark_pipeline(images, detector, estimator, args.repeat)
+                set_results["testing_images_" + mode]["detection_allocated"] = benchmark_allocations(images, detector)
+            if synthetic:
+                set_results["synthetic_" + mode] = benchmark_pipeline(synthetic, detector, estimator, 1, truth)
+                set_results["synthetic_" + mode]["detection_allocated"] = benchmark_allocations(synthetic, detector)
+        if args.synthetic > 0:
+            # Full frame search against tracking mode on a game piece moving between frames
+            frames = moving_frames(data, args.synthetic)
+            detector = ColorDetection(benchmark_set["lower_bound"], benchmark_set["upper_bound"], resolution=RESOLUTION)
+            set_results["moving"] = benchmark_pipeline(frames, detector, estimator, 1)
+            tracker = ColorDetection(benchmark_set["lower_bound"], benchmark_set["upper_bound"], tracking=True, resolution=RESOLUTION)
+            set_results["moving_tracking"] = benchmark_pipeline(frames, tracker, estimator, 1)
+            set_results["stationary_cache"] = benchmark_cache(data, max(args.synthetic // 10, 1))
+            set_results["debug_stream"] = benchmark_debug_stream(frames, detector, estimator)
+        for method in args.methods:
+            set_results["accuracy_" + method] = benchmark_accuracy(data, method, args.holdout, benchmark_set)
+
+        results[name] = set_results
+        print_result(name, set_results)
+
+    for benchmark_set in ORIENTED_SETS:
+        data = load_dataset(benchmark_set["dataset"])
+        # The projection estimator and the lookup table only handle symmetrical game pieces
+        set_results = {"accuracy_" + method: benchmark_accuracy(data, method, args.holdout, benchmark_set)
+                       for method in args.methods if method not in ("projection", "lut")}
+        results[benchmark_set["name"]] = set_results
+        print_result(benchmark_set["name"], set_results)
+
+    results["peak_memory_mb"] = peak_memory_mb()
+    print("peak_memory_mb:", results["peak_memory_mb"])
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
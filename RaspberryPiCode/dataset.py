@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import numpy as np
+
+# The datasets were processed by different notebooks, these columns are renamed
+# so that every dataset has the same schema (2025 Coral uses x_center etc.)
+COLUMN_ALIASES = {
+    'x_center': 'Center_X',
+    'y_center': 'Center_Y',
+    'width': 'Width',
+    'height': 'Height',
+    'Angle': 'Image_angle',
+}
+
+# Column types in the binary format, every other column is float32
+COLUMN_TYPES = {
+    'Image': np.int32,
+    'x_position': np.float64,
+    'y_position': np.float64,
+}
+
+# Binary dataset format: magic, format version, JSON header length, the JSON header
+# (columns, row count and metadata) padded to DATA_ALIGNMENT, then the records
+DATASET_EXTENSION = ".gpd"
+MAGIC = b"GPDS"
+FORMAT_VERSION = 1
+DATA_ALIGNMENT = 64
+
+
+def cache_path(csv_path : str) -> str:
+    """ The binary dataset stored next to a dataset CSV, e.g. FullData.csv -> FullData.gpd """
+    return os.path.splitext(csv_path)[0] + DATASET_EXTENSION
+
+
+def normalize_columns(names : list[str]) -> list[str]:
+    """ Renames the columns of older datasets to the common schema (see COLUMN_ALIASES). """
+    return [COLUMN_ALIASES.get(name, name) for name in names]
+
+
+def read_csv(csv_path : str) -> np.ndarray:
+    """
+    Reads a dataset CSV into a structured array without using pandas
+
+    Parameters
+    ----------
+    csv_path : str
+        The dataset, e.g. Data/2024-Note/FullData.csv
+
+    Returns
+    -------
+    np.ndarray
+        One record per row with one field per CSV column, named after the common
+        schema and typed as in COLUMN_TYPES (float32 otherwise)
+    """
+    data = np.atleast_1d(np.genfromtxt(csv_path, delimiter=',', names=True, dtype=np.float64))
+    names = normalize_columns(list(data.dtype.names))
+    dtype = np.dtype([(name, COLUMN_TYPES.get(name, np.float32)) for name in names])
+    records = np.empty(len(data), dtype=dtype)
+    for source, name in zip(data.dtype.names, names):
+        records[name] = data[source]
+    return records
+
+
+def write_binary(path : str, data : np.ndarray, metadata : dict | None = None):
+    """
+    Saves a dataset in the binary format
+
+    Parameters
+    ----------
+    path : str
+        The file to write, e.g. Data/2024-Note/FullData.gpd
+    data : np.ndarray
+        The structured array of records
+    metadata : dict | None
+        Information about how the dataset was made, e.g. "game_piece", "resolution",
+        "hsv_lower", "hsv_upper" and "grid_step"
+    """
+    header = {
+        "version": FORMAT_VERSION,
+        "rows": int(len(data)),
+        "columns": [[name, np.dtype(data.dtype.fields[name][0]).str] for name in data.dtype.names],
+        "metadata": metadata or {},
+    }
+    encoded = json.dumps(header).encode("utf-8")
+    prefix_size = len(MAGIC) + 8
+    padding = -(prefix_size + len(encoded)) % DATA_ALIGNMENT
+    encoded += b" " * padding
+
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        file.write(np.array([FORMAT_VERSION, len(encoded)], dtype="<u4").tobytes())
+        file.write(encoded)
+        file.write(np.ascontiguousarray(data).tobytes())
+
+
+def read_header(path : str) -> tuple[dict, int]:
+    """ Reads the JSON header of a binary dataset and the offset its records start at. """
+    with open(path, "rb") as file:
+        magic = file.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary dataset")
+        version, header_size = np.frombuffer(file.read(8), dtype="<u4")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{path} uses dataset format version {version}, this code reads up to {FORMAT_VERSION}")
+        header = json.loads(file.read(int(header_size)).decode("utf-8"))
+    return header, len(MAGIC) + 8 + int(header_size)
+
+
+def load_binary(path : str) -> np.ndarray:
+    """ Memory maps the records of a binary dataset, only the pages that are used are read. """
+    header, offset = read_header(path)
+    dtype = np.dtype([(name, type_string) for name, type_string in header["columns"]])
+    if header["rows"] == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(header["rows"],))
+
+
+def load_metadata(path : str) -> dict:
+    """ The metadata of a dataset, given either the binary file or the CSV it was converted from. """
+    if not path.endswith(DATASET_EXTENSION):
+        path = cache_path(path)
+    if not os.path.exists(path):
+        return {}
+    return read_header(path)[0]["metadata"]
+
+
+def convert_csv(csv_path : str, output_path : str | None = None, metadata : dict | None = None) -> str:
+    """
+    Converts a dataset CSV to the binary format
+
+    Parameters
+    ----------
+    csv_path : str
+        The dataset, e.g. Data/2024-Note/FullData.csv
+    output_path : str | None
+        The binary file, next to the CSV by default
+    metadata : dict | None
+        Stored in the header, the metadata of an earlier conversion is kept if not given
+
+    Returns
+    -------
+    str
+        The path of the binary file
+    """
+    output_path = output_path or cache_path(csv_path)
+    if metadata is None:
+        metadata = load_metadata(output_path)
+    data = read_csv(csv_path)
+    write_binary(output_path, data, metadata)
+    return output_path
+
+
+def load_dataset(path : str, use_cache : bool = True) -> np.ndarray:
+    """
+    Loads a dataset as a structured array, which GamePiecePosEstimator
+    accepts in place of a pandas DataFrame.
+
+    A CSV is converted once to the binary format next to it and later loads
+    memory map the binary file directly, unless the CSV has changed since.
+
+    Parameters
+    ----------
+    path : str
+        The dataset CSV (e.g. Data/2024-Note/FullData.csv) or binary file (.gpd)
+    use_cache : bool
+        Whether to read and write the binary file of a CSV
+
+    Returns
+    -------
+    np.ndarray
+        One record per row with one field per column, in the common schema
+    """
+    if path.endswith(DATASET_EXTENSION):
+        return load_binary(path)
+    if not use_cache:
+        return read_csv(path)
+
+    binary_path = cache_path(path)
+    if not os.path.exists(binary_path) or os.path.getmtime(binary_path) < os.path.getmtime(path):
+        convert_csv(path, binary_path)
+    return load_binary(binary_path)
+
+
+def column_names(data) -> list[str]:
+    """ The column names of a structured array or a pandas DataFrame. """
+    if isinstance(data, np.ndarray):
+        return list(data.dtype.names)
+    return list(data.columns)
+
+
+def columns_to_array(data, columns : list[str], dtype=np.float64) -> np.ndarray:
+    """ Stacks the given columns of a structured array or a DataFrame into an (N, len(columns)) array. """
+    return np.column_stack([np.asarray(data[column], dtype=dtype) for column in columns])
+
+
+if __name__ == "__main__":
+    # Usage: python dataset.py Data/2024-Note/FullData.csv --game-piece Note --grid-step 0.05
+    parser = argparse.ArgumentParser(description="Convert a dataset CSV to the binary dataset format")
+    parser.add_argument("csv", help="The dataset CSV, e.g. Data/2024-Note/FullData.csv")
+    parser.add_argument("--output", help="The binary file, next to the CSV by default")
+    parser.add_argument("--game-piece", help="The game piece, the name of the CSV's folder by default")
+    parser.add_argument("--resolution", type=int, nargs=2, default=(1280, 720), help="The resolution the renders were processed at")
+    parser.add_argument("--hsv-lower", type=int, nargs=3, default=(0, 20, 25), help="Lower HSV bound used to process the renders")
+    parser.add_argument("--hsv-upper", type=int, nargs=3, default=(30, 255, 255), help="Upper HSV bound used to process the renders")
+    parser.add_argument("--grid-step", type=float, help="The distance between two rendered positions, in meters")
+    args = parser.parse_args()
+
+    metadata = {
+        "game_piece": args.game_piece or os.path.basename(os.path.dirname(os.path.abspath(args.csv))),
+        "resolution": list(args.resolution),
+        "hsv_lower": list(args.hsv_lower),
+        "hsv_upper": list(args.hsv_upper),
+        "grid_step": args.grid_step,
+        "source": os.path.basename(args.csv),
+    }
+    output_path = convert_csv(args.csv, args.output, metadata)
+    data = load_binary(output_path)
+    print("Wrote", len(data), "rows with columns", ", ".join(data.dtype.names), "to", output_path)
@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+
+# Niceness of the debug stream process, it only gets the CPU time the pipeline leaves over
+STREAM_NICENESS = 10
+
+class DebugOverlay:
+    """
+    Draws the detected game pieces and their estimated positions on a downscaled
+    copy of a camera frame, for the debug video stream.
+
+    The stream image is preallocated once, `downscale` resizes a frame straight
+    into it so the (shared) frame is only read for as long as the resize takes,
+    and `draw` annotates it afterwards.
+
+    Attributes
+    ----------
+    resolution : tuple[int, int]
+        The (width, height) of the camera frames
+
+    stream_resolution : tuple[int, int]
+        The (width, height) of the stream image
+
+    image : np.ndarray
+        The stream image, overwritten by every `downscale`
+
+    Methods
+    -------
+    downscale(frame: np.ndarray) -> np.ndarray
+        Resizes a frame into the stream image and returns it
+    draw(rects: np.ndarray, positions: np.ndarray) -> np.ndarray
+        Draws the rectangles (in frame pixels) and their positions on the stream image
+    render(frame: np.ndarray, rects: np.ndarray, positions: np.ndarray) -> np.ndarray
+        Downscales a frame and draws the game pieces on it
+    """
+
+    BOX_COLOR = (0, 255, 0)
+    TEXT_COLOR = (255, 255, 255)
+
+    def __init__(self, resolution : tuple[int, int], stream_resolution : tuple[int, int] = (640, 480)):
+        self.resolution = tuple(resolution)
+        self.stream_resolution = tuple(stream_resolution)
+        self.image = np.zeros((self.stream_resolution[1], self.stream_resolution[0], 3), dtype=np.uint8)
+        self.scale = np.array([self.stream_resolution[0] / self.resolution[0], self.stream_resolution[1] / self.resolution[1]] * 2)
+
+    def downscale(self, frame : np.ndarray) -> np.ndarray:
+        """ Resizes a frame into the stream image and returns it. """
+        cv2.resize(frame, self.stream_resolution, dst=self.image, interpolation=cv2.INTER_NEAREST)
+        return self.image
+
+    def draw(self, rects : np.ndarray, positions : np.ndarray) -> np.ndarray:
+        """
+        Draws the rectangles and their positions on the stream image
+
+        Parameters
+        ----------
+        rects : np.ndarray
+            An (N, 4) array of (x, y, w, h) rectangles, in frame pixels
+        positions : np.ndarray
+            The (N, 3) (x, y, certainty) or (N, 4) (x, y, yaw, certainty) positions of the
+            rectangles, a NaN yaw is not drawn
+        """
+        for rect, position in zip(rects, positions):
+            x, y, w, h = (np.asarray(rect) * self.scale).astype(int)
+            cv2.rectangle(self.image, (x, y), (x + w, y + h), self.BOX_COLOR, 2)
+            label = f"{position[0]:.2f}, {position[1]:.2f} m"
+            if len(position) == 4 and not np.isnan(position[2]):
+                label += f", {position[2]:.0f} deg"
+            cv2.putText(self.image, label, (x, max(y - 6, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.45, self.TEXT_COLOR, 1, cv2.LINE_AA)
+        return self.image
+
+    def render(self, frame : np.ndarray, rects : np.ndarray, positions : np.ndarray) -> np.ndarray:
+        """ Downscales a frame and draws the game pieces on it. """
+        self.downscale(frame)
+        return self.draw(rects, positions)
@@ -1,13 +1,219 @@
+import os
+import sys
+import threading
 import time
 import cv2
+import numpy as np
+
+def store_frame(frame : np.ndarray, out : np.ndarray):
+    """ Copies a frame into a preallocated buffer, resizing it if the resolution differs. """
+    if frame is out:
+        return
+    if frame.shape == out.shape:
+        np.copyto(out, frame)
+    else:
+        cv2.resize(frame, (out.shape[1], out.shape[0]), dst=out)
+
+
+class CameraSource:
+    """
+    A frame source reading from a camera device.
+    Attributes
+    ----------
+    camera_id : int | str
+        The camera index or device path (e.g. "/dev/video0")
+
+    Methods
+    -------
+    read(out: np.ndarray) -> float | None
+        Reads the next frame into the buffer, returns when it was captured
+    reopen()
+        Closes and opens the camera again (e.g. after it was unplugged)
+    release()
+        Closes the camera
+    """
+
+    def __init__(self, camera_id : int | str, camera_resolution : tuple[int, int], target_fps : int):
+        self.camera_id = camera_id
+        self.camera_resolution = camera_resolution
+        self.target_fps = target_fps
+        print("Initializing camera with ID:", camera_id)
+        self.open()
+
+    def open(self):
+        """ Opens the camera with the requested resolution, rate and MJPG format. """
+        self.cap = cv2.VideoCapture(self.camera_id, self.default_backend())
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.camera_resolution[0])
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.camera_resolution[1])
+        self.cap.set(cv2.CAP_PROP_FPS, self.target_fps)
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc('M','J','P','G'))
+
+    def reopen(self):
+        """ Closes and opens the camera again, e.g. after it was unplugged and plugged back in. """
+        print("Reopening camera with ID:", self.camera_id)
+        self.cap.release()
+        self.open()
+
+    @staticmethod
+    def default_backend() -> int:
+        """ DirectShow on Windows, V4L2 on Linux (e.g. the Raspberry Pi), otherwise let OpenCV choose. """
+        if sys.platform.startswith("win"):
+            return cv2.CAP_DSHOW
+        if sys.platform.startswith("linux"):
+            return cv2.CAP_V4L2
+        return cv2.CAP_ANY
+
+    def read(self, out : np.ndarray) -> float | None:
+        """
+        Reads the next frame into the buffer, blocks until the camera delivers it.
+        Returns the time (time.time()) the frame was received, before it is decoded,
+        None if the camera delivered no frame
+        """
+        if not self.cap.grab():
+            return None
+        timestamp = time.time()
+        ret, frame = self.cap.retrieve(out)
+        if not ret:
+            return None
+        # The backend may still allocate a new frame (e.g. a different
+        # resolution than requested), copy it into the buffer then
+        store_frame(frame, out)
+        return timestamp
+
+    def release(self):
+        self.cap.release()
+
+
+class VideoFileSource:
+    """
+    A frame source replaying a video file at a fixed rate.
+    Attributes
+    ----------
+    path : str
+        The video file
+
+    fps : float
+        The replay rate, the file's own rate is used if not given
+
+    loop : bool
+        Whether to start over at the end of the file
+
+    Methods
+    -------
+    read(out: np.ndarray) -> float | None
+        Reads the next frame into the buffer, returns None at the end of the file
+    release()
+        Closes the file
+    """
+
+    def __init__(self, path : str, fps : float | None = None, loop : bool = True):
+        self.path = path
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        self.fps = fps or self.cap.get(cv2.CAP_PROP_FPS) or 30
+        self.next_frame_time = time.perf_counter()
+
+    def wait_for_next_frame(self):
+        """ Sleeps until the next frame is due, so the file replays like a live camera. """
+        delay = self.next_frame_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame_time = max(self.next_frame_time, time.perf_counter() - 1 / self.fps) + 1 / self.fps
+
+    def read(self, out : np.ndarray) -> float | None:
+        """ Reads the next frame into the buffer, returns the time it was due (its capture time). """
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        if not ret:
+            return None
+        store_frame(frame, out)
+        self.wait_for_next_frame()
+        return time.time()
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageDirectorySource(VideoFileSource):
+    """
+    A frame source replaying the images of a folder (e.g. TestingImages/2024-Ring) at a fixed rate.
+    Attributes
+    ----------
+    path : str
+        The image folder
+
+    fps : float
+        The replay rate
+
+    loop : bool
+        Whether to start over after the last image
+
+    Methods
+    -------
+    read(out: np.ndarray) -> float | None
+        Reads the next image into the buffer, returns None after the last one
+    release()
+        Nothing to close, kept for the same interface as the other sources
+    """
+
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+    def __init__(self, path : str, fps : float = 30, loop : bool = True):
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+        self.next_frame_time = time.perf_counter()
+
+        # The images are decoded once, replaying them should cost as little as a camera read
+        filenames = sorted(name for name in os.listdir(path) if name.lower().endswith(self.IMAGE_EXTENSIONS))
+        self.images = [image for image in (cv2.imread(os.path.join(path, name)) for name in filenames) if image is not None]
+        self.index = 0
+
+    def read(self, out : np.ndarray) -> float | None:
+        """ Copies the next image into the buffer, returns the time it was due (its capture time). """
+        if self.index >= len(self.images):
+            if not self.loop or not self.images:
+                return None
+            self.index = 0
+        store_frame(self.images[self.index], out)
+        self.index += 1
+        self.wait_for_next_frame()
+        return time.time()
+
+    def release(self):
+        pass
+
+
+def open_source(source : int | str, camera_resolution : tuple[int, int], target_fps : int):
+    """
+    Opens the frame source described by a camera id or a path
+
+    Parameters
+    ----------
+    source : int | str
+        A camera index, a device path (/dev/video0), a video file or an image folder
+    """
+    if isinstance(source, int) or str(source).startswith("/dev/"):
+        return CameraSource(source, camera_resolution, target_fps)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, target_fps)
+    return VideoFileSource(source, target_fps)
+
 
 class FrameCapture:
     """
     A class used to capture frames from a specific camera.
+
+    A background thread keeps reading the source and always holds the latest
+    decoded frame, so capture_frame does not wait on the camera's exposure.
+    Given a FrameRing, the thread decodes every frame straight into the next
+    ring slot (see capture_slot), so no frame is ever copied.
     Attributes
     ----------
-    camera_id : int
-        The camera index (used with OpenCV)
+    camera_id : int | str
+        The camera index, a device path, a video file or an image folder (see open_source)
 
     camera_resolution : tuple[int, int]
         The desired resolution for the camera to capture
@@ -15,51 +221,194 @@ class FrameCapture:
     target_fps : int
         The desired FPS of the camera
 
+    source : CameraSource | VideoFileSource | ImageDirectorySource
+        The source the frames are read from
+
+    ring : FrameRing | None
+        The shared memory ring the frames are read into, None to use private buffers
+
     Methods
     -------
-    capture_frame() -> tuple[cv2.Mat, float]
-        Captures a frame from the camera and returns it along with the timestamp
+    capture_frame(out: np.ndarray | None = None) -> tuple[cv2.Mat, float]
+        Returns the latest frame along with the timestamp it was captured at
+    capture_slot() -> tuple[int, int, float]
+        Returns the ring slot, sequence number and timestamp of the latest frame
+    release()
+        Stops the background thread and closes the source
     """
 
-    def __init__(self, camera_id : int, camera_resolution : tuple[int, int], target_fps : int):
+    # Without a ring, the reader thread writes into one buffer while another holds
+    # the latest frame and a third may be copied out by capture_frame
+    BUFFERS = 3
+
+    # After a failed camera read the thread waits before trying again, twice as
+    # long after every failure up to the maximum, so a missing camera does not
+    # busy loop. Every REOPEN_AFTER failures in a row the camera is reopened, and
+    # after MAX_FAILURES (about 20 seconds) the thread gives up
+    RETRY_DELAY = 0.01
+    MAX_RETRY_DELAY = 0.5
+    REOPEN_AFTER = 10
+    MAX_FAILURES = 50
+
+    def __init__(self, camera_id : int | str, camera_resolution : tuple[int, int], target_fps : int, source=None, ring=None):
         """
         A class used to capture frames from a specific camera
 
         Attributes
         ----------
-        camera_id : int
-            The camera index (used with open cv)
-        
+        camera_id : int | str
+            The camera index (used with open cv), a video file or an image folder
+
         camera_resolution: tuple[int, int]
             The desired resolution for the camera to capture
-        
+
         target_fps : int
             The desired fps of the camera
 
+        source : optional
+            An already opened frame source, used instead of camera_id
+
+        ring : FrameRing, optional
+            A shared memory ring to read the frames straight into, see capture_slot
+
         Methods
         -------
-        capture_frame(queue)
-            Starts frame capture on the camera
+        capture_frame(out)
+            Returns the latest frame from the camera
         """
         self.camera_id = camera_id
-        print("Initializing camera with ID:", camera_id)
-        self.cap = cv2.VideoCapture(camera_id, cv2.CAP_DSHOW)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, camera_resolution[0])
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, camera_resolution[1])
-        self.cap.set(cv2.CAP_PROP_FPS, target_fps)
-        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc('M','J','P','G'))
-    
-    def capture_frame(self) -> tuple[cv2.Mat, float]:
+        self.camera_resolution = camera_resolution
+        self.target_fps = target_fps
+        self.source = source if source is not None else open_source(camera_id, camera_resolution, target_fps)
+        self.ring = ring
+
+        if ring is None:
+            self.buffers = [np.zeros((camera_resolution[1], camera_resolution[0], 3), dtype=np.uint8) for _ in range(self.BUFFERS)]
+        else:
+            self.buffers = list(ring.frames)
+        self.timestamps = [0.0] * len(self.buffers)
+        self.frame_numbers = [0] * len(self.buffers)
+        self.sequences = [-1] * len(self.buffers)
+        self.frame_count = 0
+        self.latest = None        # Buffer (or ring slot) holding the newest frame
+        self.reading = None       # Buffer being copied out by capture_frame
+        self.returned = 0         # Number of the last frame returned by capture_frame
+        self.finished = False
+        self.error = None         # Why the thread stopped reading a camera
+        self.condition = threading.Condition()
+
+        self.running = True
+        self.thread = threading.Thread(target=self._read_frames, daemon=True)
+        self.thread.start()
+
+    def _next_buffer(self) -> int:
+        """ The buffer (or ring slot) the next frame is read into. """
+        if self.ring is not None:
+            return self.ring.next_slot()[0]
+        with self.condition:
+            return next(i for i in range(self.BUFFERS) if i != self.latest and i != self.reading)
+
+    def _read_frames(self):
+        """ Reads frames from the source until stopped, always keeping the latest one. """
+        failures = 0
+        while self.running:
+            index = self._next_buffer()
+
+            timestamp = self.source.read(self.buffers[index])
+            if timestamp is None:
+                if not isinstance(self.source, CameraSource):
+                    break  # End of the file or folder
+                # Dropped camera frame, or the camera is gone: back off and try again
+                failures += 1
+                if failures >= self.MAX_FAILURES:
+                    self.error = f"Camera {self.camera_id} delivered no frame in {failures} attempts"
+                    break
+                time.sleep(min(self.RETRY_DELAY * 2 ** (failures - 1), self.MAX_RETRY_DELAY))
+                if failures % self.REOPEN_AFTER == 0:
+                    self.source.reopen()
+                continue
+            failures = 0
+            sequence = self.ring.commit(index, timestamp) if self.ring is not None else -1
+
+            with self.condition:
+                self.frame_count += 1
+                self.timestamps[index] = timestamp
+                self.frame_numbers[index] = self.frame_count
+                self.sequences[index] = sequence
+                self.latest = index
+                self.condition.notify_all()
+
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+    def _wait_for_frame(self):
+        """ Waits for a frame newer than the last returned one, raises when there will be none. """
+        self.condition.wait_for(lambda: self.finished or self.frame_count != self.returned)
+        if self.frame_count == self.returned:
+            if self.error is not None:
+                raise OSError(self.error)
+            raise EOFError("The frame source has no more frames")
+
+    def capture_frame(self, out : np.ndarray | None = None) -> tuple[cv2.Mat, float]:
         """
-        Captures a frame from the camera and returns it along with the timestamp
+        Returns the latest frame along with the timestamp it was captured at. If it
+        was already returned by a previous call, waits for the next one. Only without
+        a ring, with a ring capture_slot hands the frame over without copying it
+        Parameters
+        ----------
+        out : np.ndarray | None
+            A preallocated buffer to write the frame into instead of allocating a new one
         Returns
         -------
         tuple[cv2.Mat, float]
             The captured frame and the timestamp of when it was captured
+        Raises
+        ------
+        EOFError
+            If the source is a file or folder that has no more frames
+        OSError
+            If the camera stopped delivering frames and could not be reopened
+        RuntimeError
+            With a ring, whose slots the thread may overwrite while they are copied
         """
-        while True:
-            start_time = time.time()
-            ret, frame = self.cap.read()
-            if ret:
-                print("FPS:", 1 / (time.time() - start_time))
-                return (frame, start_time)
+        if self.ring is not None:
+            raise RuntimeError("Frames read into a FrameRing are returned by capture_slot")
+        with self.condition:
+            self._wait_for_frame()
+            self.reading = self.latest
+            timestamp = self.timestamps[self.reading]
+            frame_number = self.frame_numbers[self.reading]
+
+        frame = self.buffers[self.reading]
+        if out is None:
+            out = frame.copy()
+        else:
+            store_frame(frame, out)
+
+        with self.condition:
+            self.reading = None
+            self.returned = frame_number
+        return (out, timestamp)
+
+    def capture_slot(self) -> tuple[int, int, float]:
+        """
+        Returns the ring slot, sequence number and capture timestamp of the latest
+        frame, waiting for a new one if it was already returned. The frame stays in
+        the slot, readers claim it and check that it is still current (see FrameRing)
+        Raises
+        ------
+        EOFError, OSError
+            See capture_frame
+        """
+        with self.condition:
+            self._wait_for_frame()
+            slot = self.latest
+            self.returned = self.frame_numbers[slot]
+            return (slot, self.sequences[slot], self.timestamps[slot])
+
+    def release(self):
+        """ Stops the background thread and closes the source. """
+        self.running = False
+        self.thread.join()
+        self.source.release()
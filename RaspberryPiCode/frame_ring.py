@@ -0,0 +1,142 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+class FrameRing:
+    """
+    A ring of preallocated frame slots in shared memory, used to hand frames from
+    the capture process to the detection process without pickling them.
+
+    The capture process writes each frame in place into the next slot and only
+    sends the small (slot, sequence) pair through a queue. Each slot has a header
+    with the sequence number and capture timestamp of the frame it holds. A
+    reader claims the slot while it works on it so that the writer skips it, and
+    checks afterwards (`is_current`) that the slot was not overwritten anyway
+    (the writer may have picked the slot just before it was claimed). Every
+    reader has its own claim flag, so that one reader releasing a slot never
+    releases it for another.
+
+    Attributes
+    ----------
+    frame_shape : tuple[int, int, int]
+        The shape of a frame, (height, width, channels)
+
+    slots : int
+        The number of frame slots in the ring
+
+    readers : int
+        The number of reader processes that may claim slots (e.g. detection and the debug stream)
+
+    name : str
+        The name of the shared memory block, used to attach from other processes
+
+    Methods
+    -------
+    next_slot() -> tuple[int, np.ndarray]
+        Returns the index and buffer of the slot the next frame should be written to
+    commit(slot: int, timestamp: float) -> int
+        Publishes the frame written to a slot and returns its sequence number
+    latest() -> tuple[int, int] | None
+        Returns the slot and sequence number of the newest frame
+    frame(slot: int) -> np.ndarray
+        Returns the frame stored in a slot (a view, not a copy)
+    timestamp(slot: int) -> float
+        Returns the capture timestamp of the frame stored in a slot
+    is_current(slot: int, sequence: int) -> bool
+        Checks that a slot still holds the frame with the given sequence number
+    claim(slot: int, reader: int = 0)
+        Marks a slot as being read so the writer does not reuse it
+    release(slot: int, reader: int = 0)
+        Lets the writer reuse a slot claimed by a reader
+    close()
+        Detaches from the shared memory
+    unlink()
+        Frees the shared memory, called once by the process that created it
+    """
+
+    def __init__(self, frame_shape : tuple[int, int, int], slots : int = 4, readers : int = 1, name : str | None = None):
+        self.frame_shape = tuple(frame_shape)
+        self.slots = slots
+        self.readers = readers
+        # Per slot header: sequence number (-1 while the slot is being written),
+        # timestamp and which readers have claimed the slot
+        self.header_dtype = np.dtype([('sequence', np.int64), ('timestamp', np.float64), ('claimed', np.int64, (readers,))])
+        header_size = self.header_dtype.itemsize * slots
+        frame_size = int(np.prod(self.frame_shape))
+
+        create = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=header_size + frame_size * slots)
+        self.name = self.shm.name
+
+        self.headers = np.ndarray((slots,), dtype=self.header_dtype, buffer=self.shm.buf)
+        self.frames = np.ndarray((slots,) + self.frame_shape, dtype=np.uint8, buffer=self.shm.buf, offset=header_size)
+        if create:
+            self.headers['sequence'] = -1
+            self.headers['timestamp'] = 0.0
+            self.headers['claimed'] = 0
+
+        # Only used by the writer
+        self.next_sequence = 0
+
+    def __reduce__(self):
+        # Child processes attach to the same block by name instead of copying it
+        return (self.__class__, (self.frame_shape, self.slots, self.readers, self.name))
+
+    def next_slot(self) -> tuple[int, np.ndarray]:
+        """
+        Returns the index and buffer of the slot the next frame should be written to,
+        the slot is marked as being written until `commit` is called
+        """
+        slot = self.next_sequence % self.slots
+        # Skip the slots a reader is still working on
+        for _ in range(self.slots):
+            if not self.headers['claimed'][slot].any():
+                break
+            self.next_sequence += 1
+            slot = self.next_sequence % self.slots
+        self.headers['sequence'][slot] = -1
+        return slot, self.frames[slot]
+
+    def commit(self, slot : int, timestamp : float) -> int:
+        """ Publishes the frame written to a slot and returns its sequence number. """
+        sequence = self.next_sequence
+        self.headers['timestamp'][slot] = timestamp
+        self.headers['sequence'][slot] = sequence
+        self.next_sequence += 1
+        return sequence
+
+    def latest(self) -> tuple[int, int] | None:
+        """ Returns the slot and sequence number of the newest frame, None before the first one. """
+        sequences = self.headers['sequence']
+        slot = int(np.argmax(sequences))
+        sequence = int(sequences[slot])
+        return None if sequence < 0 else (slot, sequence)
+
+    def frame(self, slot : int) -> np.ndarray:
+        """ Returns the frame stored in a slot (a view into shared memory, not a copy). """
+        return self.frames[slot]
+
+    def timestamp(self, slot : int) -> float:
+        """ Returns the capture timestamp of the frame stored in a slot. """
+        return float(self.headers['timestamp'][slot])
+
+    def is_current(self, slot : int, sequence : int) -> bool:
+        """ Checks that a slot still holds the frame with the given sequence number. """
+        return int(self.headers['sequence'][slot]) == sequence
+
+    def claim(self, slot : int, reader : int = 0):
+        """ Marks a slot as being read by a reader so the writer does not reuse it. """
+        self.headers['claimed'][slot, reader] = 1
+
+    def release(self, slot : int, reader : int = 0):
+        """ Lets the writer reuse a slot once no other reader claims it. """
+        self.headers['claimed'][slot, reader] = 0
+
+    def close(self):
+        """ Detaches from the shared memory. """
+        # The numpy views must be released before the buffer can be closed
+        del self.headers, self.frames
+        self.shm.close()
+
+    def unlink(self):
+        """ Frees the shared memory, called once by the process that created the ring. """
+        self.shm.unlink()
@@ -12,17 +12,63 @@ class ColorDetection:
         The lower hsv color bound for the game piece
     upper_bound: numpy array
         The upper hsv color bound for the game piece
+    min_area : float
+        The smallest contour area (in pixels) reported as a game piece
+    tracking : bool
+        Whether to search only a window around the last detection (see detect_color)
+    search_interval : int
+        In tracking mode, the number of frames between two full frame searches
+    roi_margin : float
+        In tracking mode, how much the window extends past the predicted rectangle,
+        as a fraction of the rectangle's larger side
+    pyramid_scale : int
+        Downscaling factor (e.g. 2 or 4) of the coarse search, 1 to search at full resolution
+    lut_bits : int
+        Bits kept per BGR channel by the thresholding lookup table (5 or 6), 0 to use cvtColor and inRange
+    oriented : bool
+        Whether to also find the image angle of every game piece (non symmetrical
+        game pieces such as the 2025 Coral), see find_angle
+    resolution : tuple[int, int] | None
+        The (width, height) of the frames the work buffers are allocated for
     Methods
     -------
-    findMask(img: cv2.Mat) -> cv2.Mat
+    allocate(resolution: tuple[int, int])
+        Preallocates the work buffers for frames of the given resolution
+    set_bounds(lower_bound: np.ndarray, upper_bound: np.ndarray)
+        Changes the hsv color bounds, rebuilding the thresholding lookup table
+    build_threshold_lut()
+        Precomputes the in-range decision of every quantized BGR color
+    threshold(img: cv2.Mat) -> cv2.Mat
+        Finds the pixels of the image within the hsv color bounds
+    get_kernel(kernel_size: int) -> np.ndarray
+        Returns the cached morphology structuring element of the given size
+    findMask(img: cv2.Mat, kernel_size: int = 7) -> cv2.Mat
         Finds the mask of the image based on the lower and upper bounds
     find_rectangle(contour: np.ndarray) -> tuple[int, int, int, int]
         Finds the bounding rectangle of a contour
+    find_angle(contour: np.ndarray) -> float
+        Finds the direction of the two longest straight edges of a contour
+    find_rectangles(img: cv2.Mat) -> np.ndarray
+        Finds the bounding rectangles of all game pieces in an image
+    predict_roi(frame_shape) -> tuple[int, int, int, int] | None
+        Predicts the window the tracked game piece will be in
     detect_color(frame: cv2.Mat) -> np.ndarray
-        Detects game pieces in the given frame using color detection
+        Detects all game pieces in the given frame using color detection
+    reset_tracking()
+        Forgets the tracked game piece so the next frame is fully searched
     """
 
-    def __init__(self, lower_bound : np.ndarray, upper_bound : np.ndarray):
+    # Smallest margin (in pixels) around the predicted rectangle, so that small
+    # or far away game pieces can still move between two frames
+    MIN_ROI_MARGIN = 16
+
+    # Size of the morphology kernel at full resolution
+    KERNEL_SIZE = 7
+
+    def __init__(self, lower_bound : np.ndarray, upper_bound : np.ndarray, min_area : float = 100,
+                 tracking : bool = False, search_interval : int = 30, roi_margin : float = 1.0,
+                 pyramid_scale : int = 1, lut_bits : int = 0, oriented : bool = False,
+                 resolution : tuple[int, int] | None = None):
         """
         A class used to detect game objects in the image
 
@@ -34,42 +80,186 @@ class ColorDetection:
         upper_bound: numpy array
             The upper hsv color bound
 
+        min_area : float
+            The smallest contour area (in pixels) reported as a game piece
+
+        tracking : bool
+            Whether to search only a window around the last detection
+
+        search_interval : int
+            In tracking mode, the number of frames between two full frame searches
+
+        roi_margin : float
+            In tracking mode, the window margin as a fraction of the rectangle's larger side
+
+        pyramid_scale : int
+            Downscaling factor of the coarse search (see find_rectangles), 1 to disable
+
+        lut_bits : int
+            Bits per channel of the thresholding lookup table (see threshold), 0 to disable
+
+        oriented : bool
+            Whether the rectangles also get the image angle of the game piece
+
+        resolution : tuple[int, int] | None
+            The (width, height) of the frames, to allocate the work buffers up front
+            instead of on the first frame
+
         Methods
         -------
         detect_color(frame, queue)
             Detects object in the given frame using mainly color
         """
+        self.lut_bits = lut_bits
+        self.set_bounds(lower_bound, upper_bound)
+        self.min_area = min_area
+
+        self.tracking = tracking
+        self.search_interval = search_interval
+        self.roi_margin = roi_margin
+        self.reset_tracking()
+
+        self.pyramid_scale = pyramid_scale
+        self.oriented = oriented
+
+        # Morphology structuring elements by kernel size
+        self.kernels = {}
+        self.resolution = None
+        self.allocate(resolution or (0, 0))
+
+    def allocate(self, resolution : tuple[int, int]):
+        """
+        Preallocates the work buffers for frames of the given (width, height)
+
+        Every step of the detection writes into these buffers (through the `dst`
+        parameters of OpenCV) instead of allocating its output, so a steady stream of
+        frames allocates nothing but the returned rectangles. Smaller images (the
+        tracking window, the downscaled pyramid level) use the top left corner of
+        the buffers. A larger frame than the buffers reallocates them once.
+        """
+        width, height = resolution
+        self.resolution = (width, height)
+        self.hsv = np.empty((height, width, 3), dtype=np.uint8)
+        self.mask = np.empty((height, width), dtype=np.uint8)
+        self.morph = np.empty((height, width), dtype=np.uint8)
+        if self.lut_bits:
+            self.fields = np.empty((height, width, 3), dtype=np.int32)
+            self.field_sum = np.empty((height, width), dtype=np.int32)
+            self.index = np.empty((height, width), dtype=np.intp)
+        if self.pyramid_scale > 1:
+            self.small = np.empty((max(height // self.pyramid_scale, 1), max(width // self.pyramid_scale, 1), 3), dtype=np.uint8)
+
+    def _ensure_allocated(self, shape : tuple[int, ...]):
+        """ Grows the work buffers when an image is larger than them. """
+        if shape[0] > self.resolution[1] or shape[1] > self.resolution[0]:
+            self.allocate((max(shape[1], self.resolution[0]), max(shape[0], self.resolution[1])))
+
+    def set_bounds(self, lower_bound : np.ndarray, upper_bound : np.ndarray):
+        """ Changes the hsv color bounds, the thresholding lookup table is rebuilt for them. """
         self.lower_bound = lower_bound
         self.upper_bound = upper_bound
+        if self.lut_bits:
+            self.build_threshold_lut()
+
+    def build_threshold_lut(self):
+        """
+        Precomputes the in-range decision of every quantized BGR color, so that
+        thresholding a frame is a table lookup instead of a color conversion.
+
+        Every channel keeps its `lut_bits` high bits, a color is in range when
+        the center of its quantization cell is. Per channel tables turn a pixel
+        into its (b, g, r) bit fields, which are then added into the table index.
+        """
+        bits = self.lut_bits
+        shift = 8 - bits
+        levels = np.arange(1 << bits)
+
+        # Center color of every quantization cell, in (b, g, r) index order
+        centers = (levels << shift) + ((1 << shift) >> 1)
+        b, g, r = np.meshgrid(centers, centers, centers, indexing="ij")
+        colors = np.stack((b, g, r), axis=-1).astype(np.uint8).reshape(-1, 1, 3)
+        hsv = cv2.cvtColor(colors, cv2.COLOR_BGR2HSV)
+        self.threshold_lut = cv2.inRange(hsv, self.lower_bound, self.upper_bound).ravel()
+
+        quantized = np.arange(256) >> shift
+        self.channel_lut = np.stack((quantized << (2 * bits), quantized << bits, quantized), axis=-1).astype(np.int32).reshape(256, 1, 3)
+        self.channel_sum = np.ones((1, 3))
+
+    def threshold(self, img : cv2.Mat) -> cv2.Mat:
+        """
+        Finds the pixels of the image within the hsv color bounds
+
+        Parameters
+        ----------
+        img : cv2.Mat
+            A BGR image
+
+        Returns
+        -------
+        cv2.Mat
+            The mask, 255 for the pixels within the bounds. With the lookup table
+            it can differ from inRange for colors near the bounds (within the
+            quantization step). It is a view of a work buffer, overwritten by the
+            next call
+        """
+        self._ensure_allocated(img.shape)
+        height, width = img.shape[:2]
+        mask = self.mask[:height, :width]
+        if not self.lut_bits:
+            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=self.hsv[:height, :width])
+            return cv2.inRange(hsv, self.lower_bound, self.upper_bound, dst=mask)
+
+        fields = cv2.LUT(img, self.channel_lut, dst=self.fields[:height, :width])
+        field_sum = cv2.transform(fields, self.channel_sum, dst=self.field_sum[:height, :width])
+        # np.take casts its indices to intp, copying into an intp buffer avoids that allocation
+        index = self.index[:height, :width]
+        np.copyto(index, field_sum)
+        return np.take(self.threshold_lut, index, out=mask, mode="clip")
+
+    def get_kernel(self, kernel_size : int) -> np.ndarray:
+        """ Returns the (cached) square structuring element of the given size. """
+        kernel = self.kernels.get(kernel_size)
+        if kernel is None:
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+            self.kernels[kernel_size] = kernel
+        return kernel
+
+    def reset_tracking(self):
+        """ Forgets the tracked game piece so the next frame is fully searched. """
+        self.track = None                   # Last (x, y, w, h) of the largest game piece
+        self.velocity = np.zeros(2)         # Center motion per frame, in pixels
+        self.frames_since_search = 0
+        self.last_search = None             # Rectangles of the last full frame search
     
-    def findMask(self, img : cv2.Mat) -> cv2.Mat:
+    def findMask(self, img : cv2.Mat, kernel_size : int = KERNEL_SIZE) -> cv2.Mat:
         """
         Finds the mask of the image based on the lower and upper bounds
         Parameters
         ----------
         img : cv2.Mat
             The image to find the mask of
+        kernel_size : int
+            The size of the morphology kernel, smaller for downscaled images
         Returns
         -------
         cv2.Mat
-            The mask of the image
+            The mask of the image, a view of a work buffer overwritten by the next call
         """
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-
-        mask = cv2.inRange(hsv, self.lower_bound, self.upper_bound)
+        mask = self.threshold(img)
+        morph = self.morph[:mask.shape[0], :mask.shape[1]]
 
-        # Define the kernel for the morphological operation
-        # It is a 7*7 2d array of ones
+        # The kernel for the morphological operations, a kernel_size*kernel_size square
         # Try changing the size of the kernel to see how it affects the image
-        kernel = np.ones((7, 7), np.uint8)
-
-        # Perform morphological opening to remove noise
-        opening = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        kernel = self.get_kernel(kernel_size)
 
-        # Perform morphological closing to close small holes
-        processed_mask = cv2.morphologyEx(opening, cv2.MORPH_CLOSE, kernel)
+        # Perform morphological opening (erode then dilate) to remove noise, then
+        # closing (dilate then erode) to close small holes, between the two buffers
+        cv2.erode(mask, kernel, dst=morph)
+        cv2.dilate(morph, kernel, dst=mask)
+        cv2.dilate(mask, kernel, dst=morph)
+        cv2.erode(morph, kernel, dst=mask)
 
-        return processed_mask
+        return mask
     
     def find_rectangle(self, contour : np.ndarray) -> tuple[int, int, int, int]:
         """
@@ -88,26 +278,219 @@ class ColorDetection:
         x, y, w, h = cv2.boundingRect(contour)
         return (x, y, w, h)
 
-    def detect_color(self, frame : cv2.Mat) -> np.ndarray:
+    @staticmethod
+    def find_angle(contour : np.ndarray) -> float:
         """
-        Detects game pieces in the given frame using color detection
+        Finds the image angle of a contour, the average direction of its two longest
+        straight edges (used for the 2025 Coral). This is the find_angle of
+        SetUp/process_blender_data.py that the datasets were processed with, computed
+        over all edges at once instead of edge by edge
 
         Parameters
         ----------
-        frame : cv2.Mat
-            The frame to detect game pieces in
+        contour : np.ndarray
+            The contour of the game piece
+
+        Returns
+        -------
+        float
+            The angle in degrees in [0, 180), NaN when the contour has fewer than
+            two straight edges
+        """
+        if len(contour) < 2:
+            return np.nan
+
+        # Simplify the contour (remove small jitter)
+        epsilon = 0.01 * cv2.arcLength(contour, True)
+        points = cv2.approxPolyDP(contour, epsilon, True).reshape(-1, 2)
+
+        # The edges between consecutive points, wrapping around, ignoring tiny edges
+        edges = np.empty(points.shape)
+        np.subtract(points[1:], points[:-1], out=edges[:-1])
+        np.subtract(points[0], points[-1], out=edges[-1])
+        lengths = np.hypot(edges[:, 0], edges[:, 1])
+        straight = np.flatnonzero(lengths > 2)
+        if len(straight) < 2:
+            return np.nan
+
+        # Average the direction of the two longest edges, as a circular mean
+        # (avoid averaging 179° and -179° to get 0°)
+        longest = straight[np.argsort(-lengths[straight], kind="stable")[:2]]
+        angles = np.arctan2(edges[longest, 1], edges[longest, 0])
+        x_sum, y_sum = np.cos(angles).sum(), np.sin(angles).sum()
+        if np.hypot(x_sum, y_sum) < 1e-9:
+            # Exactly opposite edges (e.g. the two long sides of a rectangle) have no mean
+            # direction, the angle tends to the edges' direction as they get closer to it
+            return float(np.degrees(angles[0]) % 180)
+        average = np.degrees(np.arctan2(y_sum, x_sum))
+        return float((average + 360 + 90) % 180)  # normalize to [0, 180)
+
+    def find_rectangles(self, img : cv2.Mat) -> np.ndarray:
+        """
+        Finds the bounding rectangles of all game pieces in an image
+
+        With a pyramid scale above 1 the mask is built and searched on a
+        downscaled copy of the image, and only the largest game piece is then
+        searched again at full resolution in a window around it. Its rectangle is
+        pixel exact (the datasets are matched on it), the others are the coarse
+        rectangles scaled back up and may be off by about `pyramid_scale` pixels.
+
+        Parameters
+        ----------
+        img : cv2.Mat
+            The image (or a window of the frame) to search
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 4) array of (x, y, width, height) rectangles in the image's
+            coordinates, largest contour first, (N, 5) with the image angle in
+            oriented mode
+        """
+        scale = self.pyramid_scale
+        if scale <= 1:
+            return self._find_contour_rectangles(img, self.min_area, self.KERNEL_SIZE)
+
+        self._ensure_allocated(img.shape)
+        small_width, small_height = max(img.shape[1] // scale, 1), max(img.shape[0] // scale, 1)
+        small = cv2.resize(img, (small_width, small_height), dst=self.small[:small_height, :small_width], interpolation=cv2.INTER_LINEAR)
+        # The kernel and the minimum area shrink with the image (a 7*7 kernel becomes 3*3 at half size)
+        kernel_size = max(self.KERNEL_SIZE // scale, 1) | 1
+        rects = self._find_contour_rectangles(small, self.min_area / scale ** 2, kernel_size)
+        if len(rects) == 0:
+            return rects
+        rects[:, :4] *= scale
+
+        # Search the largest game piece again at full resolution, the window covers
+        # the rounding of the downscale and the morphology kernel
+        x, y, w, h = (int(value) for value in rects[0, :4])
+        pad = 2 * scale + self.KERNEL_SIZE
+        x0, y0 = max(x - pad, 0), max(y - pad, 0)
+        x1, y1 = min(x + w + pad, img.shape[1]), min(y + h + pad, img.shape[0])
+        refined = self._find_contour_rectangles(img[y0:y1, x0:x1], self.min_area, self.KERNEL_SIZE)
+        if len(refined) > 0:
+            rects[0] = refined[0]
+            rects[0, :2] += (x0, y0)
+        return rects
+
+    def _find_contour_rectangles(self, img : cv2.Mat, min_area : float, kernel_size : int) -> np.ndarray:
         """
-        mask = self.findMask(frame)
+        Masks an image and returns the rectangles of its contours of at least min_area
+        pixels, largest first, with the angle of every contour in oriented mode
+        """
+        mask = self.findMask(img, kernel_size)
 
         # Find contours in the mask
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        # If no contours are found, return a rectangle with all zeros
-        if not contours:
+        # Keep the contours that are large enough, largest first
+        areas = np.array([cv2.contourArea(contour) for contour in contours])
+        order = [i for i in np.argsort(-areas, kind="stable") if areas[i] >= min_area]
+
+        rects = [self.find_rectangle(contours[i]) for i in order]
+        if not self.oriented:
+            return np.array(rects, dtype=np.int32).reshape(-1, 4)
+        angles = [self.find_angle(contours[i]) for i in order]
+        return np.column_stack((np.array(rects, dtype=np.float64).reshape(-1, 4), angles))
+
+    def predict_roi(self, frame_shape : tuple[int, ...]) -> tuple[int, int, int, int] | None:
+        """
+        Predicts the window the tracked game piece will be in, moving the last
+        rectangle at its last velocity and widening it by the margin
+
+        Returns
+        -------
+        tuple[int, int, int, int] | None
+            The (x0, y0, x1, y1) window clipped to the frame, or None when
+            nothing is tracked
+        """
+        if self.track is None:
+            return None
+        x, y, w, h = self.track
+        center_x = x + w / 2 + self.velocity[0]
+        center_y = y + h / 2 + self.velocity[1]
+        margin = max(self.roi_margin * max(w, h), self.MIN_ROI_MARGIN)
+
+        x0 = max(int(center_x - w / 2 - margin), 0)
+        y0 = max(int(center_y - h / 2 - margin), 0)
+        x1 = min(int(np.ceil(center_x + w / 2 + margin)), frame_shape[1])
+        y1 = min(int(np.ceil(center_y + h / 2 + margin)), frame_shape[0])
+        if x1 <= x0 or y1 <= y0:
             return None
+        return (x0, y0, x1, y1)
+
+    def _update_track(self, rects : np.ndarray):
+        """ Follows the largest detection, or forgets the track after a miss. """
+        if len(rects) == 0:
+            self.reset_tracking()
+            return
+        x, y, w, h = (int(value) for value in rects[0, :4])
+        if self.track is not None:
+            last_x, last_y, last_w, last_h = self.track
+            self.velocity = np.array([x + w / 2 - last_x - last_w / 2, y + h / 2 - last_y - last_h / 2])
+        self.track = (x, y, w, h)
+
+    def _merge_last_search(self, rects : np.ndarray, roi : tuple[int, int, int, int]) -> np.ndarray:
+        """ Appends the rectangles of the last full search outside the window (see detect_color). """
+        # The first one was the tracked game piece, found again in the window
+        if self.last_search is None or len(self.last_search) < 2:
+            return rects
+        others = self.last_search[1:]
+        x0, y0, x1, y1 = roi
+        outside = ((others[:, 0] >= x1) | (others[:, 1] >= y1)
+                   | (others[:, 0] + others[:, 2] <= x0) | (others[:, 1] + others[:, 3] <= y0))
+        return np.concatenate((rects, others[outside]))
+
+    def detect_color(self, frame : cv2.Mat) -> np.ndarray:
+        """
+        Detects game pieces in the given frame using color detection
+
+        In tracking mode, only a window around the predicted position of the
+        largest game piece is searched, so the cost scales with the size of the
+        game piece instead of the frame. The full frame is searched when nothing
+        is tracked, after a miss, when the game piece reaches the edge of the
+        window, and every `search_interval` frames (to find new game pieces).
+        Between two full searches, the game pieces outside the window are reported
+        with their rectangles from the last full search, after the ones found in the
+        window (the tracked game piece first). A game piece entering the frame outside
+        the window is only found by the next full search.
+
+        Parameters
+        ----------
+        frame : cv2.Mat
+            The frame to detect game pieces in
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 4) array of (x, y, width, height) bounding rectangles, one per
+            contour of at least `min_area` pixels, largest contour first.
+            N is 0 when nothing is detected. In oriented mode an (N, 5) float
+            array, the last column the image angle (see find_angle)
+        """
+        if not self.tracking:
+            return self.find_rectangles(frame)
 
-        contour = max(contours, key=cv2.contourArea)
-        rect = self.find_rectangle(contour)
-        x, y, w, h = rect
+        self.frames_since_search += 1
+        roi = self.predict_roi(frame.shape) if self.frames_since_search < self.search_interval else None
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            rects = self.find_rectangles(frame[y0:y1, x0:x1])
+            if len(rects) > 0:
+                x, y, w, h = rects[0, :4]
+                # A rectangle touching the window's edge (where it is not the frame's
+                # edge) may be cut off, the full frame search finds its real size
+                cut_off = ((x == 0 and x0 > 0) or (y == 0 and y0 > 0)
+                           or (x + w == x1 - x0 and x1 < frame.shape[1])
+                           or (y + h == y1 - y0 and y1 < frame.shape[0]))
+                if not cut_off:
+                    rects[:, 0] += x0
+                    rects[:, 1] += y0
+                    self._update_track(rects)
+                    return self._merge_last_search(rects, roi)
 
-        return np.array([x, y, w, h], dtype=np.int32)
\ No newline at end of file
+        rects = self.find_rectangles(frame)
+        self.frames_since_search = 0
+        self._update_track(rects)
+        self.last_search = rects
+        return rects
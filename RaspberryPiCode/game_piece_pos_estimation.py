@@ -1,5 +1,15 @@
+from collections import OrderedDict
+from typing import TYPE_CHECKING
 import numpy as np
-import pandas as pd
+from dataset import column_names, columns_to_array, load_dataset, load_metadata
+from spatial_index import GridIndex
+from lookup_table import LookupTable
+from regression_model import RegressionModel
+
+# pandas is only needed when the caller passes a DataFrame, the runtime pipeline
+# uses the structured arrays from dataset.load_dataset and never imports it
+if TYPE_CHECKING:
+    import pandas as pd
 
 class GamePiecePosEstimator:
     """
@@ -13,22 +23,203 @@ class GamePiecePosEstimator:
     height: int
         The height of the image
 
-    data : pandas.DataFrame
-        The data frame containing the game piece positions
+    data : np.ndarray | pandas.DataFrame
+        The game piece positions, either a structured array (memory mapped) from
+        dataset.load_dataset or a pandas data frame with the same columns
+
+    index : GridIndex
+        A spatial index over the matching columns of `data`, built once so that
+        lookups do not rescan the whole table
+
+    lut : LookupTable | None
+        A precomputed lookup table (see lookup_table.build_lut), when set
+        estimate_position reads the table instead of searching the data
+
+    model : RegressionModel | None
+        A fitted regression model (see regression_model.fit_model), when set the
+        positions are computed from it instead of searching the data
+
+    method : str
+        "tolerance" averages every row within a widening tolerance of the rectangle,
+        "knn" interpolates between the k nearest rows (see interpolate_position)
+
+    k : int
+        The number of rows the "knn" method interpolates between
+
+    cache_size : int
+        The number of recent results kept (least recently used first out), 0 disables
+        the cache. A stationary game piece is found at about the same rectangle every
+        frame, its position is then looked up instead of searched again
+
+    cache_bucket : int
+        The rectangles are cached by their center and size divided by this many pixels,
+        1 caches every exact rectangle and returns the same results as no cache. A larger
+        bucket answers nearby rectangles with the first one's position, so the results
+        change: up to about 4 cm with 2 pixels on the 2024 Note (see benchmark.benchmark_cache)
+
+    cache_hits, cache_misses : int
+        The number of estimates answered from the cache and computed
+
+    oriented : bool
+        Whether rectangles with an angle also get a yaw, when the data has the image
+        angle and rotation of a non symmetrical game piece (2025 Coral) and the
+        "tolerance" method searches it, or the model was fitted on such data
+
+    yaw_period : float | None
+        The period of the rotation column, 180 for a game piece that looks the same
+        turned around (Coral), 360 otherwise
 
     Methods
     -------
+    from_dataset(path: str, **options) -> GamePiecePosEstimator
+        Builds an estimator from a dataset file
+    set_data(data, cell_size: int = 40)
+        Swaps the dataset, clearing the cache
+    clear_cache()
+        Forgets every cached result
+    find_matching_rows(df, target, start_tol, max_tol, step) -> tuple[np.ndarray | pd.DataFrame, int]
+        Finds the rows matching the target within a widening tolerance
+    interpolate_position(target: np.ndarray, max_tol: int) -> tuple[float, float, float] | None
+        Interpolates the position between the nearest rows to the target
+    predict_positions(targets: np.ndarray, max_tol: int) -> np.ndarray
+        Computes the positions of several targets with the regression model
+    circular_mean(angles: np.ndarray, period: float) -> float
+        Averages angles that wrap around with the given period
     estimate_position(rectangle: np.ndarray) -> tuple[int, int]
-        Estimates the position of a game piece based on its bounding rectangle
+        Estimates the position of a game piece based on its bounding rectangle (and angle)
+    estimate_positions(rectangles: np.ndarray) -> np.ndarray
+        Estimates the positions of several game pieces at once
+    search_position(center_x, center_y, w, h, angle) / search_positions(targets)
+        The same estimates without the cache
     """
-    
-    def __init__(self, width: int, height: int, data : pd.DataFrame):
+
+    # Columns compared against the detected rectangle, the image angle is only
+    # used when the dataset has one (2025 Coral)
+    MATCH_COLUMNS = ['Center_X', 'Center_Y', 'Width', 'Height']
+    ANGLE_COLUMN = 'Image_angle'
+    # The rendered rotation of the game piece, averaged into the yaw
+    YAW_COLUMN = 'angle'
+
+    # The image angle (see ColorDetection.find_angle) repeats every 180 degrees
+    ANGLE_PERIOD = 180
+
+    METHODS = ("tolerance", "knn")
+
+    # Inverse distance weighting power of the "knn" method
+    KNN_POWER = 2
+
+    def __init__(self, width: int, height: int, data : "np.ndarray | pd.DataFrame | None", cell_size : int = 40, lut : LookupTable | None = None,
+                 method : str = "tolerance", k : int = 8, model : RegressionModel | None = None, cache_size : int = 0,
+                 cache_bucket : int = 1, yaw_period : float | None = None):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown estimation method {method!r}, expected one of {self.METHODS}")
         self.width = width
         self.height = height
         self.data = data
-    
+        self.lut = lut
+        self.model = model
+        self.method = method
+        self.k = k
+        self.cache_size = cache_size
+        self.cache_bucket = cache_bucket
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.yaw_period = yaw_period
+        # A model fitted on an oriented dataset takes the image angle and predicts the yaw
+        self.oriented = (model is not None and RegressionModel.ANGLE_INPUT in model.input_columns
+                         and RegressionModel.ANGLE_OUTPUT in model.output_columns)
+        if self.oriented and self.yaw_period is None:
+            self.yaw_period = model.angle_period
+        # In lookup table and model mode the data is optional, it is only needed for find_matching_rows
+        if data is not None:
+            self.build_index(cell_size)
 
-    def find_matching_rows(self, df, target, start_tol=25, max_tol=40, step=3) -> tuple[pd.DataFrame, int]:
+    @classmethod
+    def from_dataset(cls, path : str, **options) -> "GamePiecePosEstimator":
+        """
+        Builds an estimator from a dataset file (binary or CSV, see dataset.load_dataset),
+        for the resolution stored in the dataset's metadata (1280x720 if there is none)
+        """
+        width, height = load_metadata(path).get("resolution", (1280, 720))
+        return cls(width, height, load_dataset(path), **options)
+
+    def build_index(self, cell_size : int = 40):
+        """ Builds the spatial index over the matching columns of the data. """
+        self.match_columns = list(self.MATCH_COLUMNS)
+        angle_period = None
+        names = column_names(self.data)
+        if self.ANGLE_COLUMN in names:
+            self.match_columns.append(self.ANGLE_COLUMN)
+            angle_period = self.ANGLE_PERIOD
+        features = columns_to_array(self.data, self.match_columns)
+        self.index = GridIndex(features, cell_size, angle_period)
+        self.positions = columns_to_array(self.data, ['x_position', 'y_position'])
+
+        # The yaw is averaged from the matching rows, only the tolerance method has them
+        if self.model is None:
+            self.oriented = (self.ANGLE_COLUMN in names and self.YAW_COLUMN in names
+                             and self.lut is None and self.method == "tolerance")
+        if self.oriented and self.model is None:
+            yaws = columns_to_array(self.data, [self.YAW_COLUMN])[:, 0]
+            if self.yaw_period is None:
+                # Coral is rendered over 180 degrees, the 2023 Cone over 360
+                self.yaw_period = 180 if len(yaws) and yaws.max() < 180 else 360
+            # Unit vectors of the rotations, summed to average them circularly
+            turns = 2 * np.pi * yaws / self.yaw_period
+            self.yaw_vectors = np.column_stack((np.cos(turns), np.sin(turns)))
+
+        if self.method == "knn":
+            # Every column is divided by its spread, so that a pixel of width counts
+            # as much as the same fraction of the center's range
+            features = features[:, :len(self.MATCH_COLUMNS)]
+            self.feature_scale = features.std(axis=0) if len(features) else np.ones(features.shape[1])
+            self.feature_scale[~(self.feature_scale > 0)] = 1
+            self.knn_index = GridIndex(features / self.feature_scale, cell_size / self.feature_scale[:2].max())
+
+
+    def set_data(self, data : "np.ndarray | pd.DataFrame", cell_size : int = 40):
+        """ Swaps the dataset (e.g. for another game piece), the cached results belong to the old one. """
+        self.data = data
+        self.build_index(cell_size)
+        self.clear_cache()
+
+    def clear_cache(self):
+        """ Forgets every cached result, the hit and miss counters are kept. """
+        self.cache.clear()
+
+    def cache_key(self, target : np.ndarray, tolerances : tuple[int, int, int]) -> tuple:
+        """ The cache key of a (Center_X, Center_Y, Width, Height[, angle]) target searched with the given tolerances. """
+        return tuple(int(value) // self.cache_bucket if value == value else None for value in target) + tolerances
+
+    def cache_get(self, key : tuple):
+        """ The cached result of a key (a position or None), False if it is not cached. """
+        if key not in self.cache:
+            self.cache_misses += 1
+            return False
+        self.cache_hits += 1
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def cache_put(self, key : tuple, position : tuple[float, float, float] | None):
+        self.cache[key] = position
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    @staticmethod
+    def circular_mean(angles : np.ndarray, period : float) -> float:
+        """ Averages angles that wrap around with the given period (e.g. 179 and 1 average to 0 with 180), in [0, period). """
+        turns = 2 * np.pi * np.asarray(angles, dtype=np.float64) / period
+        return float(np.arctan2(np.sin(turns).sum(), np.cos(turns).sum()) * period / (2 * np.pi) % period)
+
+    @staticmethod
+    def select_rows(df, rows : np.ndarray):
+        """ Selects rows by position from a structured array or a DataFrame. """
+        if isinstance(df, np.ndarray):
+            return df[rows]
+        return df.iloc[rows]
+
+    def find_matching_rows(self, df, target, start_tol=25, max_tol=40, step=3) -> "tuple[np.ndarray | pd.DataFrame, int]":
         """
         Find rows in the dataframe that match the target values within a dynamically
         increasing tolerance. If no rows are found for a very small tolerance, the
@@ -36,55 +227,161 @@ class GamePiecePosEstimator:
         tolerance is reached.
 
         Parameters:
-            df (pd.DataFrame): DataFrame with the columns.
+            df (np.ndarray | pd.DataFrame): Structured array or DataFrame with the columns.
             target (dict): Target values for each column.
             start_tol (int): Starting tolerance measured in pixels.
             max_tol (int): Maximum allowed tolerance measured in pixels.
             step (int): Increment to increase tolerance on each iteration measured in pixels.
 
         Returns:
-            filtered_df (pd.DataFrame): DataFrame with matching rows.
+            filtered_df (np.ndarray | pd.DataFrame): The matching rows, same type as df.
 
             used_tol (int): Tolerance at which the matching rows were found.
         """
+        # The estimator's own data is searched through the prebuilt index,
+        # any other data frame falls back to a full scan
+        # (a target without the image angle is matched on the rectangle columns of the index)
+        use_index = df is self.data and all(column in target for column in self.MATCH_COLUMNS)
+        if use_index:
+            point = np.array([target[column] for column in self.match_columns if column in target], dtype=np.float64)
+
         tolerance = start_tol
         while tolerance <= max_tol:
-            # Create mask using np.isclose for each column
-            mask = (
-                np.isclose(df['Center_X'], target['Center_X'], atol=tolerance) &
-                np.isclose(df['Center_Y'], target['Center_Y'], atol=tolerance) &
-                np.isclose(df['Width'], target['Width'], atol=tolerance) &
-                np.isclose(df['Height'], target['Height'], atol=tolerance)
-            )
-            filtered_df = df[mask]
+            if use_index:
+                filtered_df = self.select_rows(df, self.index.within(point, tolerance))
+            else:
+                # Create mask using np.isclose for each column
+                mask = (
+                    np.isclose(df['Center_X'], target['Center_X'], atol=tolerance) &
+                    np.isclose(df['Center_Y'], target['Center_Y'], atol=tolerance) &
+                    np.isclose(df['Width'], target['Width'], atol=tolerance) &
+                    np.isclose(df['Height'], target['Height'], atol=tolerance)
+                )
+                filtered_df = df[mask]
             
             # Check if any row is found
-            if not filtered_df.empty:
-                print(f"Found rows with tolerance: {tolerance}")
+            if len(filtered_df) > 0:
                 return filtered_df, tolerance
             
             # Increase the tolerance and try again
             tolerance += step
 
         # No rows found within maximum tolerance
-        print("No rows found within the max tolerance.")
-        return df.iloc[[]], tolerance  # Return an empty DataFrame
+        return df[:0], tolerance  # Return an empty DataFrame
     
+    def interpolate_position(self, target : np.ndarray, max_tol : int = 40) -> tuple[float, float, float] | None:
+        """
+        Interpolates the position between the k rows nearest to the target in
+        normalized feature space, weighting every row by its inverse squared distance.
+
+        Parameters:
+            target (np.ndarray): The (Center_X, Center_Y, Width, Height) of the rectangle.
+            max_tol (int): No position is returned when even the closest row is
+                           further than this on some column, measured in pixels.
+
+        Returns:
+            tuple[float, float, float] | None: The (x_position, y_position, certainty),
+                where the certainty is 50 minus the pixel distance to the closest row
+                (the same scale as the tolerance method), or None.
+        """
+        target = np.asarray(target, dtype=np.float64)
+        rows, distances = self.knn_index.nearest(target / self.feature_scale, self.k, norm=2)
+        if len(rows) == 0:
+            return None
+
+        # The L-infinity pixel distance to the closest row, the same measure as the tolerance
+        pixel_distance = float(np.abs(self.index.features[rows, :len(target)] - target).max(axis=1).min())
+        if pixel_distance > max_tol:
+            return None
+
+        exact = distances == 0
+        if np.any(exact):
+            # The target is a rendered rectangle, no interpolation needed
+            x_position, y_position = self.positions[rows[exact]].mean(axis=0)
+        else:
+            weights = distances ** -self.KNN_POWER
+            x_position, y_position = weights @ self.positions[rows] / weights.sum()
+        return (float(x_position), float(y_position), 50 - pixel_distance)
+
+    def predict_positions(self, targets : np.ndarray, max_tol : int = 40) -> np.ndarray:
+        """
+        Computes the positions of several targets with the regression model.
+
+        Parameters:
+            targets (np.ndarray): An (N, 4) array of (Center_X, Center_Y, Width, Height),
+                                  or (N, 5) with the image angle for an oriented model.
+            max_tol (int): No position is returned for targets whose size is further than
+                           this from the sizes the model was fitted on, measured in pixels.
+
+        Returns:
+            np.ndarray: An (N, 3) array of (x_position, y_position, certainty), NaN where
+                        the target is out of range. The certainty is 50 minus the pixel
+                        distance outside the fitted sizes. (N, 4) with the yaw,
+                        (x_position, y_position, yaw, certainty), for an oriented model,
+                        which needs the image angle of every target.
+
+        Raises:
+            ValueError: When the targets do not have the model's input columns (an
+                        oriented model given rectangles without an image angle).
+        """
+        with_angle = self.oriented and targets.shape[1] > len(self.MATCH_COLUMNS)
+        if not with_angle:
+            targets = targets[:, :len(self.MATCH_COLUMNS)]
+        if targets.shape[1] != len(self.model.input_columns):
+            raise ValueError(f"The model takes {self.model.input_columns}, got targets of {targets.shape[1]} columns "
+                             f"(a model fitted on an oriented dataset needs the image angle of every rectangle)")
+        positions = np.full((len(targets), 4 if with_angle else 3), np.nan)
+        outside = self.model.distance_outside(targets)
+        valid = (outside <= max_tol) & ~np.isnan(targets).any(axis=1)
+        if np.any(valid):
+            predicted = self.model.predict(targets[valid])
+            positions[valid, :2] = predicted[:, :2]
+            if with_angle:
+                positions[valid, 2] = predicted[:, 2]
+            positions[valid, -1] = 50 - outside[valid]
+        return positions
+
     def estimate_position(self, rectangle: np.ndarray) -> tuple[tuple[float, float], int]:
         """
         Estimates the position of a game piece based on its bounding rectangle.
 
         Parameters:
             rectangle (np.ndarray): A numpy array containing the bounding rectangle
-                                    in the format [x, y, width, height].
+                                    in the format [x, y, width, height], or
+                                    [x, y, width, height, angle] in oriented mode
+                                    (see ColorDetection.find_angle).
 
         Returns:
             tuple[tuple[int, int], int]: A tuple containing the estimated position
                                           (center_x, center_y) and the estimated certainty.
+                                          (x, y, yaw, certainty) for a rectangle with an
+                                          angle when the data is oriented.
         """
-        x, y, w, h = rectangle
+        x, y, w, h = rectangle[:4]
         center_x = x + w // 2
         center_y = y + h // 2
+        angle = rectangle[4] if len(rectangle) > 4 and self.oriented else None
+
+        if self.cache_size:
+            target = (center_x, center_y, w, h) if angle is None else (center_x, center_y, w, h, angle)
+            key = self.cache_key(target, (25, 40, 3))
+            position = self.cache_get(key)
+            if position is False:
+                position = self.search_position(center_x, center_y, w, h, angle)
+                self.cache_put(key, position)
+            return position
+        return self.search_position(center_x, center_y, w, h, angle)
+
+    def search_position(self, center_x : int, center_y : int, w : int, h : int, angle : float | None = None) -> tuple[float, ...] | None:
+        """ Estimates the position of the game piece of a rectangle center and size (and angle), without the cache. """
+        if self.lut is not None:
+            return self.lut.lookup(center_x, center_y, w, h)
+        if self.model is not None:
+            target = [center_x, center_y, w, h] + ([] if angle is None else [angle])
+            position = self.predict_positions(np.array([target], dtype=np.float64))[0]
+            return None if np.isnan(position[0]) else tuple(float(value) for value in position)
+        if self.method == "knn":
+            return self.interpolate_position(np.array([center_x, center_y, w, h]))
         
         target = {
             'Center_X': center_x,
@@ -92,11 +389,136 @@ class GamePiecePosEstimator:
             'Width': w,
             'Height': h
         }
+        # Without an angle (the contour had no straight edges) only the rectangle is matched
+        if angle is not None and not np.isnan(angle):
+            target[self.ANGLE_COLUMN] = angle
         
         matching_rows, used_tol = self.find_matching_rows(self.data, target, 25, 40, 3)
         
-        if not matching_rows.empty:
-            return (matching_rows['x_position'].mean(), matching_rows['y_position'].mean(), (50 - used_tol))
+        if len(matching_rows) > 0:
+            x_position = np.asarray(matching_rows['x_position'], dtype=np.float64).mean()
+            y_position = np.asarray(matching_rows['y_position'], dtype=np.float64).mean()
+            if angle is not None:
+                # Without an angle the rows of every rotation match, their mean is no yaw
+                yaw = np.nan if np.isnan(angle) else self.circular_mean(matching_rows[self.YAW_COLUMN], self.yaw_period)
+                return (x_position, y_position, yaw, (50 - used_tol))
+            return (x_position, y_position, (50 - used_tol))
         
         # If no match is found, return None for position and 0 for certainty
-        return None
\ No newline at end of file
+        return None
+
+    def estimate_positions(self, rectangles : np.ndarray, start_tol : int = 25, max_tol : int = 40, step : int = 3) -> np.ndarray:
+        """
+        Estimates the positions of several game pieces at once, applying the same
+        widening tolerance rule as estimate_position to every rectangle in a
+        single vectorized pass over the candidate rows.
+
+        Parameters:
+            rectangles (np.ndarray): An (N, 4) array of bounding rectangles
+                                     in the format [x, y, width, height], or (N, 5)
+                                     with the image angle in oriented mode.
+
+        Returns:
+            np.ndarray: An (N, 3) array of (x_position, y_position, certainty),
+                        the row is NaN where no match was found. (N, 4) with the
+                        yaw, (x_position, y_position, yaw, certainty), for rectangles
+                        with an angle when the data is oriented.
+        """
+        rectangles = np.asarray(rectangles)
+        rectangles = rectangles.reshape(-1, rectangles.shape[-1] if rectangles.ndim == 2 or rectangles.shape == (5,) else 4)
+        columns = 5 if rectangles.shape[1] == 5 and self.oriented else 4
+        positions = np.full((len(rectangles), columns - 1), np.nan)
+        if len(rectangles) == 0:
+            return positions
+
+        x, y, w, h = rectangles[:, :4].T
+        targets = np.column_stack((x + w // 2, y + h // 2, w, h) + tuple(rectangles[:, 4:columns].T)).astype(np.float64)
+        if not self.cache_size:
+            return self.search_positions(targets, start_tol, max_tol, step)
+
+        # Only the rectangles that are not cached are searched, in one pass
+        keys = [self.cache_key(target, (start_tol, max_tol, step)) for target in targets]
+        missing = []
+        for i, key in enumerate(keys):
+            position = self.cache_get(key)
+            if position is False:
+                missing.append(i)
+            elif position is not None:
+                positions[i] = position
+        if missing:
+            positions[missing] = self.search_positions(targets[missing], start_tol, max_tol, step)
+            for i in missing:
+                self.cache_put(keys[i], None if np.isnan(positions[i, 0]) else tuple(float(value) for value in positions[i]))
+        return positions
+
+    def search_positions(self, targets : np.ndarray, start_tol : int = 25, max_tol : int = 40, step : int = 3) -> np.ndarray:
+        """
+        Estimates the positions of several (Center_X, Center_Y, Width, Height[, angle])
+        targets, without the cache. The angle is only used in oriented mode.
+        """
+        with_angle = targets.shape[1] > len(self.MATCH_COLUMNS) and self.oriented
+        if not with_angle:
+            targets = targets[:, :len(self.MATCH_COLUMNS)]
+        positions = np.full((len(targets), 4 if with_angle else 3), np.nan)
+        if self.lut is not None:
+            for i, target in enumerate(targets):
+                position = self.lut.lookup(*target)
+                if position is not None:
+                    positions[i] = position
+            return positions
+
+        if self.model is not None:
+            return self.predict_positions(targets, max_tol)
+
+        if self.method == "knn":
+            for i, target in enumerate(targets):
+                position = self.interpolate_position(target, max_tol)
+                if position is not None:
+                    positions[i] = position
+            return positions
+
+        # Only rows within the max tolerance of some rectangle can match, the index
+        # finds them without scanning the table. It also matches on the image angle
+        # when the target has one, a missing angle is left out of the query
+        if not np.isnan(targets[:, :len(self.MATCH_COLUMNS)]).any():
+            queries = [target[:len(self.MATCH_COLUMNS)] if np.isnan(target[-1]) else target for target in targets]
+            rows = np.unique(np.concatenate([self.index.within(query, max_tol) for query in queries]))
+        else:
+            rows = np.arange(len(self.index))
+        if len(rows) == 0:
+            return positions
+
+        features = self.index.features[rows, :targets.shape[1]]
+        row_positions = self.positions[rows]
+
+        # The smallest tolerance each row passes for each rectangle, using the
+        # np.isclose rule of find_matching_rows
+        difference = np.abs(features[None, :, :] - targets[:, None, :])
+        if with_angle:
+            # The image angle wraps around, a missing angle (a contour without
+            # straight edges) matches every row
+            angle_difference = np.mod(difference[:, :, -1], self.ANGLE_PERIOD)
+            difference[:, :, -1] = np.nan_to_num(np.minimum(angle_difference, self.ANGLE_PERIOD - angle_difference))
+        excess = difference - GridIndex.RTOL * np.abs(np.nan_to_num(targets[:, None, :]))
+        distance = excess.max(axis=2)
+
+        tolerances = np.arange(start_tol, max_tol + 1, step)
+        if len(tolerances) == 0:
+            return positions
+        closest = distance.min(axis=1)
+        # The last tried tolerance, which is below max_tol when the steps do not reach it exactly
+        found = closest <= tolerances[-1]
+        used_tol = tolerances[np.minimum(np.searchsorted(tolerances, closest), len(tolerances) - 1)]
+
+        mask = distance <= used_tol[:, None]
+        counts = mask.sum(axis=1)
+        sums = mask.astype(np.float64) @ row_positions
+        positions[found, :2] = sums[found] / counts[found, None]
+        positions[found, -1] = 50 - used_tol[found]
+        if with_angle:
+            # The circular mean of the matching rows' rotations, the yaw stays NaN
+            # without an angle (the rows of every rotation match)
+            known = found & ~np.isnan(targets[:, -1])
+            yaw_sums = mask[known].astype(np.float64) @ self.yaw_vectors[rows]
+            positions[known, 2] = np.arctan2(yaw_sums[:, 1], yaw_sums[:, 0]) * self.yaw_period / (2 * np.pi) % self.yaw_period
+        return positions
@@ -0,0 +1,123 @@
+import multiprocessing as mp
+import numpy as np
+
+class LatestValue:
+    """
+    A single slot channel between processes that only keeps the newest value.
+
+    `put` overwrites whatever is in the slot and never blocks the producer on a
+    slow consumer. `get` sleeps until a value newer than the last one this
+    process received arrives, so consumers neither spin nor see stale data.
+    The value is a fixed size numpy record stored in shared memory, so nothing
+    is pickled on the way.
+
+    Attributes
+    ----------
+    dtype : np.dtype
+        The (usually structured) dtype of the value
+
+    condition : mp.Condition
+        Signaled on every put, several LatestValues may share one so that a
+        consumer can wait on all of them (see wait_any)
+
+    Methods
+    -------
+    put(value) -> bool
+        Replaces the value, wakes up the waiting consumers and returns whether
+        an unread value was dropped
+    get(timeout: float | None = None) -> np.void | None
+        Waits for a value newer than the last one received and returns a copy of it
+    peek() -> np.void
+        Returns a copy of the current value without receiving it
+    has_new() -> bool
+        Checks whether a value newer than the last one received is waiting
+    wait_any(values: list[LatestValue], timeout: float | None = None) -> bool
+        Waits until any of several LatestValues sharing a condition has a new value
+    """
+
+    def __init__(self, dtype : np.dtype, condition=None):
+        self.dtype = np.dtype(dtype)
+        self.buffer = mp.RawArray('B', self.dtype.itemsize)
+        self.version = mp.RawValue('q', 0)
+        # The newest version any consumer has received, used to count dropped values
+        self.read_version = mp.RawValue('q', 0)
+        self.condition = condition if condition is not None else mp.Condition()
+        self.value = np.frombuffer(self.buffer, dtype=self.dtype, count=1)
+
+        # The newest version this process has received, every consumer
+        # process keeps its own copy
+        self.last_version = 0
+
+    def __getstate__(self):
+        # The numpy view cannot be pickled, it is recreated over the shared buffer
+        state = self.__dict__.copy()
+        del state['value']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.value = np.frombuffer(self.buffer, dtype=self.dtype, count=1)
+
+    def put(self, value) -> bool:
+        """
+        Replaces the value and wakes up the waiting consumers
+
+        Returns
+        -------
+        bool
+            True if the previous value was overwritten before anyone read it
+        """
+        with self.condition:
+            dropped = self.read_version.value != self.version.value
+            self.value[0] = value
+            self.version.value += 1
+            self.condition.notify_all()
+        return dropped
+
+    def get(self, timeout : float | None = None) -> np.void | None:
+        """
+        Waits for a value newer than the last one received and returns a copy of it
+
+        Parameters
+        ----------
+        timeout : float | None
+            The maximum time to wait in seconds, None waits forever
+
+        Returns
+        -------
+        np.void | None
+            The newest value, or None if nothing new arrived before the timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.version.value != self.last_version, timeout):
+                return None
+            self.last_version = self.version.value
+            self.read_version.value = self.last_version
+            return self.value[0].copy()
+
+    def peek(self) -> np.void:
+        """
+        Returns a copy of the current value (all zeros before the first put) without
+        receiving it, for observers that must not change what the consumer sees as
+        new or what is counted as dropped
+        """
+        with self.condition:
+            return self.value[0].copy()
+
+    def has_new(self) -> bool:
+        """ Checks whether a value newer than the last one received is waiting. """
+        return self.version.value != self.last_version
+
+    @staticmethod
+    def wait_any(values : list["LatestValue"], timeout : float | None = None) -> bool:
+        """
+        Waits until any of the values has something new, they must share one condition
+
+        Returns
+        -------
+        bool
+            False if nothing new arrived before the timeout
+        """
+        condition = values[0].condition
+        with condition:
+            return condition.wait_for(lambda: any(value.has_new() for value in values), timeout)
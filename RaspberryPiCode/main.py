@@ -1,88 +1,419 @@
+import json
+import math
 import multiprocessing as mp
+import os
+import sys
+import time
 import cv2
 import numpy as np
-import pandas as pd
+from dataset import load_dataset
+from debug_stream import STREAM_NICENESS, DebugOverlay
 from frame_capture import FrameCapture
+from frame_ring import FrameRing
 from game_piece_detection import ColorDetection
 from game_piece_pos_estimation import GamePiecePosEstimator
+from latest_value import LatestValue
+from lookup_table import LookupTable
 from network_manager import NetworkManager
+from projection_estimation import ProjectionEstimator
+from regression_model import RegressionModel
+from telemetry import PipelineTelemetry
 
-def frame_capture_process(queue : mp.Queue, camera_id : int, resolution : tuple[int, int], fps : int):
-    frame_capture = FrameCapture(camera_id, resolution, fps)
-    while True:
-        frame, timestamp = frame_capture.capture_frame()
-        if not queue.full():
-            queue.put((frame, timestamp))
+# Messages passed between the stages, each stage only ever sees the newest one.
+# "timestamp" is when the frame was captured, "sent" when the previous stage finished.
+# The angles are NaN unless the detection is oriented, the positions are
+# (x, y, yaw, certainty) with a NaN yaw unless the estimator is oriented
+MAX_DETECTIONS = 8
+FRAME_MESSAGE = np.dtype([('slot', np.int64), ('sequence', np.int64), ('sent', np.float64)])
+DETECTION_MESSAGE = np.dtype([('timestamp', np.float64), ('sent', np.float64), ('count', np.int64), ('rects', np.int32, (MAX_DETECTIONS, 4)),
+                              ('angles', np.float64, (MAX_DETECTIONS,))])
+POSITION_MESSAGE = np.dtype([('timestamp', np.float64), ('sent', np.float64), ('count', np.int64), ('positions', np.float64, (MAX_DETECTIONS, 4)),
+                             ('rects', np.int32, (MAX_DETECTIONS, 4))])
+
+# How long the network process waits for a position before publishing "no target"
+NO_TARGET_TIMEOUT = 0.1
+
+# Certainty of an oriented game piece without an image angle (not oriented detection, or
+# a contour without straight edges), the lowest a match gets (50 - the 40 pixel max
+# tolerance): it is matched on the rectangle alone, over every rotation, and its yaw
+# is published as 0
+UNKNOWN_YAW_CERTAINTY = 10.0
+
+# When a position is published (see NetworkManager): only when it moved, turned or its
+# certainty changed beyond the deadbands, or the heartbeat (seconds) expired, and at
+# most max_rate times a second per camera. "No target" is published once
+PUBLISHING = {"position_deadband": 0.02, "yaw_deadband": 2.0, "certainty_deadband": 5.0, "heartbeat": 0.5, "max_rate": 50}
+
+# Per stage durations, the time each message waited for the next stage, and drops
+TELEMETRY_METRICS = ['capture', 'detection_wait', 'detection', 'estimation_wait', 'estimation', 'publish_wait', 'publish', 'end_to_end', 'stream']
+TELEMETRY_COUNTERS = ['frames', 'frames_dropped', 'stale_frames', 'detections_dropped', 'positions_dropped', 'cache_hits', 'cache_misses',
+                      'stream_frames', 'stream_skipped']
+TELEMETRY_PERIOD = 1.0  # seconds
+
+# Debug stream settings, a camera's "debug_stream" entry overrides them. Every stream
+# is served by its own process, on its own MJPEG port: "port" or, when None, the
+# first stream port plus the camera's index (1181, 1182, ...)
+DEBUG_STREAM = {"resolution": [640, 360], "fps": 15, "cores": None, "port": None}
+FIRST_STREAM_PORT = 1181
+
+# Team number for network management
+TEAM_NUMBER = 5554
+
+# One entry per camera, each runs its own capture, detection and estimation
+# processes and publishes under its own topic prefix ("" publishes directly in
+# "datatable", so a single camera keeps the original topic names).
+# The same settings can be loaded from a JSON file: python main.py cameras.json
+CAMERAS = [
+    {
+        "topic_prefix": "",
+        # A camera index, a device path (/dev/video0), a video file or an image folder,
+        # e.g. 'TestingImages/2024-Ring' replays the testing images without a camera
+        "source": 0,
+        "resolution": [1280, 720],
+        "fps": 120,
+        "lower_bound": [9, 35, 0],  # Example lower bound for color detection
+        "upper_bound": [31, 255, 255],  # Example upper bound for color detection
+        # The search runs at half resolution with a full resolution refinement.
+        # Add "tracking": True to only search a window around the largest game piece
+        # between full searches (every "search_interval" frames, 30 by default). It is
+        # much cheaper, but the other game pieces are then reported at their position
+        # from the last full search, and a game piece entering the frame is only found
+        # by the next one.
+        # Add "oriented": True for non symmetrical game pieces (with the 2025 Coral
+        # dataset), the image angle is then matched and the yaw published
+        "detection": {"pyramid_scale": 2},
+        # Estimator data (example data), it is converted to the binary dataset
+        # format next to the CSV on the first run so later startups only memory map it
+        "dataset": "Data/2024-Note/FullData.csv",
+        # GamePiecePosEstimator options, "method": "knn" interpolates between the
+        # nearest rendered rectangles instead of averaging a tolerance window.
+        # The cache keeps the results of the last rectangles. "cache_bucket": 2 rounds them
+        # to 2 pixels for more hits, but then nearby rectangles get the first one's position
+        # (up to about 4 cm off on the 2024 Note)
+        "estimation": {"method": "tolerance", "cache_size": 256, "cache_bucket": 1},
+        # Use the regression model fitted next to the dataset instead of the dataset
+        # itself (python regression_model.py Data/2024-Note/FullData.csv)
+        "use_model": False,
+        # Use the lookup table built next to the dataset instead of searching the dataset
+        # (python lookup_table.py Data/2024-Note/FullData.csv), a lookup is two array reads
+        # but the positions are off from the search by about 3 cm (symmetrical pieces only)
+        "lut": False,
+        # A camera file of projection_estimation.py, when set the positions are computed
+        # from the camera's projection and no dataset is loaded (symmetrical pieces only)
+        "projection": None,
+        # CPU cores the detection and estimation processes run on, None to let the OS choose.
+        # Cameras of a JSON file are not pinned unless they set their own cores
+        "detection_cores": [1],
+        "estimation_cores": [2],
+        # An annotated, downscaled video stream of the camera for debugging, e.g. {} for the
+        # DEBUG_STREAM settings or {"fps": 10, "cores": [3]} (a core the pipeline does not
+        # use, see debug_stream_process), None for no stream
+        "debug_stream": None,
+    },
+]
 
-def detection_process(queue : mp.Queue, detection_queue : mp.Queue, lower_bound : np.ndarray, upper_bound : np.ndarray):
-    color_detection = ColorDetection(lower_bound, upper_bound)
+def load_config(path : str) -> tuple[int, list[dict], dict]:
+    """
+    Loads the team number, camera list and publishing settings from a JSON file
+    of the form {"team_number": 5554, "cameras": [{...}, ...], "publishing": {...}},
+    every camera takes the keys of the CAMERAS entries, missing keys default to
+    the first entry's (and to PUBLISHING's), except the cores: they default to None
+    so that two cameras are never pinned to the same cores
+    """
+    with open(path) as file:
+        config = json.load(file)
+    defaults = {**CAMERAS[0], "detection_cores": None, "estimation_cores": None}
+    cameras = [{**defaults, **camera} for camera in config["cameras"]]
+    return config.get("team_number", TEAM_NUMBER), cameras, {**PUBLISHING, **config.get("publishing", {})}
+
+def pin_to_cores(cores : list[int] | None):
+    """ Pins the calling process to the given CPU cores, where the OS supports it (Linux). """
+    if not cores or not hasattr(os, "sched_setaffinity"):
+        return
+    available = os.sched_getaffinity(0)
+    cores = [core for core in cores if core in available]
+    if cores:
+        os.sched_setaffinity(0, cores)
+    else:
+        print("None of the requested cores are available, process is not pinned")
+
+def warn_shared_cores(cameras : list[dict]):
+    """ Prints a warning for every CPU core more than one pinned process of the cameras runs on. """
+    processes = {}
+    for camera in cameras:
+        name = camera["topic_prefix"] or "camera"
+        stream_cores = (camera["debug_stream"] or {}).get("cores", DEBUG_STREAM["cores"])
+        for stage, cores in (("detection", camera["detection_cores"]), ("estimation", camera["estimation_cores"]), ("debug stream", stream_cores)):
+            for core in cores or []:
+                processes.setdefault(core, []).append(f"{name} {stage}")
+    for core, names in sorted(processes.items()):
+        if len(names) > 1:
+            print(f"Warning: core {core} is shared by {', '.join(names)}, they will slow each other down")
+
+def frame_capture_process(frame_mailbox : LatestValue, frame_ring : FrameRing, telemetry : PipelineTelemetry, camera_id : int | str, resolution : tuple[int, int], fps : int):
+    # The grab thread decodes straight into the shared memory slots, only their index is sent
+    frame_capture = FrameCapture(camera_id, resolution, fps, ring=frame_ring)
     while True:
-        if not queue.empty():
-            frame, timestamp = queue.get()
-            rect = color_detection.detect_color(frame)
-            if rect is None:
-                continue
-            if not detection_queue.full():
-                detection_queue.put((rect, timestamp))
+        slot, sequence, timestamp = frame_capture.capture_slot()
 
-def position_estimation_process(detection_queue : mp.Queue, position_queue : mp.Queue, estimator_data : pd.DataFrame):
-    estimator = GamePiecePosEstimator(1280, 720, estimator_data)
+        sent = time.time()
+        telemetry.record('capture', sent - timestamp)
+        telemetry.count('frames')
+        if frame_mailbox.put((slot, sequence, sent)):
+            telemetry.count('frames_dropped')
+
+def detection_process(frame_mailbox : LatestValue, detection_mailbox : LatestValue, frame_ring : FrameRing, telemetry : PipelineTelemetry,
+                      lower_bound : np.ndarray, upper_bound : np.ndarray, resolution : tuple[int, int], detection_options : dict, cores : list[int] | None):
+    pin_to_cores(cores)
+    # The work buffers are allocated for the camera resolution before the first frame
+    color_detection = ColorDetection(lower_bound, upper_bound, resolution=resolution, **detection_options)
     while True:
-        if not detection_queue.empty():
-            rect, timestamp = detection_queue.get()
-            position = estimator.estimate_position(rect)
-            if position is None:
+        message = frame_mailbox.get()
+        start = time.time()
+        telemetry.record('detection_wait', start - message['sent'])
+
+        slot, sequence = int(message['slot']), int(message['sequence'])
+        frame_ring.claim(slot)
+        try:
+            # Drop the frame if the capture process reused the slot before or while it was read
+            if not frame_ring.is_current(slot, sequence):
+                telemetry.count('stale_frames')
                 continue
-            if not position_queue.full():
-                position_queue.put((position, timestamp))
+            timestamp = frame_ring.timestamp(slot)
+            rects = color_detection.detect_color(frame_ring.frame(slot))
+            if not frame_ring.is_current(slot, sequence):
+                telemetry.count('stale_frames')
+                continue
+        finally:
+            frame_ring.release(slot)
+
+        sent = time.time()
+        telemetry.record('detection', sent - start)
+        if len(rects) == 0:
+            continue
 
-def network_management_process(position_queue : mp.Queue, team_number : int):
-    network_manager = NetworkManager(team_number)
+        rects = rects[:MAX_DETECTIONS]
+        message = np.zeros((), dtype=DETECTION_MESSAGE)
+        message['timestamp'], message['sent'], message['count'] = timestamp, sent, len(rects)
+        message['rects'][:len(rects)] = rects[:, :4]
+        message['angles'] = np.nan
+        if rects.shape[1] > 4:
+            message['angles'][:len(rects)] = rects[:, 4]
+        if detection_mailbox.put(message):
+            telemetry.count('detections_dropped')
+
+def position_estimation_process(detection_mailbox : LatestValue, position_mailbox : LatestValue, telemetry : PipelineTelemetry,
+                                dataset_path : str | None, lut_path : str | None, model : RegressionModel | None, projection : ProjectionEstimator | None,
+                                resolution : tuple[int, int], estimator_options : dict, cores : list[int] | None):
+    pin_to_cores(cores)
+    if projection is not None:
+        estimator = projection
+    else:
+        # The binary dataset (or lookup table) is memory mapped here rather than copied from the main process
+        estimator_data = load_dataset(dataset_path) if dataset_path is not None else None
+        lut = LookupTable.load(lut_path) if lut_path is not None else None
+        estimator = GamePiecePosEstimator(resolution[0], resolution[1], estimator_data, lut=lut, model=model, **estimator_options)
+    cached = isinstance(estimator, GamePiecePosEstimator) and estimator.cache_size > 0
+    # Oriented datasets (2025 Coral) match the image angles and estimate a yaw
+    oriented = isinstance(estimator, GamePiecePosEstimator) and estimator.oriented
+    cache_hits = cache_misses = 0
     while True:
-        if not position_queue.empty():
-            position, timestamp = position_queue.get()
-            x, y, certainty = position[0], position[1], position[2]
-            network_manager.publish_game_piece_position(x, y, 0, certainty)
+        message = detection_mailbox.get()
+        start = time.time()
+        telemetry.record('estimation_wait', start - message['sent'])
 
-            # When the game piece is non-symmetrical, you can pass the rotation angle as well
-            # network_manager.publish_game_piece_position(x, y, rotation_angle, certainty)
+        rects = message['rects'][:message['count']]
+        if oriented:
+            positions = estimator.estimate_positions(np.column_stack((rects, message['angles'][:message['count']])))
+            unknown_yaw = np.isnan(positions[:, 2])
+            positions[unknown_yaw, 3] = np.minimum(positions[unknown_yaw, 3], UNKNOWN_YAW_CERTAINTY)
         else:
-            # If no position is available, you can publish a default value or wait
-            network_manager.publish_game_piece_position(0, 0, 0, 0)
+            positions = np.insert(estimator.estimate_positions(rects), 2, np.nan, axis=1)
+        # Drop the rectangles that did not match the dataset
+        matched = ~np.isnan(positions[:, 0])
+        positions, rects = positions[matched], rects[matched]
+        if cached:
+            telemetry.count('cache_hits', estimator.cache_hits - cache_hits)
+            telemetry.count('cache_misses', estimator.cache_misses - cache_misses)
+            cache_hits, cache_misses = estimator.cache_hits, estimator.cache_misses
+
+        sent = time.time()
+        telemetry.record('estimation', sent - start)
+        if len(positions) == 0:
+            continue
+
+        timestamp = message['timestamp']
+        message = np.zeros((), dtype=POSITION_MESSAGE)
+        message['timestamp'], message['sent'], message['count'] = timestamp, sent, len(positions)
+        message['positions'][:len(positions)] = positions
+        message['rects'][:len(rects)] = rects
+        if position_mailbox.put(message):
+            telemetry.count('positions_dropped')
+
+def debug_stream_process(frame_ring : FrameRing, position_mailbox : LatestValue, telemetry : PipelineTelemetry, team_number : int,
+                         prefix : str, resolution : tuple[int, int], stream_options : dict):
+    # The stream samples the newest frame at its own rate instead of receiving every
+    # frame, so it never holds back the pipeline. It runs at a low priority, but on the
+    # cores of the detection or estimation it still adds to their p95/p99 latencies:
+    # give it a spare core ("cores") to leave them alone
+    if hasattr(os, "nice"):
+        os.nice(STREAM_NICENESS)
+    cv2.setNumThreads(1)
+    pin_to_cores(stream_options["cores"])
+    stream_resolution = tuple(stream_options["resolution"])
+    network_manager = NetworkManager(team_number, (), stream_name=f"Camera {prefix}" if prefix else "Camera",
+                                     stream_resolution=stream_resolution, stream_fps=stream_options["fps"], stream_port=stream_options["port"],
+                                     client_name="raspberrypi_stream" + (f"_{prefix}" if prefix else ""))
+    overlay = DebugOverlay(resolution, stream_resolution)
+    period = 1.0 / stream_options["fps"]
+    next_frame = time.time()
+    while True:
+        time.sleep(max(next_frame - time.time(), 0))
+        next_frame = max(next_frame + period, time.time())
+
+        latest = frame_ring.latest()
+        if latest is None:
+            continue
+        slot, sequence = latest
+        start = time.time()
+        # Reader 1 of the ring, the slot is only held while it is resized
+        frame_ring.claim(slot, 1)
+        try:
+            current = frame_ring.is_current(slot, sequence)
+            if current:
+                timestamp = frame_ring.timestamp(slot)
+                overlay.downscale(frame_ring.frame(slot))
+                current = frame_ring.is_current(slot, sequence)
+        finally:
+            frame_ring.release(slot, 1)
+        if not current:
+            telemetry.count('stream_skipped')
+            continue
+
+        # The newest positions, drawn if they belong to about the same moment as the frame
+        message = position_mailbox.peek()
+        if abs(message['timestamp'] - timestamp) < NO_TARGET_TIMEOUT:
+            overlay.draw(message['rects'][:message['count']], message['positions'][:message['count']])
+        network_manager.publish_image(overlay.image)
+
+        telemetry.record('stream', time.time() - start)
+        telemetry.count('stream_frames')
+
+def network_management_process(position_mailboxes : list[LatestValue], telemetries : list[PipelineTelemetry], prefixes : list[str], team_number : int,
+                               publishing : dict):
+    # One process publishes for every camera, it wakes up on whichever camera
+    # has a new position so a slow camera never holds back the others
+    network_manager = NetworkManager(team_number, prefixes, **publishing, stream_name=None)
+    previous_snapshots = [telemetry.snapshot() for telemetry in telemetries]
+    now = time.time()
+    next_report = now + TELEMETRY_PERIOD
+    no_target_deadlines = [now + NO_TARGET_TIMEOUT] * len(position_mailboxes)
+    while True:
+        timeout = max(min(no_target_deadlines + [next_report]) - time.time(), 0)
+        LatestValue.wait_any(position_mailboxes, timeout)
+
+        for camera, (position_mailbox, telemetry, prefix) in enumerate(zip(position_mailboxes, telemetries, prefixes)):
+            message = position_mailbox.get(timeout=0)
+            if message is not None:
+                start = time.time()
+                telemetry.record('publish_wait', start - message['sent'])
+
+                # Symmetrical game pieces (and oriented ones without an image angle, at a
+                # low certainty) have no yaw, it is published as 0
+                positions = np.nan_to_num(message['positions'][:message['count']])
+                # The largest game piece and all of them are published together, when
+                # any game piece changed (or appeared, or vanished)
+                network_manager.publish_game_pieces(positions, prefix, message['timestamp'])
+
+                end = time.time()
+                telemetry.record('publish', end - start)
+                telemetry.record('end_to_end', end - message['timestamp'])
+                no_target_deadlines[camera] = end + NO_TARGET_TIMEOUT
+            elif time.time() >= no_target_deadlines[camera]:
+                # No position arrived for a while, "no target" is published once and
+                # the process sleeps until the next position (or telemetry report)
+                network_manager.publish_no_target(prefix)
+                no_target_deadlines[camera] = math.inf
+
+        # Publish the latency percentiles of the last period
+        if time.time() >= next_report:
+            for camera, (telemetry, prefix) in enumerate(zip(telemetries, prefixes)):
+                snapshot = telemetry.snapshot()
+                network_manager.publish_telemetry(telemetry.summary(previous_snapshots[camera], snapshot), prefix)
+                previous_snapshots[camera] = snapshot
+            next_report += TELEMETRY_PERIOD
 
 
 def main():
-    camera_id = 0
-    
-    # Camera resolution and FPS settings
-    resolution = (1280, 720)
-    camera_fps = 120
+    team_number, cameras, publishing = load_config(sys.argv[1]) if len(sys.argv) > 1 else (TEAM_NUMBER, CAMERAS, PUBLISHING)
+    prefixes = [camera["topic_prefix"] for camera in cameras]
+    if len(set(prefixes)) != len(prefixes):
+        raise ValueError("Every camera needs its own topic_prefix")
+    warn_shared_cores(cameras)
 
-    lower_bound = np.array([9, 35, 0])  # Example lower bound for color detection
-    upper_bound = np.array([31, 255, 255])  # Example upper bound for color detection
+    # Every position mailbox signals the same condition, so that the network
+    # process can wait on all cameras at once
+    position_condition = mp.Condition()
+    position_mailboxes, telemetries, frame_rings, processes = [], [], [], []
 
-    # Team number for network management
-    team_number = 5554  # Team number
+    for index, camera in enumerate(cameras):
+        resolution = tuple(camera["resolution"])
+        lower_bound = np.array(camera["lower_bound"])
+        upper_bound = np.array(camera["upper_bound"])
 
-    frame_queue = mp.Queue(maxsize=1)
-    detection_queue = mp.Queue(maxsize=1)
-    position_queue = mp.Queue(maxsize=1)
+        # Frames are shared through preallocated slots, the mailbox only carries slot indices
+        stream_options = None if camera["debug_stream"] is None else {**DEBUG_STREAM, **camera["debug_stream"]}
+        if stream_options is not None and stream_options["port"] is None:
+            stream_options["port"] = FIRST_STREAM_PORT + index
+        frame_ring = FrameRing((resolution[1], resolution[0], 3), readers=1 if stream_options is None else 2)
+        frame_mailbox = LatestValue(FRAME_MESSAGE)
+        detection_mailbox = LatestValue(DETECTION_MESSAGE)
+        position_mailbox = LatestValue(POSITION_MESSAGE, position_condition)
+        telemetry = PipelineTelemetry(TELEMETRY_METRICS, TELEMETRY_COUNTERS)
+        projection, lut_path = None, None
+        if camera["projection"]:
+            dataset_path, model = None, None
+            projection = ProjectionEstimator.load(camera["projection"], resolution)
+        elif camera["use_model"]:
+            dataset_path, model = None, RegressionModel.load(camera["dataset"])
+            # A model fitted on an oriented dataset needs the image angle of every rectangle
+            if RegressionModel.ANGLE_INPUT in model.input_columns and not camera["detection"].get("oriented", False):
+                raise ValueError(f"The model of {camera['dataset']} takes the image angle, set \"oriented\": True in the camera's detection settings")
+        elif camera["lut"]:
+            # Fails here, before any process starts, when the table was not built
+            LookupTable.load(camera["dataset"])
+            dataset_path, model, lut_path = None, None, camera["dataset"]
+        else:
+            # Converts the CSV once, before the estimation process maps the binary file
+            load_dataset(camera["dataset"])
+            dataset_path, model = camera["dataset"], None
 
-    # Load estimator data (example data)
-    estimator_data = pd.read_csv('Data/2024-Note/FullData.csv')
+        processes += [
+            mp.Process(target=frame_capture_process, args=(frame_mailbox, frame_ring, telemetry, camera["source"], resolution, camera["fps"])),
+            mp.Process(target=detection_process, args=(frame_mailbox, detection_mailbox, frame_ring, telemetry, lower_bound, upper_bound,
+                                                       resolution, camera["detection"], camera["detection_cores"])),
+            mp.Process(target=position_estimation_process, args=(detection_mailbox, position_mailbox, telemetry, dataset_path, lut_path,
+                                                                 model, projection, resolution, camera["estimation"], camera["estimation_cores"])),
+        ]
+        if stream_options is not None:
+            processes.append(mp.Process(target=debug_stream_process, args=(frame_ring, position_mailbox, telemetry, team_number,
+                                                                           camera["topic_prefix"], resolution, stream_options)))
+        frame_rings.append(frame_ring)
+        position_mailboxes.append(position_mailbox)
+        telemetries.append(telemetry)
 
-    processes = [
-        mp.Process(target=frame_capture_process, args=(frame_queue, camera_id, resolution, camera_fps)),
-        mp.Process(target=detection_process, args=(frame_queue, detection_queue, lower_bound, upper_bound)),
-        mp.Process(target=position_estimation_process, args=(detection_queue, position_queue, estimator_data)),
-        mp.Process(target=network_management_process, args=(position_queue, team_number))
-    ]
+    processes.append(mp.Process(target=network_management_process, args=(position_mailboxes, telemetries, prefixes, team_number, publishing)))
 
     for process in processes:
         process.start()
 
-    for process in processes:
-        process.join()
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for frame_ring in frame_rings:
+            frame_ring.close()
+            frame_ring.unlink()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
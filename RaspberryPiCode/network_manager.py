@@ -1,5 +1,6 @@
 import ntcore
-from cscore import CameraServer
+import numpy as np
+from cscore import CameraServer, CvSource, MjpegServer, VideoMode
 from cv2 import Mat
 import time
 
@@ -11,6 +12,10 @@ class NetworkManager:
     team_number : int
         The team number of the robot, used to determine the robot's IP address.
 
+    prefixes : list[str]
+        The topic prefix of every camera, each camera publishes in its own sub-table
+        of "datatable" ("" publishes directly in "datatable").
+
     robot_ip : str
         The IP address of the robot, formatted as "team_number.local".
 
@@ -20,28 +25,74 @@ class NetworkManager:
     data_table : ntcore.NetworkTable
         The NetworkTable used to store and retrieve data.
         
-    camera_publisher : cscore.VideoSink
-        The publisher for the camera stream.
+    camera_publisher : cscore.CvSource | None
+        The publisher for the camera stream, None when this manager has no stream.
+
+    camera_server : cscore.MjpegServer
+        The MJPEG server of the camera stream, when it was given an explicit port.
 
     topics : dict
-        A dictionary of topics for publishing data to the NetworkTable.
+        A dictionary of topics for publishing data to the NetworkTable, per prefix.
 
     publishers : dict
-        A dictionary of publishers for the topics defined in `topics`.
+        A dictionary of publishers for the topics defined in `topics`, per prefix.
+
+    position_deadband : float
+        How far (meters) a game piece has to move before new positions are published.
+
+    yaw_deadband : float
+        How far (degrees) a game piece has to turn before new positions are published.
+
+    certainty_deadband : float
+        How much a certainty has to change before new positions are published.
+
+    heartbeat : float
+        Seconds after which unchanged positions are published again, so that the
+        robot can tell a still game piece from a stopped coprocessor.
+
+    min_interval : float
+        The shortest time between two published positions of a camera (1 / max_rate).
+
+    last_published : dict
+        The last published (N, 4) array of (x, y, yaw, certainty) of every prefix,
+        None after "no target" was published, and the time it was published.
 
     Methods
     -------
-    setup_camera(camera_name: str)
-        Sets up the camera with the specified name and resolution.
+    setup_camera(camera_name: str, resolution: tuple[int, int] = (640, 480), fps: int = 15, port: int | None = None)
+        Sets up the camera stream with the specified name, resolution, frame rate and MJPEG port.
     publish_image(image: Mat)
         Publishes an image to the camera stream.
-    setup_topics()
-        Sets up the topics for publishing data to the NetworkTable.
-    game_piece_position(x: float, y: float, a: float, certainty: float = 0.0)
-        Publishes the robot's position and certainty to the NetworkTable.
+    setup_topics(prefix: str = "")
+        Sets up the topics of one camera for publishing data to the NetworkTable.
+    capture_time(timestamp: float | None) -> tuple[int, float]
+        Converts a capture timestamp to the local and server NetworkTables time.
+    positions_changed(positions: np.ndarray, last_positions: np.ndarray | None) -> bool
+        Whether a game piece appeared, vanished or changed beyond the deadbands.
+    publish_game_pieces(positions: np.ndarray, prefix: str = "", timestamp: float | None = None) -> bool
+        Publishes the largest game piece and every game piece when any of them changed
+        beyond the deadbands or the heartbeat expired, at most max_rate times a second.
+    publish_game_piece_position(x: float, y: float, a: float, certainty: float = 0.0, prefix: str = "", timestamp: float | None = None) -> bool
+        Publishes a single game piece, see publish_game_pieces.
+    publish_no_target(prefix: str = "") -> bool
+        Publishes that no game piece is in view, once until a game piece is seen again.
+    publish_game_piece_positions(positions: np.ndarray, prefix: str = "", timestamp: float | None = None)
+        Publishes every detected game piece to the NetworkTable in one update.
+    publish_telemetry(summary: dict[str, float], prefix: str = "")
+        Publishes pipeline latency percentiles and drop counts to the NetworkTable.
     """
 
-    def __init__(self, team_number : int):
+    def __init__(self, team_number : int, prefixes : list[str] = ("",), position_deadband : float = 0.02, yaw_deadband : float = 2.0,
+                 certainty_deadband : float = 5.0, heartbeat : float = 0.5, max_rate : float = 50.0,
+                 stream_name : str | None = "Camera", stream_resolution : tuple[int, int] = (640, 480), stream_fps : int = 15,
+                 stream_port : int | None = None, client_name : str = "raspberrypi"):
+        self.position_deadband = position_deadband
+        self.yaw_deadband = yaw_deadband
+        self.certainty_deadband = certainty_deadband
+        self.heartbeat = heartbeat
+        self.min_interval = 1.0 / max_rate
+        self.last_published = {}
+
         self.robot_ip = str(team_number) + ".local"  # Assuming the robot's IP is in the format "team_number.local"
         
         print("Setting up NetworkManager...")
@@ -52,48 +103,175 @@ class NetworkManager:
         self.data_table = self.nt.getTable("datatable")
         print("NetworkTable setup complete.")
 
-        self.setup_camera("Camera")
-        print("Camera setup complete.")
+        # Each process connects as its own client, e.g. the debug stream processes
+        # own their camera streams while the network process publishes the positions
+        self.camera_publisher = None
+        if stream_name is not None:
+            self.setup_camera(stream_name, stream_resolution, stream_fps, stream_port)
+            print("Camera setup complete.")
 
         print("Setting up topics...")
-        self.setup_topics()
+        self.topics = {}
+        self.publishers = {}
+        self.telemetry_tables = {}
+        self.telemetry_publishers = {}
+        for prefix in prefixes:
+            self.setup_topics(prefix)
         print("Topics setup complete.")
 
-        self.nt.startClient4("raspberrypi_" + str(team_number))
+        self.nt.startClient4(client_name + "_" + str(team_number))
         self.nt.setServerTeam(team_number, 0) # where TEAM=5554, 294, 1690, etc
         print("Starting NetworkTable client...")
         time.sleep(3) # Wait for the client to start Recommended by the library
         print("NetworkTable client started.")
 
-    def setup_camera(self, camera_name):
-        """ Sets up the camera on the robot. """
+    def setup_camera(self, camera_name, resolution=(640, 480), fps=15, port=None):
+        """
+        Sets up the camera on the robot. Without a port CameraServer numbers the MJPEG
+        server itself (from 1181), only once per process, so every process streaming a
+        camera needs its own port.
+        """
         print("Setting up camera stream...")
-        self.camera_publisher = CameraServer.putVideo(camera_name, 640, 480) # Set the resolution to 640x480 to reduce CPU usage and bandwidth
-        self.camera_publisher.setFPS(15) # Limit the FPS to 15 to limit CPU usage and bandwidth
+        if port is None:
+            self.camera_publisher = CameraServer.putVideo(camera_name, resolution[0], resolution[1]) # A low resolution to reduce CPU usage and bandwidth
+        else:
+            self.camera_publisher = CvSource(camera_name, VideoMode.PixelFormat.kMJPEG, resolution[0], resolution[1], fps)
+            self.camera_server = MjpegServer("serve_" + camera_name, port)
+            self.camera_server.setSource(self.camera_publisher)
+            # Registered so that the stream is still listed for the dashboards
+            CameraServer.addCamera(self.camera_publisher)
+            CameraServer.addServer(self.camera_server)
+            print("Camera stream served on port", port)
+        self.camera_publisher.setFPS(fps) # Limit the FPS to limit CPU usage and bandwidth
     
     def publish_image(self, image : Mat):
         """ Publishes an image to the camera stream. """
         self.camera_publisher.putFrame(image)
 
-    def setup_topics(self):
-        self.topics = {
-            "game_piece_position_x" : self.data_table.getDoubleTopic("game_piece_position_x"),
-            "game_piece_position_y" : self.data_table.getDoubleTopic("game_piece_position_y"),
-            "game_piece_yaw" : self.data_table.getDoubleTopic("game_piece_yaw"),
-            "certainty" : self.data_table.getDoubleTopic("certainty")
+    def setup_topics(self, prefix : str = ""):
+        """ Sets up the topics of one camera, in the "datatable/<prefix>" sub-table. """
+        table = self.data_table.getSubTable(prefix) if prefix else self.data_table
+        topics = {
+            # The largest game piece as one atomic [x, y, yaw, certainty, timestamp] update,
+            # the timestamp is when its frame was captured, in NetworkTables server time
+            # (seconds, the robot's FPGA time). A certainty of 0 means no game piece is in view.
+            # The yaw is 0 for symmetrical game pieces, and for oriented ones whose image
+            # angle is unknown, which main.py publishes with the lowest certainty
+            "game_piece" : table.getDoubleArrayTopic("game_piece"),
+            # All game pieces in the frame, flattened as [x0, y0, yaw0, certainty0, x1, ...]
+            "game_piece_positions" : table.getDoubleArrayTopic("game_piece_positions")
         }
 
-        self.publishers = {
-            "game_piece_position_x" : self.topics["game_piece_position_x"].publish(),
-            "game_piece_position_y" : self.topics["game_piece_position_y"].publish(),
-            "game_piece_yaw" : self.topics["game_piece_yaw"].publish(),
-            "certainty" : self.topics["certainty"].publish()
-        }        
+        self.topics[prefix] = topics
+        self.publishers[prefix] = {
+            "game_piece" : topics["game_piece"].publish(),
+            "game_piece_positions" : topics["game_piece_positions"].publish()
+        }
+        self.last_published[prefix] = (None, 0.0)
+
+        # Telemetry topics are created on first use, one per summary entry
+        self.telemetry_tables[prefix] = table.getSubTable("telemetry")
+        self.telemetry_publishers[prefix] = {}
+
+    def capture_time(self, timestamp : float | None) -> tuple[int, float]:
+        """
+        Converts a time.time() capture timestamp to the local NetworkTables time
+        (microseconds, what the publishers take) and to the server time in seconds
+        (what the robot compares against). The local time is used until the client
+        is connected and knows the server's offset.
+        """
+        now = ntcore._now()
+        local = now if timestamp is None else now - int((time.time() - timestamp) * 1e6)
+        offset = self.nt.getServerTimeOffset()
+        return local, (local + (offset or 0)) * 1e-6
+
+    def positions_changed(self, positions : np.ndarray, last_positions : np.ndarray | None) -> bool:
+        """
+        Whether an (N, 4) array of (x, y, yaw, certainty) differs from the last published
+        one: a game piece appeared or vanished, or any game piece moved, turned or
+        changed certainty beyond the deadbands. The game pieces are compared in order
+        (largest first).
+        """
+        if last_positions is None or len(positions) != len(last_positions):
+            return True
+        difference = positions - last_positions
+        return bool(np.any(np.hypot(difference[:, 0], difference[:, 1]) >= self.position_deadband)
+                    or np.any(np.abs((difference[:, 2] + 180) % 360 - 180) >= self.yaw_deadband)
+                    or np.any(np.abs(difference[:, 3]) >= self.certainty_deadband))
+
+    def publish_game_pieces(self, positions : np.ndarray, prefix : str = "", timestamp : float | None = None) -> bool:
+        """
+        Publishes the largest game piece (the first one) and every game piece of a
+        frame, each topic in one atomic update.
+
+        Nothing is sent while every game piece stays within the deadbands of the last
+        published positions, unless the heartbeat expired, and never more than
+        max_rate times a second. The timestamp is when the frame was captured (time.time()).
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            An (N, 4) array of (x, y, yaw, certainty), largest game piece first, or
+            (N, 3) of (x, y, certainty) for symmetrical game pieces
+
+        Returns
+        -------
+        bool
+            True if the positions were published
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(len(positions), -1)
+        if positions.shape[1] == 3:
+            positions = np.insert(positions, 2, 0.0, axis=1)  # Symmetrical pieces have no yaw
+        last_positions, last_time = self.last_published[prefix]
+        now = time.time()
+        if now - last_time < self.min_interval:
+            return False
+        if now - last_time < self.heartbeat and not self.positions_changed(positions, last_positions):
+            return False
+
+        local, server = self.capture_time(timestamp)
+        self.publishers[prefix]["game_piece"].set(positions[0].tolist() + [server], local)
+        self.publishers[prefix]["game_piece_positions"].set(positions.reshape(-1).tolist(), local)
+        self.last_published[prefix] = (positions, now)
+        return True
+
+    def publish_game_piece_position(self, x, y, a, certainty=0.0, prefix="", timestamp=None) -> bool:
+        """ Publishes a single game piece, see publish_game_pieces. Returns True if it was published. """
+        return self.publish_game_pieces(np.array([[x, y, a, certainty]]), prefix, timestamp)
+
+    def publish_no_target(self, prefix : str = "") -> bool:
+        """
+        Publishes that no game piece is in view (all zeros), once until a game
+        piece is published again. Returns True if it was published.
+        """
+        if self.last_published[prefix][0] is None and self.last_published[prefix][1] > 0:
+            return False
+
+        local, server = self.capture_time(None)
+        self.publishers[prefix]["game_piece"].set([0.0, 0.0, 0.0, 0.0, server], local)
+        self.publishers[prefix]["game_piece_positions"].set([], local)
+        self.last_published[prefix] = (None, time.time())
+        return True
+
+    def publish_game_piece_positions(self, positions : np.ndarray, prefix : str = "", timestamp : float | None = None):
+        """
+        Publishes every detected game piece to the NetworkTable in one update.
+
+        The positions are an (N, 3) array of (x, y, certainty) or an (N, 4) array
+        of (x, y, yaw, certainty), they are sent as one flat array of N * 4 values
+        so that all poses of a frame arrive together. The timestamp is when the
+        frame was captured (time.time()).
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        if positions.ndim == 2 and positions.shape[1] == 3:
+            positions = np.insert(positions, 2, 0.0, axis=1)  # Symmetrical pieces have no yaw
+        self.publishers[prefix]["game_piece_positions"].set(positions.reshape(-1).tolist(), self.capture_time(timestamp)[0])
 
-    def publish_game_piece_position(self, x, y, a, certainty=0.0):
-        """ Publishes the game piece's position to the NetworkTable. """
+    def publish_telemetry(self, summary : dict[str, float], prefix : str = ""):
+        """ Publishes pipeline latency percentiles and drop counts (see PipelineTelemetry.summary). """
         timestamp = ntcore._now()
-        self.publishers["game_piece_position_x"].set(x, timestamp)
-        self.publishers["game_piece_position_y"].set(y, timestamp)
-        self.publishers["game_piece_yaw"].set(a, timestamp)
-        self.publishers["certainty"].set(certainty, timestamp)
\ No newline at end of file
+        publishers = self.telemetry_publishers[prefix]
+        for name, value in summary.items():
+            if name not in publishers:
+                publishers[name] = self.telemetry_tables[prefix].getDoubleTopic(name).publish()
+            publishers[name].set(value, timestamp)
@@ -0,0 +1,367 @@
+import argparse
+import glob
+import json
+import math
+import cv2
+import numpy as np
+from dataset import column_names, columns_to_array, load_dataset
+
+class ProjectionEstimator:
+    """
+    Estimates the position of game pieces from the camera's projection instead of
+    a rendered dataset
+
+    The datasets sample the inverse of the camera's ground plane projection, this
+    computes it directly: the ray through the center of the bounding rectangle is
+    intersected with the horizontal plane at half the game piece's height. That
+    takes constant time and no dataset memory. Only symmetrical game pieces (Note)
+    are supported, the center of a rotated piece's rectangle moves with the angle.
+
+    Rectangles cut off by the image edge use the edges that are still seen: the
+    bottom edge of a piece cut off at the top is its near rim on the floor, the
+    top edge of one cut off at the bottom its far rim at the piece's height, and
+    the piece's width places the center of one cut off at a side.
+
+    Coordinates are the dataset's: x to the right, y forward, z up, in meters.
+
+    Attributes
+    ----------
+    width : int
+        The width of the image
+
+    height: int
+        The height of the image
+
+    camera_matrix : np.ndarray
+        The 3x3 intrinsic matrix of the camera, for width x height images
+
+    distortion : np.ndarray
+        The OpenCV distortion coefficients of the camera
+
+    rotation : np.ndarray
+        The 3x3 rotation from the OpenCV camera axes (x right, y down, z forward)
+        to the world axes
+
+    position : np.ndarray
+        The (x, y, z) position of the camera
+
+    piece_height : float
+        The height of the game piece, its center is at half of it
+
+    piece_width : float
+        The width of the game piece seen from the camera, 0 if unknown
+
+    near_offset, far_offset : float
+        The distance along the floor from the piece's center to the points seen at
+        the bottom and at the top of its rectangle (its near and far rim)
+
+    Methods
+    -------
+    from_measurements(...) -> ProjectionEstimator
+        Builds an estimator from calibrated intrinsics and the measured camera height and angles
+    load(path: str, resolution: tuple[int, int] | None = None) -> ProjectionEstimator
+        Loads a camera file (see save and Data/blender_render_worker.py --camera)
+    save(path: str)
+        Saves the camera to a JSON file
+    floor_positions(points: np.ndarray, plane_height: float) -> np.ndarray
+        Intersects the rays through image points with a horizontal plane
+    estimate_position(rectangle: np.ndarray) -> tuple[float, float, float] | None
+        Estimates the position of a game piece based on its bounding rectangle
+    estimate_positions(rectangles: np.ndarray) -> np.ndarray
+        Estimates the positions of several game pieces at once
+    """
+
+    # The center of a rectangle cut off by the image edge is not the piece's center
+    EDGE_CERTAINTY = 25
+    CERTAINTY = 50
+
+    def __init__(self, width : int, height : int, camera_matrix : np.ndarray, distortion : np.ndarray, rotation : np.ndarray,
+                 position : np.ndarray, piece_height : float = 0.0, piece_width : float = 0.0,
+                 near_offset : float | None = None, far_offset : float | None = None):
+        self.width = width
+        self.height = height
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.distortion = np.asarray(distortion, dtype=np.float64).ravel()
+        self.rotation = np.asarray(rotation, dtype=np.float64).reshape(3, 3)
+        self.position = np.asarray(position, dtype=np.float64).ravel()
+        self.piece_height = float(piece_height)
+        self.piece_width = float(piece_width)
+        self.near_offset = piece_width / 2 if near_offset is None else float(near_offset)
+        self.far_offset = piece_width / 2 if far_offset is None else float(far_offset)
+
+    @classmethod
+    def from_measurements(cls, width : int, height : int, camera_matrix : np.ndarray, distortion : np.ndarray, camera_height : float,
+                          pitch : float, yaw : float = 0.0, roll : float = 0.0, x : float = 0.0, y : float = 0.0,
+                          piece_height : float = 0.0, piece_width : float = 0.0) -> "ProjectionEstimator":
+        """
+        Builds an estimator from calibrated intrinsics (see calibrate_intrinsics) and the
+        camera's measured mounting
+
+        Parameters
+        ----------
+        camera_height : float
+            The height of the camera lens above the floor, in meters
+        pitch : float
+            How far the camera looks down from horizontal, in degrees
+        yaw : float
+            How far the camera is turned left (counter-clockwise seen from above), in degrees
+        roll : float
+            How far the camera is rolled clockwise (as seen from behind it), in degrees
+        x, y : float
+            The position of the camera on the robot, the estimated positions are relative to it
+        """
+        pitch, yaw, roll = np.radians([pitch, yaw, roll])
+        # A level camera looking forward: its x is the world's x, its y is down and its z is forward
+        level = np.array([[1, 0, 0], [0, 0, 1], [0, -1, 0]], dtype=np.float64)
+        tilt = np.array([[1, 0, 0], [0, math.cos(pitch), math.sin(pitch)], [0, -math.sin(pitch), math.cos(pitch)]])
+        turn = np.array([[math.cos(yaw), -math.sin(yaw), 0], [math.sin(yaw), math.cos(yaw), 0], [0, 0, 1]])
+        spin = np.array([[math.cos(roll), -math.sin(roll), 0], [math.sin(roll), math.cos(roll), 0], [0, 0, 1]])
+        rotation = turn @ tilt @ level @ spin
+        return cls(width, height, camera_matrix, distortion, rotation, (x, y, camera_height), piece_height, piece_width)
+
+    @classmethod
+    def load(cls, path : str, resolution : tuple[int, int] | None = None) -> "ProjectionEstimator":
+        """
+        Loads a camera file, scaling the intrinsics when the camera runs at a different
+        resolution (with the same aspect ratio) than the one it was calibrated at
+        """
+        with open(path) as file:
+            camera = json.load(file)
+        width, height = camera["resolution"]
+        camera_matrix = np.array(camera["camera_matrix"], dtype=np.float64)
+        if resolution is not None and tuple(resolution) != (width, height):
+            camera_matrix[0] *= resolution[0] / width
+            camera_matrix[1] *= resolution[1] / height
+            width, height = resolution
+        return cls(width, height, camera_matrix, camera["distortion"], camera["rotation"], camera["position"], camera.get("piece_height", 0.0),
+                   camera.get("piece_width", 0.0), camera.get("near_offset"), camera.get("far_offset"))
+
+    def save(self, path : str):
+        """ Saves the camera to a JSON file. """
+        with open(path, "w") as file:
+            json.dump({
+                "resolution": [self.width, self.height],
+                "camera_matrix": self.camera_matrix.tolist(),
+                "distortion": self.distortion.tolist(),
+                "rotation": self.rotation.tolist(),
+                "position": self.position.tolist(),
+                "piece_height": self.piece_height,
+                "piece_width": self.piece_width,
+                "near_offset": self.near_offset,
+                "far_offset": self.far_offset,
+            }, file, indent=4)
+
+    def floor_positions(self, points : np.ndarray, plane_height : float) -> np.ndarray:
+        """
+        Intersects the rays through image points with a horizontal plane
+
+        Parameters
+        ----------
+        points : np.ndarray
+            An (N, 2) array of pixel coordinates
+        plane_height : float
+            The height of the plane, in meters
+
+        Returns
+        -------
+        np.ndarray
+            An (N, 2) array of (x, y) positions on the plane, NaN where the ray
+            does not reach the plane (at or above the horizon)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        normalized = cv2.undistortPoints(points, self.camera_matrix, self.distortion).reshape(-1, 2)
+        directions = np.column_stack((normalized, np.ones(len(normalized)))) @ self.rotation.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = (plane_height - self.position[2]) / directions[:, 2]
+        distance[~(distance > 0)] = np.nan
+        return self.position[:2] + distance[:, None] * directions[:, :2]
+
+    def depths(self, positions : np.ndarray) -> np.ndarray:
+        """ The distance of the piece centers at the given (x, y) positions along the camera's view axis. """
+        points = np.column_stack((positions, np.full(len(positions), self.piece_height / 2))) - self.position
+        return points @ self.rotation[:, 2]
+
+    def anchor_positions(self, center_x : np.ndarray, y : np.ndarray, h : np.ndarray, cut_top : np.ndarray, cut_bottom : np.ndarray) -> np.ndarray:
+        """ The piece centers from the rectangles' centers, or from the edge that is not cut off. """
+        positions = self.floor_positions(np.column_stack((center_x, y + h / 2)), self.piece_height / 2)
+        for rows, edge, plane_height, offset in ((cut_top & ~cut_bottom, y + h, 0.0, self.near_offset),
+                                                 (cut_bottom & ~cut_top, y, self.piece_height, -self.far_offset)):
+            if not np.any(rows):
+                continue
+            rim = self.floor_positions(np.column_stack((center_x[rows], edge[rows])), plane_height)
+            away = rim - self.position[:2]
+            positions[rows] = rim + offset * away / np.linalg.norm(away, axis=1)[:, None]
+        return positions
+
+    def estimate_position(self, rectangle : np.ndarray) -> tuple[float, float, float] | None:
+        """
+        Estimates the position of a game piece based on its bounding rectangle.
+
+        Parameters:
+            rectangle (np.ndarray): A numpy array containing the bounding rectangle
+                                    in the format [x, y, width, height].
+
+        Returns:
+            tuple[float, float, float] | None: The estimated (x_position, y_position, certainty),
+                                               None if the rectangle is above the horizon.
+        """
+        x_position, y_position, certainty = self.estimate_positions(np.asarray(rectangle).reshape(1, 4))[0]
+        return None if np.isnan(x_position) else (float(x_position), float(y_position), float(certainty))
+
+    def estimate_positions(self, rectangles : np.ndarray) -> np.ndarray:
+        """
+        Estimates the positions of several game pieces at once.
+
+        Parameters:
+            rectangles (np.ndarray): An (N, 4) array of bounding rectangles
+                                     in the format [x, y, width, height].
+
+        Returns:
+            np.ndarray: An (N, 3) array of (x_position, y_position, certainty), NaN where the
+                        rectangle is above the horizon. The certainty is lower for rectangles
+                        touching the image edge.
+        """
+        rectangles = np.asarray(rectangles, dtype=np.float64).reshape(-1, 4)
+        positions = np.full((len(rectangles), 3), np.nan)
+        if len(rectangles) == 0:
+            return positions
+
+        x, y, w, h = rectangles.T
+        cut_left, cut_top = x <= 0, y <= 0
+        cut_right, cut_bottom = x + w >= self.width, y + h >= self.height
+        center_x = x + w / 2
+        positions[:, :2] = self.anchor_positions(center_x, y, h, cut_top, cut_bottom)
+
+        # A piece cut off at one side is as wide as its width at its distance
+        sideways = (cut_left ^ cut_right) & ~np.isnan(positions[:, 0])
+        if self.piece_width > 0 and np.any(sideways):
+            expected_width = self.camera_matrix[0, 0] * self.piece_width / self.depths(positions[sideways, :2])
+            center_x[sideways] = np.where(cut_left[sideways], x[sideways] + w[sideways] - expected_width / 2, x[sideways] + expected_width / 2)
+            positions[sideways, :2] = self.anchor_positions(center_x[sideways], y[sideways], h[sideways], cut_top[sideways], cut_bottom[sideways])
+
+        cut_off = cut_left | cut_top | cut_right | cut_bottom
+        positions[:, 2] = np.where(cut_off, self.EDGE_CERTAINTY, self.CERTAINTY)
+        positions[np.isnan(positions[:, 0]), 2] = np.nan
+        return positions
+
+
+def calibrate_intrinsics(image_paths : list[str], board_size : tuple[int, int], square_size : float) -> tuple[np.ndarray, np.ndarray, tuple[int, int]]:
+    """
+    Calibrates the camera's intrinsics from chessboard images (e.g. taken with SetUp/image_capture.py)
+
+    Parameters
+    ----------
+    image_paths : list[str]
+        The images, the chessboard should be seen from several angles and cover the whole image
+    board_size : tuple[int, int]
+        The number of inner corners of the chessboard, e.g. (9, 6)
+    square_size : float
+        The side of a chessboard square, in meters
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, tuple[int, int]]
+        The camera matrix, the distortion coefficients and the images' resolution
+    """
+    board = np.zeros((board_size[0] * board_size[1], 3), np.float32)
+    board[:, :2] = np.mgrid[0:board_size[0], 0:board_size[1]].T.reshape(-1, 2) * square_size
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+    object_points, image_points, resolution = [], [], None
+    for image_path in image_paths:
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            continue
+        found, corners = cv2.findChessboardCorners(gray, board_size)
+        if not found:
+            print("No chessboard found in", image_path)
+            continue
+        object_points.append(board)
+        image_points.append(cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria))
+        resolution = (gray.shape[1], gray.shape[0])
+    if len(object_points) < 3:
+        raise ValueError(f"Found the chessboard in {len(object_points)} images, at least 3 are needed")
+
+    error, camera_matrix, distortion, _, _ = cv2.calibrateCamera(object_points, image_points, resolution, None, None)
+    print("Calibrated from", len(object_points), "images, reprojection error", round(error, 3), "pixels")
+    return camera_matrix, distortion.ravel(), resolution
+
+
+def fit_camera(data : np.ndarray, piece_height : float = 0.0, width : int = 1280, height : int = 720) -> ProjectionEstimator:
+    """
+    Fits the camera of a rendered dataset, for datasets whose .blend is not at hand
+
+    The rectangle centers of the rows not cut off by the image edge are matched to
+    their positions like a flat calibration target, then the piece's width and rim
+    offsets are measured on the same rows.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The dataset rows, as returned by dataset.load_dataset
+    piece_height : float
+        The height of the game piece (only moves the fitted camera up by half of it)
+    """
+    if 'Image_angle' in column_names(data):
+        print("Warning: the dataset has an image angle, the projection only fits symmetrical game pieces")
+    center_x, center_y, w, h = columns_to_array(data, ['Center_X', 'Center_Y', 'Width', 'Height']).T
+    inside = (center_x - w / 2 > 1) & (center_y - h / 2 > 1) & (center_x + w / 2 < width - 1) & (center_y + h / 2 < height - 1)
+    positions = columns_to_array(data, ['x_position', 'y_position'])[inside]
+
+    object_points = np.column_stack((positions, np.zeros(len(positions)))).astype(np.float32)
+    image_points = np.column_stack((center_x, center_y))[inside].astype(np.float32)
+    guess = np.array([[width, 0, width / 2], [0, width, height / 2], [0, 0, 1]], dtype=np.float64)
+    flags = cv2.CALIB_USE_INTRINSIC_GUESS | cv2.CALIB_FIX_ASPECT_RATIO | cv2.CALIB_ZERO_TANGENT_DIST | cv2.CALIB_FIX_K3
+    error, camera_matrix, distortion, rotations, translations = cv2.calibrateCamera(
+        [object_points], [image_points], (width, height), guess, None, flags=flags)
+
+    # calibrateCamera returns the world to camera transform, the estimator uses the inverse
+    world_to_camera, _ = cv2.Rodrigues(rotations[0])
+    position = -world_to_camera.T @ translations[0].ravel()
+    # The centers were fitted on the z = 0 plane, they are at half the piece's height
+    position[2] += piece_height / 2
+    estimator = ProjectionEstimator(width, height, camera_matrix, distortion, world_to_camera.T, position, piece_height)
+
+    center_x, center_y, w, h = center_x[inside], center_y[inside], w[inside], h[inside]
+    estimator.piece_width = float(np.median(w * estimator.depths(positions) / camera_matrix[0, 0]))
+    distance = np.linalg.norm(positions - position[:2], axis=1)
+    near = estimator.floor_positions(np.column_stack((center_x, center_y + h / 2)), 0.0)
+    far = estimator.floor_positions(np.column_stack((center_x, center_y - h / 2)), piece_height)
+    estimator.near_offset = float(np.nanmedian(distance - np.linalg.norm(near - position[:2], axis=1)))
+    estimator.far_offset = float(np.nanmedian(np.linalg.norm(far - position[:2], axis=1) - distance))
+    print("Fitted the camera to", len(positions), "rows, reprojection error", round(error, 3), "pixels")
+    return estimator
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python projection_estimation.py fit Data/2024-Note/FullData.csv camera.json
+    #   python projection_estimation.py calibrate "SetUp/calibration_image_*.png" camera.json --board 9 6 --square 0.025 --camera-height 0.5 --pitch 20
+    parser = argparse.ArgumentParser(description="Create the camera file of the projection estimator")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fit_parser = commands.add_parser("fit", help="Fit the camera of a rendered dataset")
+    fit_parser.add_argument("csv", help="The dataset, e.g. Data/2024-Note/FullData.csv")
+    fit_parser.add_argument("output", help="The camera file to write")
+    fit_parser.add_argument("--piece-height", type=float, default=0.0, help="The height of the game piece, in meters")
+    calibrate_parser = commands.add_parser("calibrate", help="Calibrate a real camera from chessboard images")
+    calibrate_parser.add_argument("images", help="A glob of the chessboard images, e.g. 'SetUp/calibration_image_*.png'")
+    calibrate_parser.add_argument("output", help="The camera file to write")
+    calibrate_parser.add_argument("--board", type=int, nargs=2, default=(9, 6), help="Inner corners of the chessboard")
+    calibrate_parser.add_argument("--square", type=float, required=True, help="Side of a chessboard square, in meters")
+    calibrate_parser.add_argument("--camera-height", type=float, required=True, help="Height of the camera above the floor, in meters")
+    calibrate_parser.add_argument("--pitch", type=float, required=True, help="How far the camera looks down, in degrees")
+    calibrate_parser.add_argument("--yaw", type=float, default=0.0, help="How far the camera is turned left, in degrees")
+    calibrate_parser.add_argument("--roll", type=float, default=0.0, help="How far the camera is rolled clockwise, in degrees")
+    calibrate_parser.add_argument("--piece-height", type=float, default=0.0, help="The height of the game piece, in meters")
+    calibrate_parser.add_argument("--piece-width", type=float, default=0.0, help="The width of the game piece, in meters")
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        estimator = fit_camera(load_dataset(args.csv), args.piece_height)
+    else:
+        camera_matrix, distortion, (width, height) = calibrate_intrinsics(sorted(glob.glob(args.images)), tuple(args.board), args.square)
+        estimator = ProjectionEstimator.from_measurements(width, height, camera_matrix, distortion, args.camera_height,
+                                                          args.pitch, args.yaw, args.roll, piece_height=args.piece_height,
+                                                          piece_width=args.piece_width)
+    estimator.save(args.output)
+    print("Saved", args.output)
@@ -0,0 +1,278 @@
+import itertools
+import os
+import sys
+import numpy as np
+from dataset import load_dataset, column_names, columns_to_array
+
+class RegressionModel:
+    """
+    A polynomial regression from a bounding rectangle to the game piece position,
+    fitted offline from a dataset so that the runtime does not need the dataset
+
+    The inputs are the rectangle columns plus the inverse of its width and height
+    (the distance to the game piece is about proportional to them), and the sine
+    and cosine of the image angle when the dataset has one. They are standardized
+    and expanded into every product of up to `degree` of them. Angle outputs are
+    fitted as a sine and cosine and turned back into an angle.
+
+    Attributes
+    ----------
+    degree : int
+        The polynomial degree
+
+    input_columns : list[str]
+        The dataset columns the model takes, in order
+
+    output_columns : list[str]
+        The dataset columns the model predicts, in order
+
+    angle_period : float | None
+        The period of the "angle" output (and "Image_angle" input), None when the
+        dataset has no angle
+
+    mean, scale : np.ndarray
+        The standardization of the expanded inputs
+
+    powers : np.ndarray
+        The (T, F) exponents of every polynomial term
+
+    coefficients : np.ndarray
+        The (T, O) fitted coefficients
+
+    envelope : np.ndarray
+        A (X, Y, 4) grid over the rectangle center holding the (min width, min height,
+        max width, max height) of the rows fitted around every cell, the model is
+        only trusted inside it
+
+    envelope_origin : np.ndarray
+        The (Center_X, Center_Y) of the first envelope cell
+
+    Methods
+    -------
+    predict(inputs: np.ndarray) -> np.ndarray
+        Predicts the outputs of an (N, len(input_columns)) array of inputs
+    distance_outside(inputs: np.ndarray) -> np.ndarray
+        How far (in pixels) every input's size lies outside the sizes fitted around its center
+    save(path: str)
+        Saves the model next to the given path
+    load(path: str) -> RegressionModel
+        Loads a saved model
+    """
+
+    ANGLE_INPUT = 'Image_angle'
+    ANGLE_OUTPUT = 'angle'
+
+    # Side of an envelope cell, in pixels
+    ENVELOPE_CELL = 32
+
+    # Rows of the design matrix computed at once, each holds a (terms, features) array
+    # of powers (10 MB for 1024 rows of the 2025 Coral's 165 terms of 8 features)
+    DESIGN_CHUNK = 1024
+
+    def __init__(self, degree : int, input_columns : list[str], output_columns : list[str], angle_period : float | None,
+                 mean : np.ndarray, scale : np.ndarray, powers : np.ndarray, coefficients : np.ndarray,
+                 envelope : np.ndarray, envelope_origin : np.ndarray):
+        self.degree = int(degree)
+        self.input_columns = list(input_columns)
+        self.output_columns = list(output_columns)
+        self.angle_period = angle_period
+        self.mean = mean
+        self.scale = scale
+        self.powers = powers
+        self.coefficients = coefficients
+        self.envelope = envelope
+        self.envelope_origin = envelope_origin
+
+    @staticmethod
+    def expand_inputs(inputs : np.ndarray, input_columns : list[str], angle_period : float | None) -> np.ndarray:
+        """ The rectangle columns, the inverse width and height, and the sine and cosine of the image angle. """
+        inputs = np.asarray(inputs, dtype=np.float64).reshape(-1, len(input_columns))
+        rectangle = inputs[:, :4]
+        expanded = [rectangle, 100 / np.maximum(rectangle[:, 2:4], 1)]
+        if RegressionModel.ANGLE_INPUT in input_columns:
+            radians = inputs[:, input_columns.index(RegressionModel.ANGLE_INPUT)] * (2 * np.pi / angle_period)
+            expanded += [np.sin(radians)[:, None], np.cos(radians)[:, None]]
+        return np.hstack(expanded)
+
+    @staticmethod
+    def polynomial_powers(features : int, degree : int) -> np.ndarray:
+        """ The exponents of every product of up to `degree` features, the constant term first. """
+        powers = []
+        for order in range(degree + 1):
+            for combination in itertools.combinations_with_replacement(range(features), order):
+                powers.append(np.bincount(np.array(combination, dtype=np.int64), minlength=features))
+        return np.array(powers, dtype=np.int64)
+
+    def design_matrix(self, inputs : np.ndarray) -> np.ndarray:
+        """ The polynomial terms of the standardized inputs, one row per input, computed a chunk of rows at a time. """
+        standardized = (self.expand_inputs(inputs, self.input_columns, self.angle_period) - self.mean) / self.scale
+        matrix = np.empty((len(standardized), len(self.powers)))
+        for start in range(0, len(standardized), self.DESIGN_CHUNK):
+            chunk = standardized[start:start + self.DESIGN_CHUNK]
+            matrix[start:start + len(chunk)] = np.prod(chunk[:, None, :] ** self.powers[None, :, :], axis=2)
+        return matrix
+
+    def predict(self, inputs : np.ndarray) -> np.ndarray:
+        """
+        Predicts the outputs of an (N, len(input_columns)) array of inputs
+
+        Returns
+        -------
+        np.ndarray
+            An (N, len(output_columns)) array, e.g. (x_position, y_position[, angle])
+        """
+        raw = self.design_matrix(inputs) @ self.coefficients
+        if self.ANGLE_OUTPUT not in self.output_columns:
+            return raw
+        # The angle was fitted as its sine and cosine, the last two raw outputs
+        angle = np.arctan2(raw[:, -2], raw[:, -1]) * (self.angle_period / (2 * np.pi))
+        return np.column_stack((raw[:, :-2], np.mod(angle, self.angle_period)))
+
+    @classmethod
+    def build_envelope(cls, inputs : np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Tabulates the width and height range of the rows around every cell of the
+        rectangle center. The datasets only cover the rectangles seen from the
+        floor area that was rendered, a polynomial is meaningless elsewhere.
+        """
+        cell = cls.ENVELOPE_CELL
+        # One empty cell of padding on every side, filled by the dilation below
+        origin = np.floor(inputs[:, :2].min(axis=0) / cell) * cell - cell
+        cells = np.floor((inputs[:, :2] - origin) / cell).astype(np.int64)
+        shape = tuple(cells.max(axis=0) + 2)
+
+        low = np.full(shape + (2,), np.inf)
+        high = np.full(shape + (2,), -np.inf)
+        np.minimum.at(low, (cells[:, 0], cells[:, 1]), inputs[:, 2:4])
+        np.maximum.at(high, (cells[:, 0], cells[:, 1]), inputs[:, 2:4])
+
+        # Every cell also takes the range of its 8 neighbours, so that rectangles
+        # between two rendered centers are covered
+        padded_low = np.pad(low, ((1, 1), (1, 1), (0, 0)), constant_values=np.inf)
+        padded_high = np.pad(high, ((1, 1), (1, 1), (0, 0)), constant_values=-np.inf)
+        for dx in range(3):
+            for dy in range(3):
+                low = np.minimum(low, padded_low[dx:dx + shape[0], dy:dy + shape[1]])
+                high = np.maximum(high, padded_high[dx:dx + shape[0], dy:dy + shape[1]])
+        return np.concatenate((low, high), axis=2), origin
+
+    def distance_outside(self, inputs : np.ndarray) -> np.ndarray:
+        """
+        How far (in pixels) every input's width or height lies outside the sizes the
+        model was fitted on around its center, infinite where nothing was fitted
+        """
+        inputs = np.asarray(inputs, dtype=np.float64).reshape(-1, len(self.input_columns))
+        cells = np.floor((inputs[:, :2] - self.envelope_origin) / self.ENVELOPE_CELL).astype(np.int64)
+        inside = np.all((cells >= 0) & (cells < self.envelope.shape[:2]), axis=1)
+
+        distance = np.full(len(inputs), np.inf)
+        bounds = self.envelope[cells[inside, 0], cells[inside, 1]]
+        size = inputs[inside, 2:4]
+        outside = np.maximum(bounds[:, :2] - size, size - bounds[:, 2:])
+        distance[inside] = np.maximum(outside.max(axis=1), 0)
+        return distance
+
+    @staticmethod
+    def model_path(path : str) -> str:
+        """ The model file of a dataset, e.g. Data/2024-Note/FullData_model.npz. """
+        return os.path.splitext(path)[0] + "_model.npz"
+
+    def save(self, path : str):
+        """ Saves the model next to the given path (usually the dataset's FullData.csv). """
+        np.savez(self.model_path(path), degree=self.degree, input_columns=np.array(self.input_columns),
+                 output_columns=np.array(self.output_columns), angle_period=np.nan if self.angle_period is None else self.angle_period,
+                 mean=self.mean, scale=self.scale, powers=self.powers, coefficients=self.coefficients,
+                 envelope=self.envelope, envelope_origin=self.envelope_origin)
+
+    @classmethod
+    def load(cls, path : str) -> "RegressionModel":
+        """ Loads a model saved next to the given path. """
+        with np.load(cls.model_path(path)) as model:
+            angle_period = float(model["angle_period"])
+            return cls(int(model["degree"]), model["input_columns"].tolist(), model["output_columns"].tolist(),
+                       None if np.isnan(angle_period) else angle_period, model["mean"], model["scale"],
+                       model["powers"], model["coefficients"], model["envelope"], model["envelope_origin"])
+
+
+def fit_model(data : np.ndarray, degree : int = 3) -> RegressionModel:
+    """
+    Fits a regression model to the rows of a dataset with least squares
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The dataset rows, as returned by dataset.load_dataset
+    degree : int
+        The polynomial degree, 3 fits the Note and Cone datasets to about 5 cm
+
+    Returns
+    -------
+    RegressionModel
+        The fitted model
+    """
+    columns = column_names(data)
+    input_columns = ['Center_X', 'Center_Y', 'Width', 'Height']
+    output_columns = ['x_position', 'y_position']
+    angle_period = None
+    if RegressionModel.ANGLE_INPUT in columns:
+        input_columns.append(RegressionModel.ANGLE_INPUT)
+    if RegressionModel.ANGLE_OUTPUT in columns:
+        output_columns.append(RegressionModel.ANGLE_OUTPUT)
+    if RegressionModel.ANGLE_INPUT in columns or RegressionModel.ANGLE_OUTPUT in columns:
+        # Symmetrical pieces are rendered over half a turn (2025 Coral), the others over a full turn
+        angles = columns_to_array(data, [column for column in (RegressionModel.ANGLE_INPUT, RegressionModel.ANGLE_OUTPUT) if column in columns])
+        angle_period = 180.0 if angles.max() < 180 else 360.0
+
+    inputs = columns_to_array(data, input_columns)
+    targets = columns_to_array(data, output_columns)
+    if RegressionModel.ANGLE_OUTPUT in output_columns:
+        radians = targets[:, -1] * (2 * np.pi / angle_period)
+        targets = np.column_stack((targets[:, :-1], np.sin(radians), np.cos(radians)))
+
+    expanded = RegressionModel.expand_inputs(inputs, input_columns, angle_period)
+    mean, scale = expanded.mean(axis=0), expanded.std(axis=0)
+    scale[~(scale > 0)] = 1
+    powers = RegressionModel.polynomial_powers(expanded.shape[1], degree)
+    model = RegressionModel(degree, input_columns, output_columns, angle_period, mean, scale, powers,
+                            np.zeros((len(powers), targets.shape[1])), *RegressionModel.build_envelope(inputs))
+    model.coefficients, *_ = np.linalg.lstsq(model.design_matrix(inputs), targets, rcond=None)
+    return model
+
+
+def build_model(csv_path : str, degree : int = 3, save : bool = True) -> RegressionModel:
+    """
+    Fits a regression model to a dataset and saves it next to the dataset, so that
+    the estimator can load the small model file instead of the dataset
+
+    Parameters
+    ----------
+    csv_path : str
+        The dataset, e.g. Data/2024-Note/FullData.csv
+    degree : int
+        The polynomial degree
+    save : bool
+        Whether to save the model next to the dataset
+
+    Returns
+    -------
+    RegressionModel
+        The fitted model
+    """
+    data = load_dataset(csv_path)
+    model = fit_model(data, degree)
+
+    errors = np.hypot(*(model.predict(columns_to_array(data, model.input_columns))[:, :2] - columns_to_array(data, ['x_position', 'y_position'])).T)
+    print("Fitted", len(model.powers), "terms, mean error", round(float(errors.mean()), 4), "m, p95", round(float(np.percentile(errors, 95)), 4), "m")
+    if save:
+        model.save(csv_path)
+    return model
+
+
+if __name__ == "__main__":
+    # Usage: python regression_model.py Data/2024-Note/FullData.csv [degree]
+    if len(sys.argv) < 2:
+        print("Usage: python regression_model.py <path to FullData.csv> [degree]")
+        sys.exit(1)
+    degree = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    model = build_model(sys.argv[1], degree)
+    print("Saved", RegressionModel.model_path(sys.argv[1]))
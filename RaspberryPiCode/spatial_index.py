@@ -0,0 +1,154 @@
+import numpy as np
+
+class GridIndex:
+    """
+    A uniform grid over the first two feature columns (the image center of the
+    bounding rectangle) used to look up dataset rows without scanning the whole table
+
+    Attributes
+    ----------
+    features : np.ndarray
+        The (N, D) feature matrix the index was built from, e.g.
+        (Center_X, Center_Y, Width, Height[, Image_angle])
+
+    cell_size : float
+        The side length of a grid cell, measured in the units of the first two columns
+
+    angle_period : float | None
+        If set, the last feature column is treated as an angle that wraps around
+        with this period (180 for the 2025 Coral image angle)
+
+    Methods
+    -------
+    within(point: np.ndarray, tolerance: float) -> np.ndarray
+        Returns the indices of all rows within an L-infinity tolerance of the point
+    nearest(point: np.ndarray, k: int, norm: float = np.inf) -> tuple[np.ndarray, np.ndarray]
+        Returns the indices and distances of the k rows closest to the point
+    """
+
+    # np.isclose(a, b, atol) tests |a - b| <= atol + rtol * |b| with this default rtol,
+    # the index keeps the same rule so its results match the original mask search
+    RTOL = 1e-05
+
+    def __init__(self, features : np.ndarray, cell_size : float = 40, angle_period : float | None = None):
+        self.features = np.ascontiguousarray(features, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        self.angle_period = angle_period
+
+        centers = self.features[:, :2]
+        self.origin = np.nanmin(centers, axis=0) if len(centers) else np.zeros(2)
+        cells = np.floor((centers - self.origin) / self.cell_size).astype(np.int64)
+        self.grid_shape = (cells.max(axis=0) + 1) if len(cells) else np.ones(2, dtype=np.int64)
+
+        # Sort the rows by cell so that every grid column (fixed x cell) is one
+        # contiguous run of rows, ordered by the y cell
+        cell_ids = cells[:, 0] * self.grid_shape[1] + cells[:, 1]
+        self.order = np.argsort(cell_ids, kind="stable")
+        self.sorted_features = self.features[self.order]
+        counts = np.bincount(cell_ids, minlength=int(np.prod(self.grid_shape)))
+        self.cell_start = np.concatenate(([0], np.cumsum(counts)))
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def _distances(self, candidates : np.ndarray, point : np.ndarray) -> np.ndarray:
+        """ Per-column absolute differences, wrapping the angle column if there is one (and the point has it). """
+        diff = np.abs(candidates - point)
+        if self.angle_period is not None and len(point) == self.features.shape[1]:
+            angle_diff = np.mod(diff[:, -1], self.angle_period)
+            diff[:, -1] = np.minimum(angle_diff, self.angle_period - angle_diff)
+        return diff
+
+    def _candidates(self, point : np.ndarray, radius : float) -> tuple[np.ndarray, bool]:
+        """
+        Collects the positions (into the sorted arrays) of every row whose grid cell
+        overlaps the square of the given radius around the point.
+
+        Returns
+        -------
+        tuple[np.ndarray, bool]
+            The candidate positions and whether the square covered the whole grid
+        """
+        low = np.floor((point[:2] - radius - self.origin) / self.cell_size).astype(np.int64)
+        high = np.floor((point[:2] + radius - self.origin) / self.cell_size).astype(np.int64)
+        covers_grid = bool(np.all(low <= 0) and np.all(high >= self.grid_shape - 1))
+        low = np.maximum(low, 0)
+        high = np.minimum(high, self.grid_shape - 1)
+        if np.any(low > high):
+            return np.empty(0, dtype=np.int64), covers_grid
+
+        ny = self.grid_shape[1]
+        runs = [
+            np.arange(self.cell_start[ix * ny + low[1]], self.cell_start[ix * ny + high[1] + 1])
+            for ix in range(low[0], high[0] + 1)
+        ]
+        return np.concatenate(runs), covers_grid
+
+    def within(self, point : np.ndarray, tolerance : float) -> np.ndarray:
+        """
+        Finds every row whose features are all within the tolerance of the point,
+        using the same rule as np.isclose(column, value, atol=tolerance)
+
+        Parameters
+        ----------
+        point : np.ndarray
+            The target feature values, one per column. It may leave out the last
+            columns (e.g. a rectangle without its image angle), only the columns it
+            has are compared
+        tolerance : float
+            The L-infinity tolerance
+
+        Returns
+        -------
+        np.ndarray
+            The matching row indices, in ascending order
+        """
+        point = np.asarray(point, dtype=np.float64)
+        limits = tolerance + self.RTOL * np.abs(point)
+        positions, _ = self._candidates(point, float(limits[:2].max()))
+        if len(positions) == 0:
+            return positions
+
+        diff = self._distances(self.sorted_features[positions, :len(point)], point)
+        mask = np.all(diff <= limits, axis=1)
+        return np.sort(self.order[positions[mask]])
+
+    @staticmethod
+    def _norm(diff : np.ndarray, norm : float) -> np.ndarray:
+        """ Reduces per-column differences to one distance per row. """
+        return np.linalg.norm(diff, ord=norm, axis=1)
+
+    def nearest(self, point : np.ndarray, k : int, norm : float = np.inf) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the k rows closest to the point
+
+        Parameters
+        ----------
+        point : np.ndarray
+            The target feature values, one per column
+        k : int
+            The number of rows to return
+        norm : float
+            The distance, np.inf for L-infinity or 2 for euclidean (any norm
+            at least as large as L-infinity keeps the search below correct)
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            The row indices and their distances, closest first
+        """
+        point = np.asarray(point, dtype=np.float64)
+        k = min(k, len(self))
+        radius = self.cell_size
+        while True:
+            positions, covers_grid = self._candidates(point, radius)
+            distances = self._norm(self._distances(self.sorted_features[positions], point), norm)
+            # Any row closer than the radius lies inside the searched square,
+            # so once k of them are found the answer is final
+            inside = distances <= radius
+            if np.count_nonzero(inside) >= k or covers_grid:
+                if not covers_grid:
+                    positions, distances = positions[inside], distances[inside]
+                closest = np.argsort(distances, kind="stable")[:k]
+                return self.order[positions[closest]], distances[closest]
+            radius *= 2
@@ -0,0 +1,107 @@
+import math
+import multiprocessing as mp
+import numpy as np
+
+class PipelineTelemetry:
+    """
+    Fixed size latency histograms and counters shared by all pipeline processes.
+
+    Every metric is a row of log-spaced histogram bins in shared memory, each
+    row is written by a single process so recording is one increment with no
+    locking. The network process takes snapshots and turns the difference
+    between two snapshots into percentiles for the last reporting window.
+
+    Attributes
+    ----------
+    metrics : list[str]
+        The names of the latency histograms, e.g. "detection" or "detection_wait"
+
+    counters : list[str]
+        The names of the event counters, e.g. "frames_dropped"
+
+    Methods
+    -------
+    record(metric: str, seconds: float)
+        Adds a duration to a histogram
+    count(counter: str, amount: int = 1)
+        Increments a counter
+    snapshot() -> tuple[np.ndarray, np.ndarray]
+        Returns a copy of all histogram and counter values
+    summary(previous, current) -> dict[str, float]
+        Computes the p50/p95/p99 latencies (in ms) and counts between two snapshots
+    """
+
+    # Bins are log spaced from 10 us to 10 s, about 11% apart
+    MIN_SECONDS = 1e-5
+    MAX_SECONDS = 10.0
+    BINS = 128
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, metrics : list[str], counters : list[str]):
+        self.metrics = {name : i for i, name in enumerate(metrics)}
+        self.counters = {name : i for i, name in enumerate(counters)}
+        self.histogram_buffer = mp.RawArray('q', len(metrics) * self.BINS)
+        self.counter_buffer = mp.RawArray('q', len(counters))
+        self._create_views()
+
+        self.scale = self.BINS / math.log(self.MAX_SECONDS / self.MIN_SECONDS)
+        # Upper edge of every bin, the percentiles are reported as the bin edge
+        self.bin_edges = self.MIN_SECONDS * np.exp((np.arange(self.BINS) + 1) / self.scale)
+
+    def _create_views(self):
+        self.histograms = np.frombuffer(self.histogram_buffer, dtype=np.int64).reshape(len(self.metrics), self.BINS)
+        self.counter_values = np.frombuffer(self.counter_buffer, dtype=np.int64)
+
+    def __getstate__(self):
+        # The numpy views cannot be pickled, they are recreated over the shared buffers
+        state = self.__dict__.copy()
+        del state['histograms'], state['counter_values']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._create_views()
+
+    def record(self, metric : str, seconds : float):
+        """ Adds a duration (in seconds) to a histogram. """
+        if seconds <= self.MIN_SECONDS:
+            bin_index = 0
+        else:
+            bin_index = min(int(math.log(seconds / self.MIN_SECONDS) * self.scale), self.BINS - 1)
+        self.histograms[self.metrics[metric], bin_index] += 1
+
+    def count(self, counter : str, amount : int = 1):
+        """ Increments a counter. """
+        self.counter_values[self.counters[counter]] += amount
+
+    def snapshot(self) -> tuple[np.ndarray, np.ndarray]:
+        """ Returns a copy of all histogram and counter values. """
+        return self.histograms.copy(), self.counter_values.copy()
+
+    def summary(self, previous : tuple[np.ndarray, np.ndarray], current : tuple[np.ndarray, np.ndarray]) -> dict[str, float]:
+        """
+        Computes the latencies and counts recorded between two snapshots
+
+        Returns
+        -------
+        dict[str, float]
+            "<metric>_p50_ms" style latencies for every metric that recorded
+            anything, "<metric>_count" sample counts and one entry per counter
+        """
+        histograms = current[0] - previous[0]
+        counters = current[1] - previous[1]
+
+        summary = {}
+        for name, row in self.metrics.items():
+            counts = histograms[row]
+            total = int(counts.sum())
+            summary[name + "_count"] = total
+            if total == 0:
+                continue
+            cumulative = np.cumsum(counts)
+            for percentile in self.PERCENTILES:
+                bin_index = int(np.searchsorted(cumulative, total * percentile / 100))
+                summary[f"{name}_p{percentile}_ms"] = float(self.bin_edges[bin_index] * 1000)
+        for name, index in self.counters.items():
+            summary[name] = int(counters[index])
+        return summary
@@ -0,0 +1,232 @@
+# Headless version of ProcessBlenderData.ipynb
+# Finds the bounding rectangle of the game piece in every Blender render and
+# writes it, together with the rendered position, to FullData.csv.
+#
+# The images are processed by a pool of worker processes and the rows are
+# written in image order as they complete. The CSV is its own checkpoint: an
+# interrupted run continues after the last complete row when started again.
+#
+# Usage (from the repository root):
+#   python SetUp/process_blender_data.py Data/Custom-Data/Images Data/Custom-Data/PositionData.txt Data/Custom-Data/FullData.csv
+#   python SetUp/process_blender_data.py <images> <positions> <csv> --angle --workers 8
+import argparse
+import csv
+import math
+import multiprocessing as mp
+import os
+import sys
+import time
+from functools import partial
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png')
+
+# Rows are flushed to disk (and so checkpointed) every this many images
+FLUSH_INTERVAL = 200
+
+SYMMETRICAL_HEADER = ['Image', 'Center_X', 'Center_Y', 'Width', 'Height', 'x_position', 'y_position']
+ANGLE_HEADER = ['Image', 'Center_X', 'Center_Y', 'Width', 'Height', 'Image_angle', 'x_position', 'y_position', 'angle']
+
+
+# Function to display progress in the console
+def update_progress(done, total, start_time):
+    progress = int(100 * done / total) if total else 100
+    bar_length = 50  # Total length of the progress bar
+    filled_length = int(bar_length * progress / 100)
+    bar = '#' * filled_length + '_' * (bar_length - filled_length)
+    sys.stdout.write('\r[{0}] {1}%  {2}/{3}  {4}s'.format(bar, progress, done, total, round(time.time() - start_time, 1)))
+    sys.stdout.flush()
+
+
+def find_contour(image, lower_bound, upper_bound):
+    """ Finds the largest contour of the game piece (rendered red), None if there is none. """
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    red_mask = cv2.inRange(hsv, lower_bound, upper_bound)
+    contours, _ = cv2.findContours(red_mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    return max(contours, key=cv2.contourArea)
+
+
+# Works by finding the two longest edges of the contour
+# and averaging their angles
+# Used for 2025 Coral
+def find_angle(contour):
+    """
+    Given a contour, find the two longest straight lines,
+    average their directions, and return the dominant angle in degrees.
+    """
+    if len(contour) < 2:
+        return None
+
+    # Simplify contour (remove small jitter)
+    epsilon = 0.01 * cv2.arcLength(contour, True)
+    approx = cv2.approxPolyDP(contour, epsilon, True)
+
+    # Collect line segments and their angles
+    lines = []
+    for i in range(len(approx)):
+        p1 = approx[i][0]
+        p2 = approx[(i + 1) % len(approx)][0]  # wrap around
+        dx = p2[0] - p1[0]
+        dy = p2[1] - p1[1]
+        length = math.hypot(dx, dy)
+        if length > 2:  # ignore tiny edges
+            lines.append((length, math.degrees(math.atan2(dy, dx))))
+
+    if len(lines) < 2:
+        return None
+
+    # Average the direction of the two longest lines, as a circular mean
+    # (avoid averaging 179° and -179° to get 0°)
+    lines.sort(reverse=True, key=lambda x: x[0])
+    angles = [math.radians(line[1]) for line in lines[:2]]
+    x_mean = np.mean([math.cos(a) for a in angles])
+    y_mean = np.mean([math.sin(a) for a in angles])
+    avg_angle = math.degrees(math.atan2(y_mean, x_mean))
+
+    return (avg_angle + 360 + 90) % 180  # normalize to [0, 180)
+
+
+def process_image(index, images_folder, extension, resolution, lower_bound, upper_bound, with_angle):
+    """
+    Finds the rectangle (and angle) of the game piece in render_<index>
+
+    Returns
+    -------
+    tuple[int, list | None]
+        The index and the image columns of its CSV row, None if the image could
+        not be read or has no game piece
+    """
+    image = cv2.imread(os.path.join(images_folder, "render_" + str(index) + "." + extension))
+    if image is None:
+        return index, None
+    image = cv2.resize(image, resolution, interpolation=cv2.INTER_LINEAR)
+
+    contour = find_contour(image, lower_bound, upper_bound)
+    if contour is None:
+        return index, None
+    x, y, w, h = cv2.boundingRect(contour)
+
+    if not with_angle:
+        return index, [x + w // 2, y + h // 2, w, h]
+
+    angle = find_angle(contour)
+    if angle is None:
+        return index, None
+    return index, [int(x + w / 2), int(y + h / 2), w, h, int(angle)]
+
+
+def read_positions(path):
+    """ Reads PositionData.txt, one "x, y" or "x, y, angle" line per render. """
+    positions = []
+    with open(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                positions.append([float(value) for value in line.strip().split(',')])
+    return positions
+
+
+def find_extension(images_folder):
+    """ The extension of the render images in the folder. """
+    for extension in IMAGE_EXTENSIONS:
+        if os.path.exists(os.path.join(images_folder, "render_0." + extension)):
+            return extension
+    raise FileNotFoundError(f"No render_0 image ({', '.join(IMAGE_EXTENSIONS)}) in {images_folder}")
+
+
+def resume_point(csv_path, header):
+    """
+    Prepares the CSV of an interrupted run to be continued
+
+    Keeps the complete rows, drops a partially written last line and returns
+    the index of the next image to process (0 when starting from scratch).
+    """
+    if not os.path.exists(csv_path):
+        return 0
+
+    with open(csv_path, 'r', newline='') as file:
+        content = file.read()
+    lines = content.split('\n')
+    if content and not content.endswith('\n'):
+        lines = lines[:-1]  # The last line was cut off in the middle
+    lines = [line for line in lines if line]
+    if not lines or next(csv.reader([lines[0]])) != header:
+        raise ValueError(f"{csv_path} exists with a different header, use --restart to overwrite it")
+
+    with open(csv_path, 'w', newline='') as file:
+        file.write('\n'.join(lines) + '\n')
+    if len(lines) == 1:
+        return 0
+    return int(next(csv.reader([lines[-1]]))[0]) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process Blender renders into a FullData.csv dataset")
+    parser.add_argument("images", help="Folder with the render_<N> images")
+    parser.add_argument("positions", help="PositionData.txt written by the Blender script")
+    parser.add_argument("output", help="The CSV to write, e.g. Data/Custom-Data/FullData.csv")
+    parser.add_argument("--angle", action="store_true", help="Non symmetrical game piece (Cone, Coral), also find the image angle")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--resolution", type=int, nargs=2, default=(1280, 720), help="Resolution the images are resized to")
+    parser.add_argument("--lower", type=int, nargs=3, default=(0, 20, 25), help="Lower HSV bound of the rendered game piece")
+    parser.add_argument("--upper", type=int, nargs=3, default=(30, 255, 255), help="Upper HSV bound of the rendered game piece")
+    parser.add_argument("--restart", action="store_true", help="Overwrite the CSV instead of continuing an interrupted run")
+    args = parser.parse_args()
+
+    positions = read_positions(args.positions)
+    extension = find_extension(args.images)
+    total_images = len([file for file in os.listdir(args.images) if file.endswith('.' + extension)])
+    print(f"Total images found: {total_images}, positions: {len(positions)}")
+    if total_images != len(positions):
+        print(f"Warning: Number of position data points ({len(positions)}) does not match number of images ({total_images}).")
+    total = min(total_images, len(positions))
+
+    if positions and len(positions[0]) != (3 if args.angle else 2):
+        print(f"Error: {args.positions} has {len(positions[0])} values per line, expected {3 if args.angle else 2}"
+              f"{'' if args.angle else ' (use --angle for non symmetrical game pieces)'}")
+        sys.exit(1)
+
+    header = ANGLE_HEADER if args.angle else SYMMETRICAL_HEADER
+    start = 0 if args.restart else resume_point(args.output, header)
+    if start > 0:
+        print(f"Continuing after image {start - 1}")
+
+    worker = partial(process_image, images_folder=args.images, extension=extension, resolution=tuple(args.resolution),
+                     lower_bound=np.array(args.lower), upper_bound=np.array(args.upper), with_angle=args.angle)
+    failed = []
+    start_time = time.time()
+    with open(args.output, 'w' if start == 0 else 'a', newline='') as csvfile:
+        csv_writer = csv.writer(csvfile)
+        if start == 0:
+            csv_writer.writerow(header)
+
+        # OpenCV's own threads would compete with the worker processes
+        with mp.Pool(args.workers, initializer=cv2.setNumThreads, initargs=(1,)) as pool:
+            # imap returns the results in image order while the pool runs ahead
+            for done, (index, columns) in enumerate(pool.imap(worker, range(start, total), chunksize=16), start + 1):
+                if columns is None:
+                    failed.append(index)
+                else:
+                    csv_writer.writerow([index] + columns + positions[index])
+                if done % FLUSH_INTERVAL == 0:
+                    csvfile.flush()
+                    os.fsync(csvfile.fileno())
+                    update_progress(done, total, start_time)
+    update_progress(total, total, start_time)
+    print()
+
+    # Validate the result against the position data
+    with open(args.output, 'r', newline='') as file:
+        rows = sum(1 for _ in file) - 1
+    if failed:
+        print(f"No game piece found in {len(failed)} images: {failed[:20]}{' ...' if len(failed) > 20 else ''}")
+    if rows != len(positions):
+        print(f"Error: {rows} rows written for {len(positions)} positions")
+        sys.exit(1)
+    print(f"Wrote {rows} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# Parallel headless version of the blender_render_script_*.py scripts
+# Renders the dataset images with several background Blender processes and
+# writes the PositionData.txt that SetUp/process_blender_data.py reads.
+#
+# The polygon filtered (x, y, rotation) grid is planned once into
+# <output>/RenderPlan.json, the index of an entry in the plan is the index of its
+# render_<index>.jpg image and of its PositionData.txt line. The renders still
+# missing are split between the workers, so an interrupted run continues where it
+# stopped when started again.
+#
+# Usage (from the repository root):
+#   python SetUp/render_dataset.py Data/Custom-Data/ImagesGenerator.blend Data/Custom-Data --object RING
+#   python SetUp/render_dataset.py <file.blend> <output> --object CORAL --rotation-range 180 --workers 4
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data", "blender_render_worker.py")
+
+# The grid used when planning a new dataset, the uniform grid of the blender_render_script_*.py scripts
+# (without a budget), or adaptive sampling with a budget (see Data/blender_render_worker.py)
+GRID_DEFAULTS = {"step": 0.05, "rotation_step": 5, "rotation_range": 0, "budget": None, "tolerance": 0.005, "levels": 3}
+
+# Seconds between two progress updates
+PROGRESS_INTERVAL = 2
+
+
+# Function to display progress in the console
+def update_progress(done, total, start_time):
+    progress = int(100 * done / total) if total else 100
+    bar_length = 50  # Total length of the progress bar
+    filled_length = int(bar_length * progress / 100)
+    bar = '#' * filled_length + '_' * (bar_length - filled_length)
+    sys.stdout.write('\r[{0}] {1}%  {2}/{3}  {4}s'.format(bar, progress, done, total, round(time.time() - start_time, 1)))
+    sys.stdout.flush()
+
+
+def image_path(output, index):
+    return os.path.join(output, "Images", f"render_{index}.jpg")
+
+
+def count_rendered(output):
+    return sum(1 for name in os.listdir(os.path.join(output, "Images")) if name.startswith("render_") and not name.endswith(".tmp.jpg"))
+
+
+def blender_command(args, threads, worker_arguments):
+    """ The command running the worker script inside a background Blender. """
+    return [args.blender, "-b", args.blend, "-t", str(threads), "--python", WORKER_SCRIPT, "--"] + worker_arguments
+
+
+def load_plan(args, plan_path):
+    """
+    Plans the grid with Blender if there is no plan yet (or --replan), otherwise
+    loads the existing one and checks it matches the grid arguments that were given
+    """
+    grid = {name: getattr(args, name) for name in GRID_DEFAULTS}
+    if args.replan or not os.path.exists(plan_path):
+        if args.object is None:
+            raise ValueError("--object is required to plan a new dataset")
+        grid = {name: GRID_DEFAULTS[name] if value is None else value for name, value in grid.items()}
+        worker_arguments = ["--plan", plan_path, "--object", args.object, "--plane", args.plane, "--step", str(grid["step"]),
+                            "--rotation-step", str(grid["rotation_step"]), "--rotation-range", str(grid["rotation_range"])]
+        if grid["budget"] is not None:
+            worker_arguments += ["--budget", str(grid["budget"]), "--tolerance", str(grid["tolerance"]), "--levels", str(grid["levels"])]
+        else:
+            grid["tolerance"] = grid["levels"] = None
+        print("Planning the render grid" if grid["budget"] is None else f"Planning at most {grid['budget']} adaptive renders")
+        subprocess.run(blender_command(args, 1, worker_arguments), check=True)
+
+    with open(plan_path, "r") as file:
+        plan = json.load(file)
+    if any(value is not None and plan.get(name) != value for name, value in grid.items()) or args.object not in (None, plan["object"]):
+        raise ValueError(f"{plan_path} was planned with a different grid or object, use --replan to start over")
+    return plan
+
+
+def write_positions(output, positions):
+    """ Writes PositionData.txt, line <index> holding the position of render_<index>. """
+    position_path = os.path.join(output, "PositionData.txt")
+    with open(position_path + ".tmp", "w") as file:
+        for position in positions:
+            file.write(", ".join(str(value) for value in position) + "\n")
+    os.replace(position_path + ".tmp", position_path)
+    return position_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the dataset images with parallel background Blender processes")
+    parser.add_argument("blend", help="The .blend file with the calibrated camera, the plane and the game piece")
+    parser.add_argument("output", help="The dataset folder, e.g. Data/Custom-Data")
+    parser.add_argument("--object", default=None, help="The game piece object (e.g. RING, CONE, CORAL), needed to plan a new dataset")
+    parser.add_argument("--plane", default="Plane", help="The field of view plane object")
+    parser.add_argument("--step", type=float, default=None, help="Grid step in Blender units (0.05)")
+    parser.add_argument("--rotation-step", type=int, default=None, help="Rotation step in degrees (5)")
+    parser.add_argument("--rotation-range", type=int, default=None, help="Rotations rendered per position (360 Cone, 180 Coral, 0 no rotation)")
+    parser.add_argument("--budget", type=int, default=None, help="Sample the grid adaptively, rendering at most this many images")
+    parser.add_argument("--tolerance", type=float, default=None, help="Largest position error (Blender units) between adaptive samples (0.005)")
+    parser.add_argument("--levels", type=int, default=None, help="The adaptive grid starts 2^levels steps wide (3)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 4), help="Number of Blender processes")
+    parser.add_argument("--engine", default="EEVEE", help="EEVEE (fast), CYCLES or WORKBENCH, the .blend's engine with KEEP")
+    parser.add_argument("--samples", type=int, default=8, help="Render samples, only the silhouette of the game piece is used")
+    parser.add_argument("--resolution", type=int, nargs=2, default=None, help="Render resolution, the .blend's resolution if not given")
+    parser.add_argument("--blender", default="blender", help="The Blender executable")
+    parser.add_argument("--replan", action="store_true", help="Plan the grid again, e.g. after moving the plane")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.join(args.output, "Images"), exist_ok=True)
+    shards_folder = os.path.join(args.output, "Shards")
+    os.makedirs(shards_folder, exist_ok=True)
+    plan_path = os.path.join(args.output, "RenderPlan.json")
+    plan = load_plan(args, plan_path)
+    total = len(plan["positions"])
+
+    # Images of an interrupted render, their final image was never written
+    for temporary_path in glob.glob(os.path.join(args.output, "Images", "render_*.tmp.jpg")):
+        os.remove(temporary_path)
+    pending = [index for index in range(total) if not os.path.exists(image_path(args.output, index))]
+    print(f"Planned renders: {total}, already rendered: {total - len(pending)}")
+
+    if pending:
+        # Every worker takes every N-th pending render, so they all get a similar
+        # mix of close (large, slow) and far renders and finish together
+        workers = min(args.workers, len(pending))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        processes = []
+        logs = []
+        try:
+            for worker in range(workers):
+                indices_path = os.path.join(shards_folder, f"indices_{worker}.txt")
+                with open(indices_path, "w") as file:
+                    file.write("\n".join(str(index) for index in pending[worker::workers]) + "\n")
+                worker_arguments = ["--plan", plan_path, "--indices", indices_path, "--output", args.output,
+                                    "--engine", args.engine, "--samples", str(args.samples)]
+                if args.resolution is not None:
+                    worker_arguments += ["--resolution"] + [str(value) for value in args.resolution]
+                logs.append(open(os.path.join(shards_folder, f"worker_{worker}.log"), "w"))
+                processes.append(subprocess.Popen(blender_command(args, threads, worker_arguments),
+                                                  stdout=logs[-1], stderr=subprocess.STDOUT))
+
+            start_time = time.time()
+            while any(process.poll() is None for process in processes):
+                update_progress(min(count_rendered(args.output), total), total, start_time)
+                time.sleep(PROGRESS_INTERVAL)
+            update_progress(min(count_rendered(args.output), total), total, start_time)
+            print()
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+                    process.wait()
+            for log in logs:
+                log.close()
+
+        failed = [worker for worker, process in enumerate(processes) if process.returncode != 0]
+        if failed:
+            print(f"Workers {failed} failed, see {shards_folder}/worker_<N>.log")
+
+    # Merge: every planned entry needs its image before the positions are written
+    missing = [index for index in range(total) if not os.path.exists(image_path(args.output, index))]
+    if missing:
+        print(f"Error: {len(missing)} renders are missing: {missing[:20]}{' ...' if len(missing) > 20 else ''}, run again to render them")
+        sys.exit(1)
+    print("Wrote", write_positions(args.output, plan["positions"]))
+
+
+if __name__ == "__main__":
+    main()